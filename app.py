@@ -2,384 +2,238 @@
 """
 Instagram Story Monitor Web App
 Deployable on Railway with user authentication and SQL database
+
+This is the web tier: create_app() builds what gunicorn serves
+(gunicorn 'app:create_app()'). Scraping lives in monitor.py and runs in
+worker.py, so web workers never import Selenium or start browsers.
 """
 
 import os
 import json
+import base64
+import heapq
+import queue
 import time
-import subprocess
-from datetime import datetime, timedelta
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
-from flask_sqlalchemy import SQLAlchemy
+from datetime import date, datetime, timedelta
+from functools import cache, partial
+from operator import itemgetter
+from types import SimpleNamespace
+from flask import Blueprint, Flask, Response, current_app, stream_with_context, render_template, request, redirect, url_for, flash, jsonify
+from sqlalchemy import case, func, select, tuple_, type_coerce
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException, WebDriverException
-import threading
-import uuid
-
-app = Flask(__name__)
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'your-secret-key-here')
-app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///instagram_monitor.db')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-# Initialize extensions
-db = SQLAlchemy(app)
+
+import click
+
+from events import EventHub
+from exports import CHUNK_ROWS, FORMATS, ExportUnavailable, export_chunks, gzip_chunks
+from db_pool import pin_writers_to_primary, read_replica, replica_from_env
+import migrations
+from models import (db, create_tables, init_app, BrowserSession, DailyStats, IngestEvent, MonitorJob, Story,
+                    StoryViewer, User, UserStats, Viewer)
+from store import (ARCHIVE_AFTER, archive_due, archived_links, archived_values, chunked, delete_user_data,
+                   rebuild_rollups, user_rollups, user_segments, view_cache, viewer_names)
+import telemetry
+
 login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = 'login'
-
-# Global variable to store active monitoring sessions
-active_monitors = {}
-
-# Database Models
-class User(UserMixin, db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(80), unique=True, nullable=False)
-    email = db.Column(db.String(120), unique=True, nullable=False)
-    password_hash = db.Column(db.String(120), nullable=False)
-    instagram_username = db.Column(db.String(80), nullable=True)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    
-    # Relationships
-    stories = db.relationship('Story', backref='user', lazy=True, cascade='all, delete-orphan')
-    viewers = db.relationship('Viewer', backref='user', lazy=True, cascade='all, delete-orphan')
-
-class Story(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    story_date = db.Column(db.String(20), nullable=False)  # YYYY-MM-DD format
-    total_views = db.Column(db.Integer, default=0)
-    total_likes = db.Column(db.Integer, default=0)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    last_checked = db.Column(db.DateTime, default=datetime.utcnow)
-    
-    # Relationships
-    story_viewers = db.relationship('StoryViewer', backref='story', lazy=True, cascade='all, delete-orphan')
-
-class Viewer(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    username = db.Column(db.String(80), nullable=False)
-    total_views = db.Column(db.Integer, default=0)
-    total_likes = db.Column(db.Integer, default=0)
-    first_seen = db.Column(db.DateTime, default=datetime.utcnow)
-    last_seen = db.Column(db.DateTime, default=datetime.utcnow)
-    
-    # Relationships
-    story_interactions = db.relationship('StoryViewer', backref='viewer', lazy=True, cascade='all, delete-orphan')
-
-class StoryViewer(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    story_id = db.Column(db.Integer, db.ForeignKey('story.id'), nullable=False)
-    viewer_id = db.Column(db.Integer, db.ForeignKey('viewer.id'), nullable=False)
-    has_viewed = db.Column(db.Boolean, default=False)
-    has_liked = db.Column(db.Boolean, default=False)
-    first_detected = db.Column(db.DateTime, default=datetime.utcnow)
-    last_updated = db.Column(db.DateTime, default=datetime.utcnow)
-    
-    # Unique constraint to prevent duplicates
-    __table_args__ = (db.UniqueConstraint('story_id', 'viewer_id', name='unique_story_viewer'),)
+login_manager.login_view = 'web.login'
+
+# Pages, API and CLI commands; create_app() registers them
+web = Blueprint('web', __name__, cli_group=None)
+
+def is_monitoring(user_id):
+    """Check whether a user has an active monitoring job"""
+    return db.session.query(
+        MonitorJob.query.filter_by(user_id=user_id, status='active').exists()
+    ).scalar()
+
+def request_monitoring(user):
+    """Mark a user's monitoring job active so a worker picks it up"""
+    job = MonitorJob.query.filter_by(user_id=user.id).first()
+    if job and job.status == 'active':
+        return False
+    if not job:
+        job = MonitorJob(user_id=user.id)
+        db.session.add(job)
+    job.instagram_username = user.instagram_username
+    job.status = 'active'
+    job.updated_at = datetime.utcnow()
+    db.session.commit()
+    view_cache.bump(user.id)
+    return True
+
+def cancel_monitoring(user_id):
+    """Mark a user's monitoring job stopped; its worker stops it on the next heartbeat"""
+    stopped = MonitorJob.query.filter_by(user_id=user_id, status='active').update(
+        {'status': 'stopped', 'updated_at': datetime.utcnow()}
+    )
+    # A stopped account's Instagram session should not outlive its job
+    BrowserSession.query.filter_by(user_id=user_id).delete()
+    db.session.commit()
+    view_cache.bump(user_id)
+    return stopped > 0
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
-
-class InstagramMonitor:
-    def __init__(self, user_id, instagram_username):
-        self.user_id = user_id
-        self.instagram_username = instagram_username
-        self.driver = None
-        self.is_running = False
-        self.session_id = str(uuid.uuid4())
-        
-    def setup_chrome(self):
-        """Setup Chrome with stability options"""
-        try:
-            subprocess.run(["taskkill", "/f", "/im", "chrome.exe"], 
-                          capture_output=True, check=False)
-            time.sleep(2)
-        except:
-            pass
-        
-        options = Options()
-        options.add_argument("--no-sandbox")
-        options.add_argument("--disable-dev-shm-usage")
-        options.add_argument("--disable-gpu")
-        options.add_argument("--log-level=3")
-        options.add_argument("--disable-logging")
-        options.add_experimental_option('excludeSwitches', ['enable-logging'])
-        options.add_experimental_option('useAutomationExtension', False)
-        options.add_argument("--disable-extensions")
-        options.add_argument("--headless")  # Run headless for server deployment
-        
-        try:
-            self.driver = webdriver.Chrome(options=options)
-            return True
-        except Exception as e:
-            print(f"Chrome setup failed: {e}")
-            return False
-    
-    def wait_for_login(self):
-        """Simulate login wait - in production, implement proper OAuth"""
-        try:
-            self.driver.get("https://www.instagram.com/")
-            time.sleep(5)
-            
-            # For now, return True - in production, implement proper login flow
-            return True
-            
-        except Exception as e:
-            print(f"Login error: {e}")
-            return False
-    
-    def go_to_profile(self):
-        """Go to user's Instagram profile"""
-        try:
-            self.driver.get(f"https://www.instagram.com/{self.instagram_username}/")
-            time.sleep(3)
-            
-            # Look for story ring
-            story_selectors = [
-                "canvas[height='77'][width='77']",
-                "canvas[height='56'][width='56']",
-                "div[role='button'] canvas"
-            ]
-            
-            for selector in story_selectors:
-                try:
-                    canvas_elements = self.driver.find_elements(By.CSS_SELECTOR, selector)
-                    for canvas in canvas_elements:
-                        if canvas.is_displayed():
-                            parent = canvas.find_element(By.XPATH, "..")
-                            self.driver.execute_script("arguments[0].click();", parent)
-                            time.sleep(3)
-                            return True
-                except:
-                    continue
-            
-            return False
-            
-        except Exception as e:
-            print(f"Error going to profile: {e}")
-            return False
-    
-    def get_story_data(self):
-        """Get story viewers and likes"""
-        try:
-            # Find "Seen by X" element
-            seen_by_selectors = [
-                "//span[contains(text(), 'Seen by')]",
-                "//button[contains(text(), 'Seen by')]",
-                "//*[contains(text(), 'Seen by')]"
-            ]
-            
-            seen_by_element = None
-            for selector in seen_by_selectors:
-                try:
-                    elements = self.driver.find_elements(By.XPATH, selector)
-                    for element in elements:
-                        if element.is_displayed():
-                            text = element.text.strip()
-                            if 'seen by' in text.lower() and any(char.isdigit() for char in text):
-                                seen_by_element = element
-                                break
-                    if seen_by_element:
-                        break
-                except:
-                    continue
-            
-            if not seen_by_element:
-                return {"viewers": [], "likes": []}
-            
-            # Click to see viewers
-            self.driver.execute_script("arguments[0].click();", seen_by_element)
-            time.sleep(3)
-            
-            # Extract viewers and likes
-            viewers = []
-            likes = []
-            
-            # Look for viewer elements
-            viewer_selectors = [
-                "a[href*='/'][role='link']",
-                "a[href*='/']"
-            ]
-            
-            for selector in viewer_selectors:
-                try:
-                    elements = self.driver.find_elements(By.CSS_SELECTOR, selector)
-                    for element in elements:
-                        if element.is_displayed():
-                            href = element.get_attribute('href') or ''
-                            text = element.text.strip()
-                            
-                            # Extract username from href
-                            username = None
-                            if href and '/p/' not in href and '/' in href:
-                                parts = href.split('/')
-                                for part in parts:
-                                    if (part and 
-                                        part not in ['www.instagram.com', 'instagram.com', 'stories', 'highlights'] and
-                                        not part.startswith('http')):
-                                        username = part
-                                        break
-                            
-                            if not username and text and self.is_valid_username(text):
-                                username = text
-                            
-                            if username and username != self.instagram_username and username not in viewers:
-                                viewers.append(username)
-                                
-                                # Check if this viewer has liked the story
-                                try:
-                                    # Look for heart icon near this viewer
-                                    parent = element.find_element(By.XPATH, "../..")
-                                    heart_elements = parent.find_elements(By.CSS_SELECTOR, "[data-testid='heart'], .heart, [aria-label*='like'], [aria-label*='Like']")
-                                    if heart_elements:
-                                        likes.append(username)
-                                except:
-                                    pass
-                except:
-                    continue
-            
-            return {"viewers": viewers, "likes": likes}
-            
-        except Exception as e:
-            print(f"Error getting story data: {e}")
-            return {"viewers": [], "likes": []}
-    
-    def is_valid_username(self, text):
-        """Check if text looks like a valid Instagram username"""
-        if not text or len(text) < 1 or len(text) > 30:
-            return False
-        if not any(char.isalpha() for char in text):
-            return False
-        if text.isdigit() or ' ' in text:
-            return False
-        if text.startswith('http') or text in ['https:', 'www.', '.com']:
-            return False
-        return True
-    
-    def update_database(self, story_data):
-        """Update database with story data - no duplicate counting"""
-        try:
-            story_date = datetime.now().strftime("%Y-%m-%d")
-            
-            # Get or create story record
-            story = Story.query.filter_by(user_id=self.user_id, story_date=story_date).first()
-            if not story:
-                story = Story(user_id=self.user_id, story_date=story_date)
-                db.session.add(story)
-                db.session.commit()
-            
-            # Update story last checked time
-            story.last_checked = datetime.utcnow()
-            
-            # Process viewers
-            for viewer_username in story_data["viewers"]:
-                # Get or create viewer record
-                viewer = Viewer.query.filter_by(user_id=self.user_id, username=viewer_username).first()
-                if not viewer:
-                    viewer = Viewer(user_id=self.user_id, username=viewer_username)
-                    db.session.add(viewer)
-                    db.session.commit()
-                
-                # Update viewer last seen
-                viewer.last_seen = datetime.utcnow()
-                
-                # Get or create story-viewer relationship (prevents duplicates)
-                story_viewer = StoryViewer.query.filter_by(story_id=story.id, viewer_id=viewer.id).first()
-                if not story_viewer:
-                    story_viewer = StoryViewer(story_id=story.id, viewer_id=viewer.id, has_viewed=True)
-                    db.session.add(story_viewer)
-                    
-                    # Only increment counts for NEW viewers (no duplicates)
-                    viewer.total_views += 1
-                else:
-                    # Update existing record
-                    story_viewer.has_viewed = True
-                    story_viewer.last_updated = datetime.utcnow()
-            
-            # Process likes
-            for liker_username in story_data["likes"]:
-                viewer = Viewer.query.filter_by(user_id=self.user_id, username=liker_username).first()
-                if viewer:
-                    story_viewer = StoryViewer.query.filter_by(story_id=story.id, viewer_id=viewer.id).first()
-                    if story_viewer and not story_viewer.has_liked:
-                        story_viewer.has_liked = True
-                        story_viewer.last_updated = datetime.utcnow()
-                        
-                        # Only increment like count if not already liked
-                        viewer.total_likes += 1
-            
-            # Update story totals
-            story.total_views = len(StoryViewer.query.filter_by(story_id=story.id, has_viewed=True).all())
-            story.total_likes = len(StoryViewer.query.filter_by(story_id=story.id, has_liked=True).all())
-            
-            db.session.commit()
-            
-        except Exception as e:
-            print(f"Database update error: {e}")
-            db.session.rollback()
-    
-    def monitor_loop(self):
-        """Main monitoring loop"""
-        self.is_running = True
-        
-        try:
-            if not self.setup_chrome():
-                return
-            
-            if not self.wait_for_login():
-                return
-            
-            while self.is_running:
-                try:
-                    if self.go_to_profile():
-                        story_data = self.get_story_data()
-                        if story_data["viewers"]:
-                            self.update_database(story_data)
-                    
-                    # Wait 5 minutes before next check
-                    for _ in range(300):  # 5 minutes = 300 seconds
-                        if not self.is_running:
-                            break
-                        time.sleep(1)
-                        
-                except Exception as e:
-                    print(f"Monitor loop error: {e}")
-                    time.sleep(60)
-                    
-        except Exception as e:
-            print(f"Monitor error: {e}")
-        finally:
-            self.cleanup()
-    
-    def stop(self):
-        """Stop monitoring"""
-        self.is_running = False
+    # Read on every request: a copy kept across requests would outlive profile edits made in other processes
+    user = db.session.get(User, int(user_id))
+    return SessionUser(user) if user else None
+
+class SessionUser(UserMixin):
+    """The logged-in user's fields, detached from the database session
+
+    read_replica rolls back and expunges the session before retrying a view
+    on the primary, which would leave a User row unusable as current_user.
+    """
+    def __init__(self, user):
+        self.id = user.id
+        self.username = user.username
+        self.email = user.email
+        self.instagram_username = user.instagram_username
+        self.created_at = user.created_at
+
+def _snapshot(row, fields):
+    """Detached, picklable copy of the given attributes of an ORM row"""
+    return SimpleNamespace(**{field: getattr(row, field) for field in fields})
+
+@web.cli.command('rebuild-rollups')
+@click.option('--user-id', type=int, default=None, help='Only rebuild this user (default: all users)')
+def rebuild_rollups_command(user_id):
+    """Backfill analytics rollups from the raw story tables."""
+    user_ids = [user_id] if user_id else [row.id for row in db.session.execute(select(User.id))]
+    for uid in user_ids:
+        rebuild_rollups(uid)
+    print(f"Rebuilt rollups for {len(user_ids)} user(s)")
+
+@web.cli.command('db-upgrade')
+def db_upgrade_command():
+    """Apply pending schema migrations (see migrations.py)."""
+    db.create_all()
+    merged_users = migrations.upgrade(db.engine)
+    # Merging duplicate rows changes counts the rollups were built from, and history
+    # from before the rollups existed has none yet
+    missing_users = db.session.execute(
+        select(Story.user_id).distinct().where(Story.user_id.not_in(select(UserStats.user_id)))
+    ).scalars().all()
+    for uid in set(merged_users) | set(missing_users):
+        rebuild_rollups(uid)
+    print(f"Schema at version {migrations.current_version(db.engine)}")
+
+def hot_queries():
+    """The lookups run on every ingest and analytics page, with the index each should use"""
+    today = datetime.now().date()
+    return [
+        ('viewer ids by name',
+         select(Viewer.id, Viewer.username).where(Viewer.user_id == 1, Viewer.username.in_(['a', 'b'])),
+         'ix_viewer_user_username'),
+        ('story of the day',
+         select(Story.id).where(Story.user_id == 1, Story.story_date == today),
+         'ix_story_user_date'),
+        ('story view/like counts',
+         select(func.count(case((StoryViewer.has_viewed.is_(True), 1))),
+                func.count(case((StoryViewer.has_liked.is_(True), 1))))
+         .where(StoryViewer.story_id == 1),
+         'ix_story_viewer_flags'),
+        ('top viewers',
+         select(Viewer.id).where(Viewer.user_id == 1)
+         .order_by(Viewer.total_views.desc(), Viewer.id.desc()).limit(50),
+         'ix_viewer_user_views'),
+    ]
+
+@web.cli.command('check-indexes')
+def check_indexes_command():
+    """EXPLAIN the hot queries and fail if one does not use its index."""
+    failed = 0
+    for name, stmt, index in hot_queries():
+        compiled = stmt.compile(db.engine, compile_kwargs={'literal_binds': True})
+        plan = migrations.explain(db.engine, compiled)
+        ok = index in plan
+        failed += 0 if ok else 1
+        print(f"{'ok  ' if ok else 'FAIL'} {name}: expected {index}")
+        if not ok:
+            print(f"     plan: {plan}")
+    if failed:
+        raise SystemExit(1)
+
+@web.cli.command('archive-stories')
+@click.option('--user-id', type=int, default=None, help='Only archive this user (default: all users)')
+@click.option('--older-than', type=int, default=None, help='Age in days (default: ARCHIVE_AFTER_DAYS)')
+def archive_stories_command(user_id, older_than):
+    """Move old story-viewer history into compressed archive segments."""
+    after = timedelta(days=older_than) if older_than is not None else ARCHIVE_AFTER
+    if after is None:
+        raise click.ClickException('archiving is off (ARCHIVE_AFTER_DAYS=off); pass --older-than')
+    segments, links = archive_due(after, user_id)
+    print(f"Archived {links} story-viewer row(s) into {segments} segment(s)")
+
+@web.cli.command('delete-user')
+@click.option('--user-id', type=int, required=True)
+@click.confirmation_option(prompt='Delete this user and all of their history?')
+def delete_user_command(user_id):
+    """Delete a user and everything recorded for them."""
+    if db.session.get(User, user_id) is None:
+        raise click.ClickException(f'no user {user_id}')
+    delete_user_data(user_id)
+    audience_store().forget(user_id)
+    print(f"Deleted user {user_id}")
+
+# Audience analytics (loyalty, churn, cohorts, overlap) over per-user bitmaps; see audience.py
+def _audience_stories(user_id):
+    return [tuple(row) for row in db.session.execute(
+        select(Story.id, Story.story_date, Story.last_checked)
+        .where(Story.user_id == user_id).order_by(Story.story_date, Story.id)
+    )]
+
+def _audience_links(story_ids):
+    import numpy as np
+    # Core rows straight into one array: building ORM rows would dominate a full load
+    liked = type_coerce(func.coalesce(StoryViewer.has_liked, False), db.Integer)
+    links = [np.fromiter((tuple(row) for row in db.session.connection().execute(
+                 select(StoryViewer.story_id, StoryViewer.viewer_id, liked)
+                 .where(StoryViewer.story_id.in_(chunk), StoryViewer.has_viewed.is_(True))
+             )), dtype=np.dtype((np.int64, 3)))
+             for chunk in chunked(story_ids)]
+    links = np.concatenate(links) if links else np.zeros((0, 3), dtype=np.int64)
+    archived = archived_links(story_ids)
+    archived = archived[archived['has_viewed']]
+    return (np.concatenate([links[:, 0], archived['story_id']]),
+            np.concatenate([links[:, 1], archived['viewer_id']]),
+            np.concatenate([links[:, 2].astype(bool), archived['has_liked']]))
+
+def _record_audience_sync(kind, seconds, stories):
+    telemetry.audience_sync_seconds.observe(seconds, kind=kind)
+    telemetry.audience_stories_loaded_total.inc(stories)
+
+@cache
+def audience_store():
+    """The process's audience matrices, set up on first use: audience.py pulls in numpy"""
+    from audience import audience_store_from_env
+    return audience_store_from_env(_audience_stories, _audience_links, on_sync=_record_audience_sync)
+
+def _audience_view(user_id, period='month'):
+    # The rollup changes with every ingest, so an unchanged one skips the sync
+    stats_row = db.session.get(UserStats, user_id)
+    version = stats_row.updated_at if stats_row else None
+    report = audience_store().report(user_id, version, period)
     
-    def cleanup(self):
-        """Clean shutdown"""
-        try:
-            if self.driver:
-                self.driver.quit()
-        except:
-            pass
+    viewer_lists = (report['loyalty']['top'], report['lapsed']['top'])
+    names = dict(db.session.execute(
+        select(Viewer.id, Viewer.username)
+        .where(Viewer.id.in_({row['viewer_id'] for rows in viewer_lists for row in rows}))
+    ).all())
+    for rows in viewer_lists:
+        for row in rows:
+            row['username'] = names.get(row['viewer_id'])
+    return report
 
 # Routes
-@app.route('/')
+@web.route('/')
 def index():
     if current_user.is_authenticated:
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('web.dashboard'))
     return render_template('index.html')
 
-@app.route('/register', methods=['GET', 'POST'])
+@web.route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
         username = request.form['username']
@@ -390,11 +244,11 @@ def register():
         # Check if user exists
         if User.query.filter_by(username=username).first():
             flash('Username already exists')
-            return redirect(url_for('register'))
+            return redirect(url_for('web.register'))
         
         if User.query.filter_by(email=email).first():
             flash('Email already exists')
-            return redirect(url_for('register'))
+            return redirect(url_for('web.register'))
         
         # Create new user
         user = User(
@@ -408,11 +262,11 @@ def register():
         db.session.commit()
         
         flash('Registration successful')
-        return redirect(url_for('login'))
+        return redirect(url_for('web.login'))
     
     return render_template('register.html')
 
-@app.route('/login', methods=['GET', 'POST'])
+@web.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         username = request.form['username']
@@ -422,133 +276,541 @@ def login():
         
         if user and check_password_hash(user.password_hash, password):
             login_user(user)
-            return redirect(url_for('dashboard'))
+            return redirect(url_for('web.dashboard'))
         else:
             flash('Invalid username or password')
     
     return render_template('login.html')
 
-@app.route('/logout')
+@web.route('/logout')
 @login_required
 def logout():
     # Stop monitoring if active
-    if current_user.id in active_monitors:
-        active_monitors[current_user.id].stop()
-        del active_monitors[current_user.id]
+    cancel_monitoring(current_user.id)
     
     logout_user()
-    return redirect(url_for('index'))
+    return redirect(url_for('web.index'))
 
-@app.route('/dashboard')
+@web.route('/dashboard')
 @login_required
+@read_replica
 def dashboard():
-    # Get user's stories and analytics
-    stories = Story.query.filter_by(user_id=current_user.id).order_by(Story.story_date.desc()).limit(7).all()
-    viewers = Viewer.query.filter_by(user_id=current_user.id).order_by(Viewer.total_views.desc()).limit(10).all()
-    
-    # Check if monitoring is active
-    is_monitoring = current_user.id in active_monitors
+    # Get user's stories and analytics from the rollups (cached per user)
+    view = view_cache.get_or_compute(current_user.id, 'dashboard', lambda: _dashboard_view(current_user.id))
     
     return render_template('dashboard.html', 
-                         stories=stories, 
-                         viewers=viewers, 
-                         is_monitoring=is_monitoring,
+                         stats=view['stats'],
+                         stories=view['stories'], 
+                         viewers=view['viewers'], 
+                         is_monitoring=view['is_monitoring'],
                          instagram_username=current_user.instagram_username)
 
-@app.route('/start_monitoring', methods=['POST'])
+def _dashboard_view(user_id):
+    stats = user_rollups(user_id)
+    stories = DailyStats.query.filter_by(user_id=user_id).order_by(DailyStats.story_date.desc()).limit(7).all()
+    return {
+        'stats': _snapshot(stats, ('total_stories', 'unique_viewers', 'total_views', 'total_likes')),
+        'stories': [_snapshot(story, ('story_date', 'total_views', 'total_likes', 'last_checked'))
+                    for story in stories],
+        'viewers': stats.top_viewer_rows()[:10],
+        'is_monitoring': is_monitoring(user_id),
+    }
+
+@web.route('/start_monitoring', methods=['POST'])
 @login_required
 def start_monitoring():
     if not current_user.instagram_username:
         flash('Please set your Instagram username in profile settings')
-        return redirect(url_for('profile'))
+        return redirect(url_for('web.profile'))
     
-    if current_user.id not in active_monitors:
-        monitor = InstagramMonitor(current_user.id, current_user.instagram_username)
-        active_monitors[current_user.id] = monitor
-        
-        # Start monitoring in background thread
-        thread = threading.Thread(target=monitor.monitor_loop)
-        thread.daemon = True
-        thread.start()
-        
+    # A worker process (worker.py) claims the job and runs the monitor
+    if request_monitoring(current_user):
         flash('Monitoring started successfully!')
     else:
         flash('Monitoring is already active')
     
-    return redirect(url_for('dashboard'))
+    return redirect(url_for('web.dashboard'))
 
-@app.route('/stop_monitoring', methods=['POST'])
+@web.route('/stop_monitoring', methods=['POST'])
 @login_required
 def stop_monitoring():
-    if current_user.id in active_monitors:
-        active_monitors[current_user.id].stop()
-        del active_monitors[current_user.id]
+    if cancel_monitoring(current_user.id):
         flash('Monitoring stopped')
     else:
         flash('No active monitoring session')
     
-    return redirect(url_for('dashboard'))
+    return redirect(url_for('web.dashboard'))
 
-@app.route('/profile', methods=['GET', 'POST'])
+@web.route('/profile', methods=['GET', 'POST'])
 @login_required
 def profile():
     if request.method == 'POST':
-        current_user.instagram_username = request.form['instagram_username']
+        # current_user is a detached copy (SessionUser); update the row itself
+        user = db.session.get(User, current_user.id)
+        user.instagram_username = request.form['instagram_username']
+        if user.monitor_job:
+            user.monitor_job.instagram_username = user.instagram_username
         db.session.commit()
+        view_cache.bump(user.id)
         flash('Profile updated successfully')
-        return redirect(url_for('profile'))
+        return redirect(url_for('web.profile'))
     
     return render_template('profile.html')
 
-@app.route('/analytics')
+@web.route('/analytics')
 @login_required
+@read_replica
 def analytics():
-    # Get detailed analytics
-    stories = Story.query.filter_by(user_id=current_user.id).order_by(Story.story_date.desc()).all()
-    viewers = Viewer.query.filter_by(user_id=current_user.id).order_by(Viewer.total_views.desc()).all()
+    # Detailed analytics, read from the rollups only
+    # Story and viewer tables and the trend chart load lazily from /api/v1
+    view = view_cache.get_or_compute(current_user.id, 'analytics', lambda: _analytics_view(current_user.id))
     
-    # Calculate statistics
-    total_stories = len(stories)
-    total_unique_viewers = len(viewers)
-    total_views = sum(viewer.total_views for viewer in viewers)
-    total_likes = sum(viewer.total_likes for viewer in viewers)
-    
-    return render_template('analytics.html',
-                         stories=stories,
-                         viewers=viewers,
-                         total_stories=total_stories,
-                         total_unique_viewers=total_unique_viewers,
-                         total_views=total_views,
-                         total_likes=total_likes)
-
-@app.route('/api/stats')
+    return render_template('analytics.html', **view)
+
+def _analytics_view(user_id):
+    stats = user_rollups(user_id)
+    return {
+        'viewers': stats.top_viewer_rows(),
+        'total_stories': stats.total_stories,
+        'total_unique_viewers': stats.unique_viewers,
+        'total_views': stats.total_views,
+        'total_likes': stats.total_likes,
+    }
+
+@web.route('/api/stats')
 @login_required
+@read_replica
 def api_stats():
     """API endpoint for real-time stats"""
-    stories = Story.query.filter_by(user_id=current_user.id).order_by(Story.story_date.desc()).limit(7).all()
+    view = view_cache.get_or_compute(current_user.id, 'api_stats', lambda: _api_stats_view(current_user.id))
+    if request.if_none_match.contains(view['etag']):
+        return '', 304, {'ETag': f'"{view["etag"]}"', 'Cache-Control': 'private, no-cache'}
+    
+    response = jsonify(view['stats'])
+    response.set_etag(view['etag'])
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def _api_stats_view(user_id):
+    # The rollup only changes on ingest, so its timestamp is a cheap validator
+    stats_row = db.session.get(UserStats, user_id)
+    version = stats_row.updated_at.timestamp() if stats_row and stats_row.updated_at else 0
+    stories = DailyStats.query.filter_by(user_id=user_id).order_by(DailyStats.story_date.desc()).limit(7).all()
     
     stats = []
     for story in stories:
         stats.append({
-            'date': story.story_date,
+            'date': story.story_date.isoformat(),
             'views': story.total_views,
             'likes': story.total_likes
         })
+    return {'etag': f"{user_id}-{version}", 'stats': stats}
+
+# Versioned JSON API
+# Responses are column-oriented ({"fields": [...], "rows": [[...], ...], "next": cursor})
+# and paginated with opaque keyset cursors, so page cost does not grow with history.
+API_PAGE_LIMIT = 50
+API_MAX_PAGE_LIMIT = 500
+
+STORY_FIELDS = {
+    'id': Story.id,
+    'date': Story.story_date,
+    'views': Story.total_views,
+    'likes': Story.total_likes,
+    'last_checked': Story.last_checked,
+}
+VIEWER_FIELDS = {
+    'id': Viewer.id,
+    'username': Viewer.username,
+    'views': Viewer.total_views,
+    'likes': Viewer.total_likes,
+    'first_seen': Viewer.first_seen,
+    'last_seen': Viewer.last_seen,
+}
+VIEWER_SORTS = {
+    'views': Viewer.total_views,
+    'likes': Viewer.total_likes,
+    'last_seen': Viewer.last_seen,
+}
+STORY_VIEWER_FIELDS = {
+    'id': StoryViewer.id,
+    'username': Viewer.username,
+    'viewed': StoryViewer.has_viewed,
+    'liked': StoryViewer.has_liked,
+    'first_detected': StoryViewer.first_detected,
+    'last_updated': StoryViewer.last_updated,
+}
+
+class ApiError(Exception):
+    """Bad API request, reported as a JSON 400"""
+
+@web.app_errorhandler(ApiError)
+def handle_api_error(error):
+    return jsonify({'error': str(error)}), 400
+
+def _json_value(value):
+    return value.isoformat() if isinstance(value, (datetime, date)) else value
+
+def encode_cursor(values):
+    raw = json.dumps([_json_value(v) for v in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor, columns):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError
+        return [datetime.fromisoformat(v) if isinstance(column.type, db.DateTime)
+                else date.fromisoformat(v) if isinstance(column.type, db.Date) else v
+                for v, column in zip(values, columns)]
+    except (ValueError, TypeError):
+        raise ApiError('invalid cursor')
+
+def page_args(fields, keyset):
+    """(field names, limit, keyset values after the cursor or None) of a page request"""
+    requested = request.args.get('fields')
+    names = requested.split(',') if requested else list(fields)
+    unknown = [name for name in names if name not in fields]
+    if unknown:
+        raise ApiError(f"unknown fields: {', '.join(unknown)}")
+    try:
+        limit = min(max(int(request.args.get('limit', API_PAGE_LIMIT)), 1), API_MAX_PAGE_LIMIT)
+    except ValueError:
+        raise ApiError('limit must be an integer')
+    cursor = request.args.get('cursor')
+    return names, limit, decode_cursor(cursor, keyset) if cursor else None
+
+def api_page(stmt, fields, keyset, descending=True):
+    """Run one keyset page of ``stmt`` with the requested sparse fields
+
+    ``keyset`` lists the sort columns, ending with a unique id column.
+    """
+    names, limit, after = page_args(fields, keyset)
+    if after:
+        key, bound = tuple_(*keyset), tuple_(*after)
+        stmt = stmt.where(key < bound if descending else key > bound)
     
-    return jsonify(stats)
+    stmt = stmt.add_columns(*(fields[name] for name in names), *keyset)
+    stmt = stmt.order_by(*(column.desc() if descending else column.asc() for column in keyset))
+    rows = db.session.execute(stmt.limit(limit + 1)).all()
+    return page_response(names, rows, limit)
+
+def page_response(names, rows, limit):
+    """JSON page of up to ``limit`` rows, each the requested fields followed by its keyset values"""
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][len(names):])
+    
+    return jsonify({
+        'fields': names,
+        'rows': [[_json_value(v) for v in row[:len(names)]] for row in rows],
+        'next': next_cursor,
+    })
+
+@web.route('/api/v1/stories')
+@login_required
+def api_stories():
+    """Stories, newest first"""
+    stmt = select().select_from(Story).where(Story.user_id == current_user.id)
+    return api_page(stmt, STORY_FIELDS, [Story.story_date, Story.id])
+
+@web.route('/api/v1/viewers')
+@login_required
+def api_viewers():
+    """Viewers sorted by views, likes or last_seen (descending)"""
+    sort = request.args.get('sort', 'views')
+    if sort not in VIEWER_SORTS:
+        raise ApiError(f"sort must be one of: {', '.join(VIEWER_SORTS)}")
+    stmt = select().select_from(Viewer).where(Viewer.user_id == current_user.id)
+    return api_page(stmt, VIEWER_FIELDS, [VIEWER_SORTS[sort], Viewer.id])
+
+@web.route('/api/v1/stories/<int:story_id>/viewers')
+@login_required
+def api_story_viewers(story_id):
+    """Viewers of one story, in detection order"""
+    story = Story.query.filter_by(id=story_id, user_id=current_user.id).first_or_404()
+    if story.archive_id is not None:
+        return _archived_story_viewers(story)
+    stmt = (select().select_from(StoryViewer)
+            .join(Viewer, Viewer.id == StoryViewer.viewer_id)
+            .where(StoryViewer.story_id == story_id))
+    return api_page(stmt, STORY_VIEWER_FIELDS, [StoryViewer.id], descending=False)
+
+def _archived_story_viewers(story):
+    """The same pages as api_story_viewers, read from the story's archive segment"""
+    from archive import link_rows
+    names, limit, after = page_args(STORY_VIEWER_FIELDS, [StoryViewer.id])
+    links = archived_links([story.id])  # in id order
+    if after:
+        links = links[links['id'] > after[0]]
+    links = links[:limit + 1]
+    usernames = viewer_names(links['viewer_id'].tolist())
+    rows = []
+    for link in link_rows(links):
+        values = archived_values(link, {story.id: story.story_date}, usernames)
+        rows.append([values[name] for name in names] + [link['id']])
+    return page_response(names, rows, limit)
 
-# Initialize database
-def create_tables():
+@web.route('/api/v1/audience')
+@login_required
+def api_audience():
+    """Loyalty, churn, cohort retention, lapsed viewers and story overlap"""
+    period = request.args.get('period', 'month')
+    if period not in ('month', 'week'):
+        raise ApiError('period must be month or week')
+    view = view_cache.get_or_compute(current_user.id, f'audience_{period}',
+                                     lambda: _audience_view(current_user.id, period))
+    return jsonify(view)
+
+# Exports
+EXPORT_DATASETS = {
+    'stories': {
+        'id': Story.id,
+        'date': Story.story_date,
+        'views': Story.total_views,
+        'likes': Story.total_likes,
+        'last_checked': Story.last_checked,
+    },
+    'viewers': VIEWER_FIELDS,
+    'story_viewers': {
+        'story_id': StoryViewer.story_id,
+        'date': Story.story_date,
+        'username': Viewer.username,
+        'viewed': StoryViewer.has_viewed,
+        'liked': StoryViewer.has_liked,
+        'first_detected': StoryViewer.first_detected,
+        'last_updated': StoryViewer.last_updated,
+    },
+}
+
+def _export_type(column):
+    for kind, sql_type in (('bool', db.Boolean), ('datetime', db.DateTime), ('date', db.Date), ('int', db.Integer)):
+        if isinstance(column.type, sql_type):
+            return kind
+    return 'str'
+
+def export_query(dataset, user_id, since=None, until=None):
+    """(names, types, statement) for one export, oldest rows first; dates are inclusive"""
+    fields = EXPORT_DATASETS[dataset]
+    stmt = select(*fields.values())
+    if dataset == 'viewers':
+        stmt = stmt.where(Viewer.user_id == user_id).order_by(Viewer.id)
+        if since:
+            stmt = stmt.where(Viewer.last_seen >= datetime.combine(since, datetime.min.time()))
+        if until:
+            stmt = stmt.where(Viewer.first_seen < datetime.combine(until + timedelta(days=1), datetime.min.time()))
+    else:
+        if dataset == 'story_viewers':
+            stmt = (stmt.select_from(StoryViewer)
+                    .join(Story, Story.id == StoryViewer.story_id)
+                    .join(Viewer, Viewer.id == StoryViewer.viewer_id)
+                    .order_by(Story.story_date, StoryViewer.id))
+        else:
+            stmt = stmt.order_by(Story.story_date, Story.id)
+        stmt = stmt.where(Story.user_id == user_id)
+        if since:
+            stmt = stmt.where(Story.story_date >= since)
+        if until:
+            stmt = stmt.where(Story.story_date <= until)
+    return list(fields), [_export_type(column) for column in fields.values()], stmt
+
+def export_rows(dataset, user_id, since=None, until=None):
+    """(names, types, rows) of one export; story_viewers also reads archived stories"""
+    names, types, stmt = export_query(dataset, user_id, since, until)
+    rows = stream_rows(stmt)
+    if dataset == 'story_viewers':
+        # Each day is either archived or hot, so merging on the date keeps the export's order
+        rows = heapq.merge(_archived_export_rows(user_id, names, since, until), rows,
+                           key=itemgetter(names.index('date')))
+    return names, types, rows
+
+def _archived_export_rows(user_id, names, since=None, until=None):
+    import numpy as np
+    from archive import link_rows
+    for links, story_dates in user_segments(user_id, since, until):
+        days = np.array([story_dates[story_id] for story_id in links['story_id'].tolist()], dtype='M8[D]')
+        keep = np.ones(len(links), dtype=bool)
+        if since:
+            keep &= days >= np.datetime64(since)
+        if until:
+            keep &= days <= np.datetime64(until)
+        order = np.lexsort((links['id'], days))
+        links = links[order[keep[order]]]
+        usernames = viewer_names(links['viewer_id'].tolist())
+        for link in link_rows(links):
+            values = archived_values(link, story_dates, usernames)
+            yield tuple(values[name] for name in names)
+
+def stream_rows(stmt):
+    """Rows of ``stmt`` from a server-side cursor, CHUNK_ROWS at a time"""
+    result = db.session.execute(stmt.execution_options(stream_results=True, yield_per=CHUNK_ROWS))
+    try:
+        for partition in result.partitions():
+            yield from partition
+    finally:
+        result.close()
+
+def _date_arg(name):
+    value = request.args.get(name)
+    try:
+        return date.fromisoformat(value) if value else None
+    except ValueError:
+        raise ApiError(f'{name} must be a YYYY-MM-DD date')
+
+@web.route('/api/v1/export/<dataset>')
+@login_required
+def api_export(dataset):
+    """Stream stories, viewers or story_viewers as CSV, NDJSON or Parquet"""
+    if dataset not in EXPORT_DATASETS:
+        raise ApiError(f"dataset must be one of: {', '.join(EXPORT_DATASETS)}")
+    fmt = request.args.get('format', 'csv')
+    if fmt not in FORMATS:
+        raise ApiError(f"format must be one of: {', '.join(FORMATS)}")
+    names, types, rows = export_rows(dataset, current_user.id, _date_arg('since'), _date_arg('until'))
+    try:
+        chunks = export_chunks(fmt, names, types, rows)
+    except ExportUnavailable as e:
+        raise ApiError(str(e))
+    
+    content_type, extension = FORMATS[fmt]
+    headers = {'Content-Disposition': f'attachment; filename="{dataset}.{extension}"',
+               'Cache-Control': 'private, no-store', 'Vary': 'Accept-Encoding'}
+    # Parquet pages are compressed already
+    if fmt != 'parquet' and 'gzip' in request.accept_encodings:
+        chunks = gzip_chunks(chunks)
+        headers['Content-Encoding'] = 'gzip'
+    return Response(stream_with_context(chunks), content_type=content_type, headers=headers)
+
+@web.cli.command('export')
+@click.argument('dataset', type=click.Choice(list(EXPORT_DATASETS)))
+@click.option('--user-id', type=int, required=True)
+@click.option('--format', 'fmt', type=click.Choice(list(FORMATS)), default='csv')
+@click.option('--since', type=click.DateTime(['%Y-%m-%d']), default=None, help='First story day (inclusive)')
+@click.option('--until', type=click.DateTime(['%Y-%m-%d']), default=None, help='Last story day (inclusive)')
+@click.option('--output', '-o', default='-', help='File to write (default: stdout)')
+@click.option('--gzip', 'compress', is_flag=True, help='gzip the output')
+def export_command(dataset, user_id, fmt, since, until, output, compress):
+    """Stream a user's stories, viewers or story-viewer history."""
+    names, types, rows = export_rows(dataset, user_id, since and since.date(), until and until.date())
+    try:
+        chunks = export_chunks(fmt, names, types, rows)
+    except ExportUnavailable as e:
+        raise click.ClickException(str(e))
+    if compress:
+        chunks = gzip_chunks(chunks)
+    with click.open_file(output, 'wb') as f:
+        for chunk in chunks:
+            f.write(chunk)
+
+# Live updates
+STREAM_MAX_SECONDS = int(os.environ.get('STREAM_MAX_SECONDS', 300))
+# Each open stream holds a gthread thread; past this many a dashboard polls /api/stats instead
+STREAM_MAX_CONNECTIONS = int(os.environ.get('STREAM_MAX_CONNECTIONS', 4))
+STREAM_RETRY_SECONDS = 300
+INGEST_EVENT_RETENTION = timedelta(hours=1)
+INGEST_EVENT_PAGE = 1000
+
+def _fetch_ingest_events(app, after_id, user_id=None):
     with app.app_context():
-        db.create_all()
+        stmt = select(IngestEvent.id, IngestEvent.user_id, IngestEvent.payload).where(IngestEvent.id > after_id)
+        if user_id is not None:
+            stmt = stmt.where(IngestEvent.user_id == user_id)
+        return db.session.execute(stmt.order_by(IngestEvent.id).limit(INGEST_EVENT_PAGE)).all()
 
-# Create tables on app startup (for production deployment)
-with app.app_context():
-    db.create_all()
+def _latest_ingest_event(app):
+    with app.app_context():
+        return db.session.execute(select(func.max(IngestEvent.id))).scalar()
+
+def _prune_ingest_events(app):
+    with app.app_context():
+        IngestEvent.query.filter(IngestEvent.created_at < datetime.utcnow() - INGEST_EVENT_RETENTION).delete()
+        db.session.commit()
+
+def event_hub_for(app):
+    """Fans ingest events out to this web worker's stream subscribers; every
+    worker polls the ingest_event table, so streams work across processes"""
+    return EventHub(partial(_fetch_ingest_events, app), partial(_latest_ingest_event, app),
+                    poll_interval=float(os.environ.get('EVENT_POLL_SECONDS', 1)),
+                    prune=partial(_prune_ingest_events, app),
+                    max_subscribers=STREAM_MAX_CONNECTIONS or None,
+                    fetch_limit=INGEST_EVENT_PAGE)
+
+@web.route('/api/v1/stream')
+@login_required
+def api_stream():
+    """Server-Sent Events stream of ingest deltas for the current user"""
+    user_id = current_user.id
+    last_id = request.headers.get('Last-Event-ID', type=int)
+    # The generator outlives the request context
+    app = current_app._get_current_object()
+    event_hub = app.extensions['event_hub']
+    subscription = event_hub.subscribe(user_id)
+    if subscription is None:
+        # This process already holds STREAM_MAX_CONNECTIONS threads in streams; EventSource
+        # gives up on a non-200 answer and the dashboard polls /api/stats (ETag) instead
+        telemetry.live_streams_rejected_total.inc()
+        response = jsonify({'error': 'Too many live streams, poll instead', 'poll': url_for('web.api_stats')})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(STREAM_RETRY_SECONDS)
+        return response
+    
+    def generate():
+        yield 'retry: 5000\n\n'
+        replayed = set()
+        # Replay what a reconnecting client missed
+        if last_id is not None:
+            for event_id, _, payload in _fetch_ingest_events(app, last_id, user_id):
+                replayed.add(event_id)
+                yield f'id: {event_id}\nevent: ingest\ndata: {payload}\n\n'
+        
+        # Streams are recycled so a worker thread is never held forever;
+        # EventSource reconnects with Last-Event-ID
+        deadline = time.monotonic() + STREAM_MAX_SECONDS
+        while time.monotonic() < deadline:
+            try:
+                event_id, payload = subscription.get(timeout=15)
+            except queue.Empty:
+                yield ': keep-alive\n\n'
+                continue
+            # Events arrive in commit order, so only skip what the replay already sent
+            if event_id in replayed:
+                continue
+            yield f'id: {event_id}\nevent: ingest\ndata: {payload}\n\n'
+    
+    response = Response(generate(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Also runs when the client leaves before the stream starts
+    response.call_on_close(partial(event_hub.unsubscribe, user_id, subscription))
+    return response
+
+# Prometheus metrics, merged across every process on this host
+@web.route('/metrics')
+def metrics():
+    token = os.environ.get('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    return Response(telemetry.registry.render(), mimetype='text/plain; version=0.0.4')
+
+# Application factory
+def create_app():
+    """The web application gunicorn serves"""
+    app = init_app(Flask(__name__))
+    login_manager.init_app(app)
+    app.register_blueprint(web)
+    app.extensions['event_hub'] = event_hub_for(app)
+    telemetry.live_streams_open.set_function(lambda: app.extensions['event_hub'].subscriber_count)
+    # Dashboard, analytics and stats reads go to DATABASE_REPLICA_URL when set
+    app.extensions['db_replica'] = replica_from_env('web')
+    app.after_request(pin_writers_to_primary)
+    # Each process flushes its own metrics for /metrics to merge
+    telemetry.registry.start()
+    return app
 
 if __name__ == '__main__':
+    app = create_app()
     # Create tables on startup (for local development)
-    create_tables()
+    create_tables(app)
     
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port, debug=False) 
\ No newline at end of file
@@ -0,0 +1,84 @@
+"""
+Cold storage for old story-viewer links
+Stories older than ARCHIVE_AFTER_DAYS have their StoryViewer rows moved into
+one compressed segment per user and month. A segment holds the same columns
+as the table: ids, story and viewer ids and timestamps delta-encoded and
+byte-shuffled, the two flags as bitmaps, all of it zlib-compressed, so a
+year of links takes a small fraction of the rows and indexes it replaces.
+The Story rows (and their totals) stay in the hot tables.
+"""
+
+import struct
+import zlib
+
+import numpy as np
+
+# One archived link; field names match the StoryViewer columns
+LINK_DTYPE = np.dtype([
+    ('id', np.int64),
+    ('story_id', np.int64),
+    ('viewer_id', np.int64),
+    ('has_viewed', np.bool_),
+    ('has_liked', np.bool_),
+    ('first_detected', 'M8[us]'),  # NaT for NULL
+    ('last_updated', 'M8[us]'),
+])
+INT_FIELDS = ('id', 'story_id', 'viewer_id', 'first_detected', 'last_updated')
+FLAG_FIELDS = ('has_viewed', 'has_liked')
+
+MAGIC = b'ISA1'
+HEADER = struct.Struct('<4sI')  # magic, link count
+COMPRESSION_LEVEL = 9  # segments are written once and read rarely
+
+
+def _shuffle(values):
+    # Delta-encoded ids and timestamps are small numbers in 8-byte words;
+    # grouping byte 0 of every word, then byte 1, ... leaves long zero runs
+    deltas = np.diff(values.view(np.int64), prepend=np.int64(0))
+    return deltas.astype('<i8').view(np.uint8).reshape(-1, 8).T.tobytes()
+
+
+def _unshuffle(data, count):
+    deltas = np.frombuffer(data, dtype=np.uint8).reshape(8, count).T.copy().view('<i8').ravel()
+    return np.cumsum(deltas, dtype=np.int64)
+
+
+def encode_segment(links):
+    """Compress a LINK_DTYPE array (sorted by story_id, id) into a segment payload"""
+    links = np.asarray(links, dtype=LINK_DTYPE)
+    parts = [HEADER.pack(MAGIC, len(links))]
+    parts.extend(_shuffle(np.ascontiguousarray(links[name])) for name in INT_FIELDS)
+    parts.extend(np.packbits(links[name], bitorder='little').tobytes() for name in FLAG_FIELDS)
+    return zlib.compress(b''.join(parts), COMPRESSION_LEVEL)
+
+
+def decode_segment(payload):
+    """The LINK_DTYPE array a segment payload was encoded from"""
+    raw = zlib.decompress(payload)
+    magic, count = HEADER.unpack_from(raw)
+    if magic != MAGIC:
+        raise ValueError('not a story archive segment')
+    links = np.zeros(count, dtype=LINK_DTYPE)
+    offset = HEADER.size
+    for name in INT_FIELDS:
+        links[name] = _unshuffle(raw[offset:offset + 8 * count], count).view(LINK_DTYPE[name])
+        offset += 8 * count
+    flag_bytes = (count + 7) // 8
+    for name in FLAG_FIELDS:
+        bits = np.frombuffer(raw, dtype=np.uint8, count=flag_bytes, offset=offset)
+        links[name] = np.unpackbits(bits, count=count, bitorder='little').astype(bool)
+        offset += flag_bytes
+    return links
+
+
+def segment_key(story_date):
+    """Stories are archived in one segment per user and calendar month"""
+    return story_date.replace(day=1)
+
+
+def link_rows(links):
+    """Plain Python rows (dicts keyed by column) of an archived link array"""
+    columns = {name: links[name].tolist() for name in LINK_DTYPE.names}
+    for name in ('first_detected', 'last_updated'):
+        columns[name] = links[name].astype(object).tolist()  # datetime, None for NaT
+    return [dict(zip(columns, values)) for values in zip(*columns.values())]
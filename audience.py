@@ -0,0 +1,448 @@
+"""
+Audience analytics over a viewer x story bitmap
+A user's StoryViewer history is held as two bit matrices, views and likes,
+with one row per story and one bit per viewer. Loyalty, churn, cohort
+retention, lapsed viewers and story overlap then come from a few NumPy
+reductions over packed rows instead of per-viewer queries. Matrices live per
+user in this process and only stories that changed since the last sync are
+read back from the database.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# Set bits in every byte value, for popcounts over packed rows
+POPCOUNT = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+LOYALTY_BINS = (0, 0.2, 0.4, 0.6, 0.8, 1.0001)
+LOYALTY_MIN_STORIES = 5   # viewers need this many stories since their first view to be ranked
+CORE_LOYALTY = 0.8        # share of stories seen that makes a viewer "core"
+CHURN_WINDOW = 7          # stories per churn period
+CHURN_PERIODS = 12
+LAPSED_RECENT = 7         # stories without a view before a regular counts as lapsed
+LAPSED_MIN_VIEWS = 3
+LAPSED_MIN_LOYALTY = 0.5
+COHORT_LIMIT = 12
+OVERLAP_STORIES = 10
+CARRYOVER_STORIES = 30
+TOP_LIMIT = 20
+LOAD_STORIES = 64         # stories read from the database per query when syncing
+
+
+def popcount(packed, axis=-1):
+    return POPCOUNT[packed].sum(axis=axis, dtype=np.int64)
+
+
+def _pack_rows(rows, columns, height, width):
+    """Packed bit rows with bit ``columns[i]`` set in row ``rows[i]`` (pairs are unique)"""
+    if not len(columns):
+        return np.zeros((height, width), dtype=np.uint8)
+    index = rows * width + (columns >> 3)
+    bits = np.left_shift(1, columns & 7)
+    return np.bincount(index, weights=bits, minlength=height * width).astype(np.uint8).reshape(height, width)
+
+
+def _pack_mask(mask, width):
+    packed = np.packbits(mask, bitorder='little')
+    return np.pad(packed, (0, width - len(packed)))
+
+
+def _unpack(packed, count):
+    return np.unpackbits(packed, axis=-1, count=count, bitorder='little')
+
+
+class AudienceMatrix:
+    """Views and likes of one user's stories, one packed row of viewer bits per story
+
+    Per-viewer view and like counts and first/last story positions are kept
+    in step with every row change, so reports never scan the whole matrix
+    for them. Rows and viewer columns grow by doubling.
+    """
+
+    def __init__(self):
+        self.stories = []  # (story id, story date, version) in date order
+        self.version = None
+        self.n_viewers = 0
+        self.viewer_ids = np.zeros(0, dtype=np.int64)
+        self.views = np.zeros((0, 0), dtype=np.uint8)
+        self.likes = np.zeros((0, 0), dtype=np.uint8)
+        self.view_counts = np.zeros(0, dtype=np.int32)
+        self.like_counts = np.zeros(0, dtype=np.int32)
+        self.first_story = np.zeros(0, dtype=np.int32)  # -1 until a viewer's first view
+        self.last_story = np.zeros(0, dtype=np.int32)
+        self._sorted = None  # (sorted viewer ids, their columns), rebuilt after new viewers
+
+    @property
+    def n_stories(self):
+        return len(self.stories)
+
+    @property
+    def width(self):
+        return self.views.shape[1]
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in (self.viewer_ids, self.views, self.likes, self.view_counts,
+                                              self.like_counts, self.first_story, self.last_story))
+
+    def stale_positions(self, stories):
+        """Positions in ``stories`` to (re)load, or None when the matrix must be rebuilt
+
+        A story keeps its row while its id and position are unchanged; a new
+        version (its last check time) reloads the row, and new stories at the
+        end are appended. Anything else - a story removed or inserted before
+        the newest - needs a rebuild.
+        """
+        if len(stories) < len(self.stories):
+            return None
+        positions = []
+        for position, story in enumerate(stories):
+            if position >= len(self.stories):
+                positions.append(position)
+            elif story[0] != self.stories[position][0]:
+                return None
+            elif story[2] != self.stories[position][2]:
+                positions.append(position)
+        return positions
+
+    def load(self, stories, positions, story_ids, viewer_ids, liked):
+        """Replace the rows at ``positions`` with their story-viewer links
+
+        ``stories`` is the user's full story list; ``story_ids``,
+        ``viewer_ids`` and ``liked`` hold one entry per viewed link of the
+        stories being loaded.
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        story_ids = np.asarray(story_ids, dtype=np.int64)
+        liked = np.asarray(liked, dtype=bool)
+        self._grow_stories(len(stories))
+        self.stories = list(stories)
+
+        loaded = np.array([stories[position][0] for position in positions], dtype=np.int64)
+        order = np.argsort(loaded)
+        rows = order[np.searchsorted(loaded, story_ids, sorter=order)] if len(story_ids) else story_ids
+        columns = self._columns(viewer_ids)
+
+        old_views, old_likes = self.views[positions], self.likes[positions]
+        self.views[positions] = _pack_rows(rows, columns, len(positions), self.width)
+        self.likes[positions] = _pack_rows(rows[liked], columns[liked], len(positions), self.width)
+        self._update_counts(positions, old_views, old_likes)
+
+    def _columns(self, viewer_ids):
+        """Columns for viewer ids, adding columns for viewers not seen before"""
+        ids = np.asarray(viewer_ids, dtype=np.int64)
+        if self._sorted is None:
+            order = np.argsort(self.viewer_ids[:self.n_viewers])
+            self._sorted = (self.viewer_ids[order], order)
+        sorted_ids, sorted_columns = self._sorted
+        found = np.searchsorted(sorted_ids, ids)
+        known = found < len(sorted_ids)
+        known[known] = sorted_ids[found[known]] == ids[known]
+        if known.all():
+            return sorted_columns[found]
+
+        new = np.unique(ids[~known])
+        self._grow_viewers(self.n_viewers + len(new))
+        self.viewer_ids[self.n_viewers:self.n_viewers + len(new)] = new
+        self.n_viewers += len(new)
+        self._sorted = None
+        return self._columns(ids)
+
+    def _grow_stories(self, count):
+        if count <= len(self.views):
+            return
+        capacity = max(count, 2 * len(self.views), 16)
+        self.views = np.pad(self.views, ((0, capacity - len(self.views)), (0, 0)))
+        self.likes = np.pad(self.likes, ((0, capacity - len(self.likes)), (0, 0)))
+
+    def _grow_viewers(self, count):
+        if count <= 8 * self.width:
+            return
+        width = max(-(-count // 8), 2 * self.width, 128)
+        self.views = np.pad(self.views, ((0, 0), (0, width - self.width)))
+        self.likes = np.pad(self.likes, ((0, 0), (0, width - self.likes.shape[1])))
+        extra = 8 * width - len(self.viewer_ids)
+        self.viewer_ids = np.pad(self.viewer_ids, (0, extra))
+        self.view_counts = np.pad(self.view_counts, (0, extra))
+        self.like_counts = np.pad(self.like_counts, (0, extra))
+        self.first_story = np.pad(self.first_story, (0, extra), constant_values=-1)
+        self.last_story = np.pad(self.last_story, (0, extra), constant_values=-1)
+
+    def _update_counts(self, positions, old_views, old_likes):
+        """Fold reloaded rows into the per-viewer counts"""
+        if (old_views & ~self.views[positions]).any():
+            # A viewer vanished from a story, so first/last views may move back
+            self._recount()
+            return
+        self._count(positions, old_views, old_likes)
+
+    def _count(self, positions, old_views=None, old_likes=None, chunk=64):
+        """Add the rows at ``positions`` (ascending) to the counts, less what ``old_*`` already added"""
+        n = self.n_viewers
+        first, last = self.first_story[:n], self.last_story[:n]
+        for start in range(0, len(positions), chunk):
+            rows = positions[start:start + chunk]
+            views = self.views[rows]
+            if old_views is not None:
+                views &= ~old_views[start:start + chunk]
+                self.like_counts[:n] -= _unpack(old_likes[start:start + chunk], n).sum(axis=0, dtype=np.int32)
+            bits = _unpack(views, n)
+            self.view_counts[:n] += bits.sum(axis=0, dtype=np.int32)
+            self.like_counts[:n] += _unpack(self.likes[rows], n).sum(axis=0, dtype=np.int32)
+            seen = bits.any(axis=0)
+            earliest = rows[bits.argmax(axis=0)]
+            latest = rows[len(rows) - 1 - bits[::-1].argmax(axis=0)]
+            moved = seen & ((first < 0) | (earliest < first))
+            first[moved] = earliest[moved]
+            last[seen] = np.maximum(last[seen], latest[seen])
+
+    def _recount(self):
+        self.view_counts[:] = 0
+        self.like_counts[:] = 0
+        self.first_story[:] = -1
+        self.last_story[:] = -1
+        self._count(np.arange(self.n_stories))
+
+
+def _story_date(matrix, position):
+    return matrix.stories[position][1].isoformat()
+
+
+def _ranked(candidates, *keys, limit=TOP_LIMIT):
+    """``candidates`` ordered by the given keys, each descending"""
+    order = np.lexsort(tuple(-key[candidates] for key in reversed(keys)))
+    return candidates[order[:limit]]
+
+
+def summary(matrix):
+    n, stories = matrix.n_viewers, matrix.n_stories
+    views = popcount(matrix.views[:stories]) if stories else np.zeros(0, dtype=np.int64)
+    return {
+        'stories': stories,
+        'viewers': int((matrix.view_counts[:n] > 0).sum()),
+        'likers': int((matrix.like_counts[:n] > 0).sum()),
+        'mean_views': round(float(views.mean()), 1) if stories else 0,
+    }
+
+
+def loyalty(matrix, min_stories=LOYALTY_MIN_STORIES, core=CORE_LOYALTY, limit=TOP_LIMIT):
+    """Share of stories each viewer saw since their first view"""
+    n = matrix.n_viewers
+    counts, first = matrix.view_counts[:n], matrix.first_story[:n]
+    eligible = np.where(first >= 0, matrix.n_stories - first, 0)
+    rate = np.divide(counts, eligible, out=np.zeros(n), where=eligible > 0)
+    ranked = eligible >= max(min_stories, 1)
+    histogram = np.histogram(rate[ranked], bins=LOYALTY_BINS)[0]
+    top = _ranked(np.flatnonzero(ranked), rate, counts, limit=limit)
+    return {
+        'ranked_viewers': int(ranked.sum()),
+        'core_viewers': int((ranked & (rate >= core)).sum()),
+        'mean': round(float(rate[ranked].mean()), 3) if ranked.any() else 0,
+        'histogram': [{'range': f"{int(low * 100)}-{min(int(high * 100), 100)}%", 'viewers': int(count)}
+                      for low, high, count in zip(LOYALTY_BINS, LOYALTY_BINS[1:], histogram)],
+        'top': [{'viewer_id': int(matrix.viewer_ids[column]), 'loyalty': round(float(rate[column]), 3),
+                 'views': int(counts[column]), 'likes': int(matrix.like_counts[column]),
+                 'stories': int(eligible[column])} for column in top],
+    }
+
+
+def churn(matrix, window=CHURN_WINDOW, periods=CHURN_PERIODS):
+    """Viewers gained and lost between consecutive windows of ``window`` stories, newest last"""
+    stories, n, width = matrix.n_stories, matrix.n_viewers, matrix.width
+    ends = list(range(stories, 0, -window))[:periods + 1][::-1]
+    if len(ends) < 2:
+        return []
+    first = matrix.first_story[:n]
+    series = []
+    previous = np.bitwise_or.reduce(matrix.views[max(ends[0] - window, 0):ends[0]], axis=0)
+    for end in ends[1:]:
+        start = end - window
+        active = np.bitwise_or.reduce(matrix.views[start:end], axis=0)
+        new = _pack_mask((first >= start) & (first < end), width)
+        before = int(popcount(previous))
+        churned = int(popcount(previous & ~active))
+        series.append({
+            'start': _story_date(matrix, start),
+            'end': _story_date(matrix, end - 1),
+            'active': int(popcount(active)),
+            'retained': int(popcount(previous & active)),
+            'churned': churned,
+            'new': int(popcount(active & new)),
+            'returned': int(popcount(active & ~previous & ~new)),
+            'churn_rate': round(churned / before, 3) if before else 0,
+        })
+        previous = active
+    return series
+
+
+def lapsed(matrix, recent=LAPSED_RECENT, min_views=LAPSED_MIN_VIEWS, min_loyalty=LAPSED_MIN_LOYALTY,
+           limit=TOP_LIMIT):
+    """Regular viewers who have not seen any of the last ``recent`` stories"""
+    n, stories = matrix.n_viewers, matrix.n_stories
+    counts, first, last = matrix.view_counts[:n], matrix.first_story[:n], matrix.last_story[:n]
+    span = np.maximum(last - first + 1, 1)
+    mask = (first >= 0) & (last < stories - recent) & (counts >= min_views) & (counts / span >= min_loyalty)
+    top = _ranked(np.flatnonzero(mask), counts, last, limit=limit)
+    return {
+        'viewers': int(mask.sum()),
+        'top': [{'viewer_id': int(matrix.viewer_ids[column]), 'views': int(counts[column]),
+                 'likes': int(matrix.like_counts[column]), 'last_story': _story_date(matrix, last[column]),
+                 'stories_missed': int(stories - 1 - last[column])} for column in top],
+    }
+
+
+def _period(day, period):
+    if period == 'week':
+        year, week, _ = day.isocalendar()
+        return f"{year}-W{week:02d}"
+    return day.strftime('%Y-%m')
+
+
+def cohorts(matrix, period='month', limit=COHORT_LIMIT):
+    """Retention of viewers grouped by the period of their first view
+
+    ``retention[k]`` is the share of a cohort that saw any story ``k``
+    periods after the one they joined in.
+    """
+    n, width = matrix.n_viewers, matrix.width
+    labels, starts = [], []
+    for position, story in enumerate(matrix.stories):
+        label = _period(story[1], period)
+        if not labels or labels[-1] != label:
+            labels.append(label)
+            starts.append(position)
+    if not labels:
+        return []
+    bounds = starts + [matrix.n_stories]
+    active = np.stack([np.bitwise_or.reduce(matrix.views[start:stop], axis=0)
+                       for start, stop in zip(bounds, bounds[1:])])
+    story_period = np.repeat(np.arange(len(labels)), np.diff(bounds))
+    first = matrix.first_story[:n]
+    joined = np.where(first >= 0, story_period[np.maximum(first, 0)], -1)
+
+    rows = []
+    for cohort in range(max(len(labels) - limit, 0), len(labels)):
+        members = joined == cohort
+        size = int(members.sum())
+        if not size:
+            continue
+        retained = popcount(active[cohort:] & _pack_mask(members, width), axis=1)
+        rows.append({'cohort': labels[cohort], 'viewers': size,
+                     'retention': [round(count / size, 3) for count in retained.tolist()]})
+    return rows
+
+
+def overlap(matrix, stories=OVERLAP_STORIES, carryover=CARRYOVER_STORIES):
+    """Jaccard overlap between the latest stories, and the share of each story's viewers who saw the next"""
+    count = matrix.n_stories
+    recent = matrix.views[max(count - stories, 0):count]
+    shared = popcount(recent[:, None, :] & recent[None, :, :])
+    sizes = np.diag(shared)
+    union = sizes[:, None] + sizes[None, :] - shared
+    jaccard = np.divide(shared, union, out=np.zeros(shared.shape), where=union > 0)
+
+    start = max(count - carryover - 1, 0)
+    rows = matrix.views[start:count]
+    kept = popcount(rows[1:] & rows[:-1]).tolist()
+    before = popcount(rows[:-1]).tolist()
+    return {
+        'dates': [_story_date(matrix, position) for position in range(max(count - stories, 0), count)],
+        'jaccard': np.round(jaccard, 3).tolist(),
+        'carryover': [{'date': _story_date(matrix, start + offset + 1),
+                       'rate': round(kept[offset] / before[offset], 3) if before[offset] else 0}
+                      for offset in range(len(kept))],
+    }
+
+
+def audience_report(matrix, period='month'):
+    """Every audience metric for one matrix; viewers are identified by viewer id"""
+    return {
+        'summary': summary(matrix),
+        'loyalty': loyalty(matrix),
+        'churn': churn(matrix),
+        'lapsed': lapsed(matrix),
+        'cohorts': cohorts(matrix, period),
+        'overlap': overlap(matrix),
+    }
+
+
+class AudienceStore:
+    """Per-user matrices kept in this process and synced incrementally
+
+    ``load_stories(user_id)`` returns the user's (story id, date, version)
+    tuples in date order; ``load_links(story_ids)`` returns (story ids,
+    viewer ids, liked) sequences for the viewed links of those stories.
+    """
+
+    def __init__(self, load_stories, load_links, max_users=32, on_sync=None):
+        self.load_stories = load_stories
+        self.load_links = load_links
+        self.max_users = max_users
+        self.on_sync = on_sync  # called with (kind, seconds, stories loaded)
+        self._matrices = OrderedDict()
+        self._locks = {}
+        self._lock = threading.Lock()
+        self.stats = {'builds': 0, 'syncs': 0, 'unchanged': 0, 'stories_loaded': 0}
+
+    def _user_lock(self, user_id):
+        with self._lock:
+            return self._locks.setdefault(user_id, threading.Lock())
+
+    def report(self, user_id, version=None, period='month'):
+        """Sync the user's matrix and report on it under the user's lock
+
+        ``version`` (e.g. the rollup's update time) lets an unchanged user
+        skip even the story list query.
+        """
+        with self._user_lock(user_id):
+            return audience_report(self._sync(user_id, version), period)
+
+    def _sync(self, user_id, version):
+        with self._lock:
+            matrix = self._matrices.get(user_id)
+            if matrix is not None:
+                self._matrices.move_to_end(user_id)
+        if matrix is not None and version is not None and matrix.version == version:
+            self.stats['unchanged'] += 1
+            return matrix
+
+        started = time.perf_counter()
+        stories = self.load_stories(user_id)
+        positions = matrix.stale_positions(stories) if matrix is not None else None
+        kind = 'sync'
+        if positions is None:
+            matrix, positions, kind = AudienceMatrix(), list(range(len(stories))), 'build'
+        try:
+            for start in range(0, len(positions), LOAD_STORIES):
+                chunk = positions[start:start + LOAD_STORIES]
+                matrix.load(stories, chunk, *self.load_links([stories[position][0] for position in chunk]))
+        except Exception:
+            # A half-loaded matrix would look current; start over next time
+            self.forget(user_id)
+            raise
+        matrix.version = version
+        self.stats['builds' if kind == 'build' else 'syncs'] += 1
+        self.stats['stories_loaded'] += len(positions)
+        if self.on_sync is not None:
+            self.on_sync(kind, time.perf_counter() - started, len(positions))
+
+        with self._lock:
+            self._matrices[user_id] = matrix
+            self._matrices.move_to_end(user_id)
+            while len(self._matrices) > self.max_users:
+                self._matrices.popitem(last=False)
+        return matrix
+
+    def forget(self, user_id):
+        with self._lock:
+            self._matrices.pop(user_id, None)
+
+
+def audience_store_from_env(load_stories, load_links, on_sync=None):
+    """AUDIENCE_CACHE_USERS bounds the matrices kept per process"""
+    return AudienceStore(load_stories, load_links,
+                         max_users=int(os.environ.get('AUDIENCE_CACHE_USERS', 32)), on_sync=on_sync)
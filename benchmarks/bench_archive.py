@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Story archive benchmark: hot table size and read paths before and after archiving
+Writes a synthetic history (one story a day for --days days) to SQLite, then
+archives the stories older than --older-than days. Reports story_viewer rows
+and database size before and after (the file is vacuumed both times), the
+compressed segment bytes, how long archiving and the archive-reading paths
+take, and whether the story_viewers export, the audience report, the
+rebuilt rollups and the per-story viewer API read the same data as before.
+Ends by timing delete_user_data on the archived account.
+
+Usage: python benchmarks/bench_archive.py [--viewers 20000] [--days 400] [--older-than 180] [--json]
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_audience import synthetic_history
+
+
+def timed(fn):
+    started = time.perf_counter()
+    value = fn()
+    return value, round((time.perf_counter() - started) * 1000, 1)
+
+
+def seed(app_module, history, days):
+    from sqlalchemy import insert
+    db = app_module.db
+    today = datetime.utcnow().date()
+    db.session.add(app_module.User(id=1, username='bench', email='bench@example.com',
+                                   password_hash='-', instagram_username='account'))
+    viewer_count = max(int(seen.max()) for seen, _ in history if len(seen))
+    db.session.execute(insert(app_module.Viewer), [
+        {'id': i, 'user_id': 1, 'username': f'viewer{i}'} for i in range(1, viewer_count + 1)])
+    for position, (seen, liked) in enumerate(history):
+        day = today - timedelta(days=days - position)
+        checked = datetime.combine(day, datetime.min.time()) + timedelta(hours=20)
+        db.session.add(app_module.Story(id=position + 1, user_id=1, story_date=day, last_checked=checked,
+                                        total_views=len(seen), total_likes=int(liked.sum())))
+        detected = checked - timedelta(hours=12)
+        db.session.execute(insert(app_module.StoryViewer), [
+            {'story_id': position + 1, 'viewer_id': int(viewer), 'has_viewed': True, 'has_liked': bool(like),
+             'first_detected': detected + timedelta(seconds=index * 7), 'last_updated': checked}
+            for index, (viewer, like) in enumerate(zip(seen, liked))])
+    db.session.commit()
+
+
+def observe(app_module, client, story_id):
+    """Everything that must read the same before and after archiving"""
+    db = app_module.db
+    names, types, rows = app_module.export_rows('story_viewers', 1)
+    digest = hashlib.sha1()
+    count = 0
+    for row in rows:
+        digest.update(repr(tuple(row)).encode())
+        count += 1
+
+    app_module.audience_store().forget(1)
+    audience = app_module.audience_store().report(1)
+
+    app_module.rebuild_rollups(1)
+    daily = [(row.story_date.isoformat(), row.new_viewers) for row in
+             app_module.DailyStats.query.filter_by(user_id=1).order_by(app_module.DailyStats.story_date)]
+
+    pages, cursor = [], None
+    while True:
+        url = f'/api/v1/stories/{story_id}/viewers?limit=500' + (f'&cursor={cursor}' if cursor else '')
+        page = client.get(url).get_json()
+        pages.extend(page['rows'])
+        cursor = page['next']
+        if not cursor:
+            break
+    db.session.remove()
+    return {'export_rows': count, 'export_sha1': digest.hexdigest(), 'audience': audience,
+            'daily': daily, 'story_viewers': pages}
+
+
+def database_size(app_module, path):
+    app_module.db.session.remove()
+    with app_module.db.engine.connect() as conn:
+        conn.exec_driver_sql('VACUUM')
+    return round(os.path.getsize(path) / 1e6, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--viewers', type=int, default=20_000)
+    parser.add_argument('--days', type=int, default=400)
+    parser.add_argument('--older-than', type=int, default=180, help='archive stories older than this many days')
+    parser.add_argument('--json', action='store_true', help='print JSON instead of a table')
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'bench_archive.db')
+    os.environ['DATABASE_URL'] = f'sqlite:///{path}'
+    os.environ.setdefault('METRICS_DIR', 'off')
+    os.environ.setdefault('CACHE_BACKEND', 'off')
+    import app as app_module
+    from models import StoryArchive
+    from sqlalchemy import func, select
+
+    history = synthetic_history(args.viewers, args.days)
+    results = {}
+    app = app_module.create_app()
+    with app.app_context():
+        db = app_module.db
+        db.create_all()
+        seed(app_module, history, args.days)
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = '1'
+        count_links = lambda: db.session.execute(select(func.count(app_module.StoryViewer.id))).scalar()
+        archived_story = 10  # well past the cutoff
+
+        results['rows_before'] = count_links()
+        results['db_mb_before'] = database_size(app_module, path)
+        before, results['reads_before_ms'] = timed(lambda: observe(app_module, client, archived_story))
+
+        (segments, links), results['archive_ms'] = timed(
+            lambda: app_module.archive_due(timedelta(days=args.older_than)))
+        results['segments'] = segments
+        results['links_archived'] = links
+        results['rows_after'] = count_links()
+        results['segment_mb'] = round(db.session.execute(
+            select(func.sum(func.length(StoryArchive.payload)))).scalar() / 1e6, 2)
+        results['db_mb_after'] = database_size(app_module, path)
+        after, results['reads_after_ms'] = timed(lambda: observe(app_module, client, archived_story))
+        results['matches'] = {key: before[key] == after[key] for key in before}
+
+        _, results['delete_user_ms'] = timed(lambda: app_module.delete_user_data(1))
+        results['rows_after_delete'] = count_links() + db.session.execute(
+            select(func.count(StoryArchive.id))).scalar()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"viewers={args.viewers} days={args.days} older_than={args.older_than}")
+    for name, value in results.items():
+        print(f"{name:<20} {value}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Audience analytics benchmark: viewer x story bitmap vs per-row Python
+Generates a synthetic history (viewers with their own loyalty, joining and
+drifting away over time), then times building an AudienceMatrix from the
+story-viewer links, a full audience_report, appending one new story and
+re-syncing a grown story, against the same metrics computed row by row
+with Python sets. With --db the history is written to SQLite and the
+matrix is built and synced through the app's loaders instead.
+
+Usage: python benchmarks/bench_audience.py [--viewers 50000] [--stories 700] [--baseline]
+                                           [--db] [--json]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from audience import CHURN_WINDOW, LAPSED_RECENT, LOAD_STORIES, AudienceMatrix, audience_report
+
+
+def synthetic_history(viewers, stories, seed=7):
+    """(story ids, viewer ids, liked) per story, in date order"""
+    rng = np.random.default_rng(seed)
+    propensity = rng.beta(0.6, 2.5, viewers)
+    joined = (rng.random(viewers) ** 2 * stories).astype(int)
+    left = np.where(rng.random(viewers) < 0.4, joined + rng.integers(10, stories, viewers), stories)
+    like_rate = rng.beta(0.5, 5, viewers)
+    history = []
+    for story in range(stories):
+        active = (joined <= story) & (story < left)
+        seen = np.flatnonzero(active & (rng.random(viewers) < propensity))
+        history.append((seen + 1, rng.random(len(seen)) < like_rate[seen]))
+    return history
+
+
+def links(history, positions):
+    story_ids = np.concatenate([np.full(len(history[p][0]), p + 1) for p in positions])
+    viewer_ids = np.concatenate([history[p][0] for p in positions])
+    liked = np.concatenate([history[p][1] for p in positions])
+    return story_ids, viewer_ids, liked
+
+
+def build(matrix, history, stories):
+    """Load every story in the chunks AudienceStore reads from the database"""
+    for start in range(0, len(stories), LOAD_STORIES):
+        positions = range(start, min(start + LOAD_STORIES, len(stories)))
+        matrix.load(stories, positions, *links(history, positions))
+
+
+def story_list(count, version=0):
+    start = date(2024, 1, 1)
+    return [(p + 1, start + timedelta(days=p), version) for p in range(count)]
+
+
+def timed(fn):
+    started = time.perf_counter()
+    value = fn()
+    return value, round((time.perf_counter() - started) * 1000, 1)
+
+
+def baseline_report(history, dates, window=CHURN_WINDOW, recent=LAPSED_RECENT):
+    """The same headline numbers from per-viewer dictionaries and sets"""
+    first, last, views = {}, {}, {}
+    story_sets = []
+    for position, (seen, _) in enumerate(history):
+        seen = set(seen.tolist())
+        story_sets.append(seen)
+        for viewer in seen:
+            first.setdefault(viewer, position)
+            last[viewer] = position
+            views[viewer] = views.get(viewer, 0) + 1
+    count = len(history)
+    loyalty = {viewer: views[viewer] / (count - first[viewer]) for viewer in views if count - first[viewer] >= 5}
+    top = sorted(loyalty, key=lambda viewer: (-loyalty[viewer], -views[viewer]))[:20]
+    windows = [set().union(*story_sets[max(end - window, 0):end]) for end in range(count, 0, -window)][:13]
+    churn = [len(before - after) / len(before) for after, before in zip(windows, windows[1:]) if before]
+    lapsed = [viewer for viewer in views if last[viewer] < count - recent and views[viewer] >= 3
+              and views[viewer] / (last[viewer] - first[viewer] + 1) >= 0.5]
+    months = {}
+    for position, day in enumerate(dates):
+        months.setdefault(day.strftime('%Y-%m'), set()).update(story_sets[position])
+    cohorts = {}
+    for viewer, position in first.items():
+        cohorts.setdefault(dates[position].strftime('%Y-%m'), set()).add(viewer)
+    retention = {label: [len(members & months[later]) / len(members) for later in months if later >= label]
+                 for label, members in cohorts.items()}
+    carryover = [len(story_sets[p] & story_sets[p - 1]) / len(story_sets[p - 1])
+                 for p in range(max(count - 30, 1), count) if story_sets[p - 1]]
+    return {'top': top, 'churn': churn, 'lapsed': len(lapsed), 'cohorts': len(retention),
+            'carryover': len(carryover)}
+
+
+def run_memory(args):
+    history = synthetic_history(args.viewers, args.stories)
+    stories = story_list(args.stories)
+    total = sum(len(seen) for seen, _ in history)
+
+    results = {'links': total}
+    matrix = AudienceMatrix()
+    tracemalloc.start()
+    _, results['build_ms'] = timed(lambda: build(matrix, history, stories[:-1]))
+    results['build_peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 1e6, 1)
+    tracemalloc.stop()
+    results['matrix_mb'] = round(matrix.nbytes / 1e6, 1)
+    report, results['report_ms'] = timed(lambda: audience_report(matrix))
+
+    # A new story column, then the same story re-scraped with more viewers
+    last = args.stories - 1
+    seen, liked = history[last]
+    half = len(seen) // 2
+    partial = (np.full(half, last + 1), seen[:half], liked[:half])
+    _, results['append_ms'] = timed(lambda: matrix.load(stories, matrix.stale_positions(stories), *partial))
+    grown = story_list(args.stories)
+    grown[-1] = grown[-1][:2] + (1,)
+    _, results['resync_ms'] = timed(lambda: matrix.load(grown, matrix.stale_positions(grown),
+                                                        *links(history, [last])))
+    _, results['report_after_append_ms'] = timed(lambda: audience_report(matrix))
+
+    if args.baseline:
+        baseline, results['baseline_ms'] = timed(
+            lambda: baseline_report(history, [story[1] for story in stories]))
+        report = audience_report(matrix)
+        results['baseline_matches'] = (
+            [row['viewer_id'] for row in report['loyalty']['top']] == baseline['top']
+            and report['lapsed']['viewers'] == baseline['lapsed']
+            and [row['churn_rate'] for row in report['churn']][::-1] == [round(c, 3) for c in baseline['churn']]
+            and len(report['cohorts']) == min(baseline['cohorts'], 12))
+    return results
+
+
+def run_db(args):
+    workdir = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'bench_audience.db')}"
+    os.environ.setdefault('METRICS_DIR', 'off')
+    import app as app_module
+    from sqlalchemy import insert, update
+
+    history = synthetic_history(args.viewers, args.stories)
+    stories = story_list(args.stories)
+    db = app_module.db
+    with app_module.create_app().app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.add(app_module.User(id=1, username='bench', email='bench@example.com',
+                                       password_hash='-', instagram_username='account'))
+        db.session.execute(insert(app_module.Viewer), [
+            {'id': i, 'user_id': 1, 'username': f'viewer{i}'} for i in range(1, args.viewers + 1)])
+        checked = datetime(2024, 1, 1)
+        db.session.execute(insert(app_module.Story), [
+            {'id': story_id, 'user_id': 1, 'story_date': day, 'last_checked': checked}
+            for story_id, day, _ in stories])
+        for position, (seen, liked) in enumerate(history):
+            db.session.execute(insert(app_module.StoryViewer), [
+                {'story_id': position + 1, 'viewer_id': int(viewer), 'has_viewed': True, 'has_liked': bool(like)}
+                for viewer, like in zip(seen, liked)])
+        db.session.commit()
+
+        store = app_module.audience_store()
+        results = {'links': sum(len(seen) for seen, _ in history)}
+        _, results['db_build_ms'] = timed(lambda: store.report(1))
+        _, results['db_unchanged_ms'] = timed(lambda: store.report(1))
+        db.session.execute(update(app_module.Story).where(app_module.Story.id == args.stories)
+                           .values(last_checked=checked + timedelta(minutes=5)))
+        db.session.commit()
+        _, results['db_resync_ms'] = timed(lambda: store.report(1))
+        results['stats'] = store.stats
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--viewers', type=int, default=50_000)
+    parser.add_argument('--stories', type=int, default=700)
+    parser.add_argument('--baseline', action='store_true', help='also time the per-row Python version')
+    parser.add_argument('--db', action='store_true', help='build and sync through SQLite and the app loaders')
+    parser.add_argument('--json', action='store_true', help='print JSON instead of a table')
+    args = parser.parse_args()
+
+    results = run_db(args) if args.db else run_memory(args)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"viewers={args.viewers} stories={args.stories}")
+    for name, value in results.items():
+        print(f"{name:<24} {value}")
+
+
+if __name__ == '__main__':
+    main()
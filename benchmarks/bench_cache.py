@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+View cache benchmark for /dashboard, /analytics and /api/stats
+Measures requests per second through the Flask test client with the
+per-user cache on and off
+
+Usage: python benchmarks/bench_cache.py [--requests 500] [--viewers 2000] [--days 60]
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+def seed(app, viewers, days):
+    """One user with `days` daily stories seen by a rotating slice of `viewers`"""
+    import monitor as monitor_app
+    from models import db, User
+    from monitor import InstagramMonitor
+    from store import rebuild_rollups
+    from werkzeug.security import generate_password_hash
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        user = User(username='bench', email='bench@bench.local',
+                    password_hash=generate_password_hash('bench'), instagram_username='bench_account')
+        db.session.add(user)
+        db.session.commit()
+
+        monitor = InstagramMonitor(user.id, 'bench_account')
+        names = [f"viewer_{i:05d}" for i in range(viewers)]
+        real_datetime = monitor_app.datetime
+        start = real_datetime.now() - timedelta(days=days)
+        for day in range(days):
+            stamp = start + timedelta(days=day)
+
+            class FixedDatetime(real_datetime):
+                @classmethod
+                def now(cls, tz=None):
+                    return stamp
+
+            monitor_app.datetime = FixedDatetime
+            try:
+                offset = (day * viewers // 7) % viewers
+                seen = (names[offset:] + names[:offset])[:viewers // 2]
+                monitor.update_database({"viewers": seen, "likes": seen[::8]})
+            finally:
+                monitor_app.datetime = real_datetime
+        rebuild_rollups(user.id)
+
+
+def measure(client, path, requests):
+    started = time.perf_counter()
+    for _ in range(requests):
+        response = client.get(path)
+        assert response.status_code == 200, (path, response.status_code)
+    return requests / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--viewers', type=int, default=2000)
+    parser.add_argument('--days', type=int, default=60)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'bench_cache.db')
+    os.environ.setdefault('DATABASE_URL', f'sqlite:///{path}')
+
+    from app import create_app
+    from store import view_cache
+    app = create_app()
+    seed(app, args.viewers, args.days)
+
+    client = app.test_client()
+    client.post('/login', data={'username': 'bench', 'password': 'bench'})
+
+    print(f"{'path':<12} {'cache off (rps)':>16} {'cache on (rps)':>15} {'speedup':>8}")
+    for path in ('/dashboard', '/analytics', '/api/stats'):
+        view_cache.enabled = False
+        off = measure(client, path, args.requests)
+        view_cache.enabled = True
+        on = measure(client, path, args.requests)
+        print(f"{path:<12} {off:>16.0f} {on:>15.0f} {on / off:>7.1f}x")
+    print(f"cache stats: {view_cache.stats}")
+
+
+if __name__ == '__main__':
+    main()
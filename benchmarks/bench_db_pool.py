@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+Database load test: web reads and ingest writes on one primary vs a primary/replica pair
+Monitor-worker threads ingest growing viewer lists (store.write_snapshots,
+worker pool settings) while web threads request /dashboard, /analytics and
+/api/stats (web pool settings, view cache off) for --seconds. Scenarios,
+each in a fresh interpreter:
+
+- primary:      no replica, reads and writes share the primary
+- replica:      DATABASE_REPLICA_URL set, the read-only views use the replica
+- replica_down: the replica URL points nowhere; views fall back to the primary
+
+Reports reads and writes per second with their p50/p95 and failures,
+and per pool the checkouts, p95 checkout time (histogram bucket bound),
+timeouts and replica fallbacks, from the same metrics /metrics exposes.
+
+By default it starts a throwaway Postgres primary and a streaming replica
+(initdb, pg_ctl and pg_basebackup on PATH or in --pg-bin). --primary-url and
+--replica-url use existing servers instead. --sqlite runs without Postgres:
+the "replica" is a copy of the seeded file, so it shows routing and pool
+behaviour but not replication.
+
+Usage: python benchmarks/bench_db_pool.py [--users 20] [--days 30] [--viewers 300] [--seconds 20]
+                                          [--readers 16] [--writers 4] [--pg-bin DIR | --sqlite |
+                                          --primary-url URL --replica-url URL] [--json]
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+from datetime import datetime, timedelta
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+READ_PATHS = ('/dashboard', '/analytics', '/api/stats')
+SCENARIOS = ('primary', 'replica', 'replica_down')
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def viewer_list(user_id, count, rng):
+    seen = [f'viewer{user_id}_{i}' for i in range(count)]
+    return {'viewers': seen, 'likes': rng.sample(seen, len(seen) // 10)}
+
+
+# Local Postgres pair
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class PostgresPair:
+    """A primary and a streaming replica in a temporary directory, trust auth on 127.0.0.1"""
+
+    def __init__(self, pg_bin=None):
+        self.bin = lambda name: os.path.join(pg_bin, name) if pg_bin else (shutil.which(name) or name)
+        self.directory = tempfile.mkdtemp(prefix='bench_db_pool_')
+        self.ports = {'primary': free_port(), 'replica': free_port()}
+        self.started = []
+
+    def url(self, name):
+        return f"postgresql://postgres@127.0.0.1:{self.ports[name]}/postgres"
+
+    def _run(self, *command):
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+    def _start(self, name):
+        data = os.path.join(self.directory, name)
+        self._run(self.bin('pg_ctl'), '-D', data, '-w', '-l', os.path.join(self.directory, f'{name}.log'),
+                  '-o', f"-p {self.ports[name]} -k {self.directory} -c listen_addresses=127.0.0.1", 'start')
+        self.started.append(data)
+
+    def __enter__(self):
+        primary = os.path.join(self.directory, 'primary')
+        self._run(self.bin('initdb'), '-D', primary, '-U', 'postgres', '--auth=trust')
+        with open(os.path.join(primary, 'postgresql.conf'), 'a') as f:
+            f.write("wal_level = replica\nmax_wal_senders = 4\nhot_standby = on\n")
+        self._start('primary')
+        self._run(self.bin('pg_basebackup'), '-h', '127.0.0.1', '-p', str(self.ports['primary']), '-U', 'postgres',
+                  '-D', os.path.join(self.directory, 'replica'), '-R', '-X', 'stream')
+        self._start('replica')
+        return self
+
+    def __exit__(self, *exc):
+        for data in reversed(self.started):
+            subprocess.run([self.bin('pg_ctl'), '-D', data, '-m', 'fast', 'stop'],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def wait_for_replica(primary_url, replica_url, timeout=60):
+    from sqlalchemy import create_engine, text
+    primary, replica = create_engine(primary_url), create_engine(replica_url)
+    with primary.connect() as conn:
+        target = conn.execute(text('SELECT pg_current_wal_lsn()')).scalar()
+    deadline = time.time() + timeout
+    with replica.connect() as conn:
+        while not conn.execute(text('SELECT pg_last_wal_replay_lsn() >= :lsn'), {'lsn': target}).scalar():
+            if time.time() > deadline:
+                raise RuntimeError('replica did not catch up')
+            time.sleep(0.2)
+            conn.rollback()
+    primary.dispose()
+    replica.dispose()
+
+
+# Seeding (once, before the scenarios)
+
+def seed(args):
+    from flask import Flask
+    from models import db, init_app, User
+    from pipeline import make_snapshot
+    from store import write_snapshots
+
+    app = init_app(Flask('bench_db_pool_seed'), role='worker')
+    rng = random.Random(3)
+    today = datetime.now()
+    with app.app_context():
+        db.create_all()
+        for user_id in range(1, args.users + 1):
+            db.session.add(User(id=user_id, username=f'bench{user_id}', email=f'bench{user_id}@example.com',
+                                password_hash='-', instagram_username=f'account{user_id}'))
+        db.session.commit()
+        for day in range(args.days, 0, -1):
+            snapshots = [make_snapshot(user_id, viewer_list(user_id, rng.randint(args.viewers // 2, args.viewers), rng),
+                                       now=today - timedelta(days=day))
+                         for user_id in range(1, args.users + 1)]
+            write_snapshots(snapshots)
+
+
+# One scenario (in its own interpreter)
+
+def run_scenario(args):
+    os.environ['CACHE_BACKEND'] = 'off'
+    from flask import Flask
+    import app as web
+    import telemetry
+    from models import init_app
+    from pipeline import make_snapshot
+    from store import write_snapshots
+
+    web_app = web.create_app()
+    worker_app = init_app(Flask('bench_db_pool_worker'), role='worker')
+    stop = threading.Event()
+    lock = threading.Lock()
+    reads, writes, read_failures, write_failures = [], [], [], []
+
+    def reader(seed):
+        rng = random.Random(seed)
+        clients = {}
+        while not stop.is_set():
+            user_id = rng.randint(1, args.users)
+            if user_id not in clients:
+                clients[user_id] = web_app.test_client()
+                with clients[user_id].session_transaction() as session:
+                    session['_user_id'] = str(user_id)
+            started = time.perf_counter()
+            try:
+                status = clients[user_id].get(rng.choice(READ_PATHS)).status_code
+            except Exception as e:
+                status = repr(e)
+            with lock:
+                (reads if status == 200 else read_failures).append(time.perf_counter() - started)
+
+    def writer(seed):
+        rng = random.Random(seed)
+        counts = {}
+        while not stop.is_set():
+            user_id = rng.randint(1, args.users)
+            counts[user_id] = min(counts.get(user_id, 0) + 25, args.viewers)
+            snapshot = make_snapshot(user_id, viewer_list(user_id, counts[user_id], rng))
+            started = time.perf_counter()
+            try:
+                with worker_app.app_context():
+                    write_snapshots([snapshot])
+            except Exception:
+                with lock:
+                    write_failures.append(time.perf_counter() - started)
+                continue
+            with lock:
+                writes.append(time.perf_counter() - started)
+
+    threads = ([threading.Thread(target=reader, args=(i,)) for i in range(args.readers)]
+               + [threading.Thread(target=writer, args=(1000 + i,)) for i in range(args.writers)])
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    metrics = telemetry.registry.snapshot()
+    pools = {}
+    for labels, value in metrics['instagram_monitor_db_pool_checkout_seconds']['samples']:
+        buckets = metrics['instagram_monitor_db_pool_checkout_seconds']['buckets']
+        p95 = next((bound for bound, count in zip(buckets, value['buckets']) if count >= value['count'] * 0.95),
+                   float('inf'))
+        pools[f"{labels['role']}/{labels['pool']}"] = {'checkouts': value['count'], 'p95_checkout_s': p95}
+    for name in ('instagram_monitor_db_pool_timeouts_total',):
+        for labels, value in metrics[name]['samples']:
+            pools.setdefault(f"{labels['role']}/{labels['pool']}", {})['timeouts'] = value
+    fallbacks = {labels['reason']: value
+                 for labels, value in metrics['instagram_monitor_db_replica_fallbacks_total']['samples']}
+    return {
+        'reads_per_second': round(len(reads) / args.seconds, 1),
+        'read_p50_ms': round(percentile(reads, 0.5) * 1000, 1) if reads else None,
+        'read_p95_ms': round(percentile(reads, 0.95) * 1000, 1) if reads else None,
+        'writes_per_second': round(len(writes) / args.seconds, 1),
+        'write_p50_ms': round(percentile(writes, 0.5) * 1000, 1) if writes else None,
+        'write_p95_ms': round(percentile(writes, 0.95) * 1000, 1) if writes else None,
+        'read_failures': len(read_failures),
+        'write_failures': len(write_failures),
+        'pools': pools,
+        'replica_fallbacks': fallbacks,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--days', type=int, default=30, help='days of seeded history per user')
+    parser.add_argument('--viewers', type=int, default=300, help='viewers per story')
+    parser.add_argument('--seconds', type=float, default=20, help='duration of each scenario')
+    parser.add_argument('--readers', type=int, default=16, help='web request threads')
+    parser.add_argument('--writers', type=int, default=4, help='ingest threads')
+    parser.add_argument('--pg-bin', help='directory with initdb, pg_ctl and pg_basebackup')
+    parser.add_argument('--sqlite', action='store_true', help='SQLite files instead of Postgres')
+    parser.add_argument('--primary-url')
+    parser.add_argument('--replica-url')
+    parser.add_argument('--scenario', choices=SCENARIOS, help=argparse.SUPPRESS)
+    parser.add_argument('--json', action='store_true', help='print JSON instead of a table')
+    args = parser.parse_args()
+
+    if args.scenario:
+        print(json.dumps(run_scenario(args)))
+        return
+
+    pair = None
+    if args.primary_url:
+        primary_url, replica_url = args.primary_url, args.replica_url or args.primary_url
+    elif args.sqlite:
+        directory = tempfile.mkdtemp()
+        primary_url = f"sqlite:///{os.path.join(directory, 'primary.db')}"
+        replica_url = f"sqlite:///{os.path.join(directory, 'replica.db')}"
+    else:
+        pair = PostgresPair(args.pg_bin).__enter__()
+        primary_url, replica_url = pair.url('primary'), pair.url('replica')
+    unreachable = ('sqlite:////nonexistent/bench_db_pool/replica.db' if args.sqlite
+                   else f"postgresql://postgres@127.0.0.1:{free_port()}/postgres")
+
+    env = dict(os.environ, DATABASE_URL=primary_url, METRICS_DIR='off', INGEST_JOURNAL_DIR='off',
+               PYTHONPATH=ROOT)
+    env.pop('DATABASE_REPLICA_URL', None)
+    results = {}
+    try:
+        os.environ.update(env)
+        seed(args)
+        if args.sqlite:
+            shutil.copy(primary_url[len('sqlite:///'):], replica_url[len('sqlite:///'):])
+        elif pair is not None:
+            wait_for_replica(primary_url, replica_url)
+
+        replicas = {'primary': None, 'replica': replica_url, 'replica_down': unreachable}
+        passthrough = [arg for arg in sys.argv[1:] if arg != '--json']
+        for scenario in SCENARIOS:
+            scenario_env = dict(env, REPLICA_RETRY_SECONDS='5')
+            if replicas[scenario]:
+                scenario_env['DATABASE_REPLICA_URL'] = replicas[scenario]
+            output = subprocess.run([sys.executable, os.path.abspath(__file__), '--scenario', scenario] + passthrough,
+                                    env=scenario_env, check=True, capture_output=True, text=True).stdout
+            results[scenario] = json.loads(output.strip().splitlines()[-1])
+    finally:
+        if pair is not None:
+            pair.__exit__(None, None, None)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    backend = 'sqlite' if args.sqlite else 'postgres'
+    print(f"backend={backend} users={args.users} days={args.days} viewers={args.viewers} "
+          f"readers={args.readers} writers={args.writers} seconds={args.seconds:g}")
+    columns = [name for name in results['primary'] if name not in ('pools', 'replica_fallbacks')]
+    print(f"{'scenario':<14}" + ''.join(f"{name:>18}" for name in columns))
+    for scenario, result in results.items():
+        print(f"{scenario:<14}" + ''.join(f"{str(result[name]):>18}" for name in columns))
+    for scenario, result in results.items():
+        print(f"{scenario}: pools {json.dumps(result['pools'])} fallbacks {json.dumps(result['replica_fallbacks'])}")
+
+
+if __name__ == '__main__':
+    main()
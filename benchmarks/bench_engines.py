@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Scraper engine benchmark: Selenium threads vs asyncio tasks over DevTools
+Scrapes --accounts accounts once each, all due at the same moment (a worker
+that just claimed them), with both engines against the same offline
+fixtures (scraper_fixtures.py):
+
+- selenium: InstagramMonitor.scrape() on a thread pool as large as the
+            BrowserPool, one FakeDriver browser per pooled slot (worker.py's
+            default engine)
+- cdp:      AsyncInstagramMonitor.scrape() as one asyncio task per account,
+            sharing --pool-size FakeChrome browsers with --tabs tabs each
+            through CDPBrowserPool (SCRAPER_ENGINE=cdp)
+
+Both pay the same simulated browser startup, page load and per-command
+round trip. Each engine runs in a fresh interpreter; reported are wall
+time, scrapes per second, p50/p95 of how long after the start each
+account's scrape finished (how late its check lands), browser round trips
+per scrape, peak threads and peak RSS of the Python process (fake browsers
+have no processes of their own), and whether every scrape returned the
+fixture's viewers.
+
+Usage: python benchmarks/bench_engines.py [--accounts 200] [--viewers 50] [--pool-size 2] [--tabs 16]
+                                          [--startup-ms 1500] [--page-load-ms 300] [--call-latency-ms 2] [--json]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def rss_mb():
+    with open('/proc/self/status') as f:
+        return next(int(line.split()[1]) for line in f if line.startswith('VmRSS')) / 1024
+
+
+class Sampler:
+    """Peak thread count and RSS of this process while a run is going"""
+
+    def __init__(self):
+        self.threads = threading.active_count()
+        self.rss_mb = rss_mb()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(0.05):
+            self.threads = max(self.threads, threading.active_count() - 1)  # not counting the sampler
+            self.rss_mb = max(self.rss_mb, rss_mb())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def new_monitor(monitor_class, user_id, account, args):
+    monitor = monitor_class(user_id=user_id, instagram_username=account)
+    monitor.base_url = 'https://fixtures.local'
+    monitor.harvest_mode = 'full'
+    monitor.wait_timeout = args.wait_timeout
+    monitor.ring_grace = args.wait_timeout
+    return monitor
+
+
+def run_selenium(app_module, accounts, args):
+    from browser_pool import BrowserPool
+    from scraper_fixtures import FakeDriver
+
+    drivers = []
+
+    def factory():
+        time.sleep(args.startup_ms / 1000)
+        driver = FakeDriver(accounts, latency=args.call_latency_ms / 1000, page_load=args.page_load_ms / 1000)
+        drivers.append(driver)
+        return driver
+
+    pool = app_module.browser_pool = BrowserPool(factory, size=args.pool_size)
+    pending = list(enumerate(accounts, start=1))
+    lock = threading.Lock()
+    timings, results = [], {}
+
+    def run():
+        while True:
+            with lock:
+                if not pending:
+                    return
+                user_id, account = pending.pop(0)
+            monitor = new_monitor(app_module.InstagramMonitor, user_id, account, args)
+            try:
+                results[account] = monitor.scrape()
+            except Exception as e:
+                results[account] = repr(e)
+            timings.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=run) for _ in range(pool.size)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    pool.close()
+    return wall, timings, results, sum(driver.call_count for driver in drivers)
+
+
+def run_cdp(app_module, accounts, args):
+    import asyncio
+    from cdp import CDPBrowserPool
+    from scraper_fixtures import FakeChrome
+
+    browsers = []
+
+    async def launch():
+        await asyncio.sleep(args.startup_ms / 1000)
+        chrome = FakeChrome(accounts, latency=args.call_latency_ms / 1000, page_load=args.page_load_ms / 1000)
+        browsers.append(chrome)
+        return chrome
+
+    pool = app_module.cdp_pool = CDPBrowserPool(launch, size=args.pool_size, tabs_per_browser=args.tabs,
+                                                setup=app_module.setup_tab)
+    timings, results = [], {}
+
+    async def scrape(user_id, account, started):
+        monitor = new_monitor(app_module.AsyncInstagramMonitor, user_id, account, args)
+        try:
+            results[account] = await monitor.scrape()
+        except Exception as e:
+            results[account] = repr(e)
+        timings.append(time.perf_counter() - started)
+
+    async def main():
+        started = time.perf_counter()
+        await asyncio.gather(*(scrape(user_id, account, started)
+                               for user_id, account in enumerate(accounts, start=1)))
+        wall = time.perf_counter() - started
+        await pool.close()
+        return wall
+
+    wall = asyncio.run(main())
+    return wall, timings, results, sum(sum(chrome.connection.calls.values()) for chrome in browsers)
+
+
+def run_engine(engine, args):
+    """One engine in this interpreter; returns its measurements"""
+    os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench_engines.db')}")
+    os.environ['METRICS_DIR'] = 'off'
+    os.environ['OUTBOUND_BACKEND'] = 'off'  # measure the engines, not the host's request budget
+    os.environ['SESSION_STORE'] = 'off'
+    import monitor as app_module
+    from scraper_fixtures import synthetic_accounts
+
+    viewers = synthetic_accounts([args.viewers], without_story=0)[f'story_{args.viewers}']
+    accounts = {f'story_{args.viewers}_{i}': viewers for i in range(1, args.accounts + 1)}
+    expected = [username for username, _ in viewers]
+
+    with Sampler() as sampler:
+        run = run_cdp if engine == 'cdp' else run_selenium
+        wall, timings, results, round_trips = run(app_module, accounts, args)
+    correct = sum(1 for data in results.values() if isinstance(data, dict) and data['viewers'] == expected)
+    return {
+        'engine': engine,
+        'wall_seconds': round(wall, 2),
+        'scrapes_per_second': round(len(accounts) / wall, 1),
+        'p50_done_seconds': round(percentile(timings, 0.5), 2),
+        'p95_done_seconds': round(percentile(timings, 0.95), 2),
+        'round_trips_per_scrape': round(round_trips / len(accounts), 1),
+        'peak_threads': sampler.threads,
+        'peak_rss_mb': round(sampler.rss_mb, 1),
+        'correct': f"{correct}/{len(accounts)}",
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--accounts', type=int, default=200)
+    parser.add_argument('--viewers', type=int, default=50, help='viewers on each story')
+    parser.add_argument('--pool-size', type=int, default=2, help='browsers, for both engines')
+    parser.add_argument('--tabs', type=int, default=16, help='tabs per browser for the cdp engine')
+    parser.add_argument('--startup-ms', type=float, default=1500, help='simulated browser startup')
+    parser.add_argument('--page-load-ms', type=float, default=300, help='simulated page load')
+    parser.add_argument('--call-latency-ms', type=float, default=2, help='simulated browser round trip')
+    parser.add_argument('--wait-timeout', type=float, default=2.0)
+    parser.add_argument('--engine', choices=('selenium', 'cdp'), help='run only this engine, in this interpreter')
+    parser.add_argument('--json', action='store_true', help='print JSON instead of a table')
+    args = parser.parse_args()
+
+    if args.engine:
+        print(json.dumps(run_engine(args.engine, args)))
+        return
+
+    results = []
+    for engine in ('selenium', 'cdp'):
+        command = [sys.executable, os.path.abspath(__file__), '--engine', engine] + sys.argv[1:]
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"accounts={args.accounts} viewers={args.viewers} browsers={args.pool_size} tabs={args.tabs} "
+          f"startup={args.startup_ms:.0f}ms page_load={args.page_load_ms:.0f}ms latency={args.call_latency_ms:.0f}ms")
+    for name in results[0]:
+        print(f"{name:<24}" + ''.join(f"{str(result[name]):>12}" for result in results))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Ingest benchmark for InstagramMonitor.update_database
+Compares the per-username ORM path with the set-based bulk path
+
+Usage: python benchmarks/bench_ingest.py [--sizes 100,1000,10000] [--database-url URL]
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+def legacy_update_database(monitor, story_data):
+    """The original one-query-per-username ingest, kept for comparison"""
+    from models import db, Story, Viewer, StoryViewer
+
+    story_date = datetime.now().date()
+    story = Story.query.filter_by(user_id=monitor.user_id, story_date=story_date).first()
+    if not story:
+        story = Story(user_id=monitor.user_id, story_date=story_date)
+        db.session.add(story)
+        db.session.commit()
+    story.last_checked = datetime.utcnow()
+
+    for viewer_username in story_data["viewers"]:
+        viewer = Viewer.query.filter_by(user_id=monitor.user_id, username=viewer_username).first()
+        if not viewer:
+            viewer = Viewer(user_id=monitor.user_id, username=viewer_username)
+            db.session.add(viewer)
+            db.session.commit()
+        viewer.last_seen = datetime.utcnow()
+        story_viewer = StoryViewer.query.filter_by(story_id=story.id, viewer_id=viewer.id).first()
+        if not story_viewer:
+            db.session.add(StoryViewer(story_id=story.id, viewer_id=viewer.id, has_viewed=True))
+            viewer.total_views += 1
+        else:
+            story_viewer.has_viewed = True
+            story_viewer.last_updated = datetime.utcnow()
+
+    for liker_username in story_data["likes"]:
+        viewer = Viewer.query.filter_by(user_id=monitor.user_id, username=liker_username).first()
+        if viewer:
+            story_viewer = StoryViewer.query.filter_by(story_id=story.id, viewer_id=viewer.id).first()
+            if story_viewer and not story_viewer.has_liked:
+                story_viewer.has_liked = True
+                story_viewer.last_updated = datetime.utcnow()
+                viewer.total_likes += 1
+
+    story.total_views = len(StoryViewer.query.filter_by(story_id=story.id, has_viewed=True).all())
+    story.total_likes = len(StoryViewer.query.filter_by(story_id=story.id, has_liked=True).all())
+    db.session.commit()
+
+
+def make_story_data(size):
+    """Synthetic scrape: every viewer seen, every tenth one liked"""
+    viewers = [f"viewer_{i:05d}" for i in range(size)]
+    return {"viewers": viewers, "likes": viewers[::10]}
+
+
+def run(size, ingest, label):
+    from sqlalchemy import event
+    from models import db, User, Viewer
+    from monitor import app, InstagramMonitor
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        user = User(username=f"bench_{label}", email=f"{label}@bench.local", password_hash="x")
+        db.session.add(user)
+        db.session.commit()
+        monitor = InstagramMonitor(user.id, "bench_account")
+        story_data = make_story_data(size)
+
+        statements = [0]
+
+        def count(*args):
+            statements[0] += 1
+
+        engine = db.engine
+        event.listen(engine, "before_cursor_execute", count)
+        try:
+            results = {}
+            # First tick inserts everything, second tick re-reads the same list
+            for tick in ("cold", "warm"):
+                statements[0] = 0
+                started = time.perf_counter()
+                ingest(monitor, story_data)
+                results[tick] = (statements[0], time.perf_counter() - started)
+        finally:
+            event.remove(engine, "before_cursor_execute", count)
+
+        total_views = db.session.query(db.func.sum(Viewer.total_views)).scalar()
+        assert total_views == size, f"{label}: expected {size} views, got {total_views}"
+        db.session.remove()
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='100,1000,10000')
+    parser.add_argument('--database-url', default=None)
+    parser.add_argument('--skip-legacy-above', type=int, default=10000,
+                        help='skip the legacy path for larger sizes (it is slow)')
+    args = parser.parse_args()
+
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    else:
+        path = os.path.join(tempfile.mkdtemp(), 'bench_ingest.db')
+        os.environ['DATABASE_URL'] = f'sqlite:///{path}'
+
+    from monitor import InstagramMonitor
+
+    print(f"{'viewers':>8} {'path':>7} {'tick':>5} {'round trips':>12} {'wall (s)':>10}")
+    for size in [int(s) for s in args.sizes.split(',')]:
+        paths = [("bulk", InstagramMonitor.update_database)]
+        if size <= args.skip_legacy_above:
+            paths.insert(0, ("legacy", legacy_update_database))
+        for label, ingest in paths:
+            for tick, (trips, elapsed) in run(size, ingest, label).items():
+                print(f"{size:>8} {label:>7} {tick:>5} {trips:>12} {elapsed:>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
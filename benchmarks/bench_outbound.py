@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Outbound budget benchmark: monitors started together, with and without the limiter
+Starts --monitors monitors spread over --processes worker processes at the
+same moment, as a deploy does. Each one runs --checks profile visits and
+viewer scrapes every --interval seconds against FakeDriver pages that take
+--page-load seconds to load. The fake site, shared by every process, answers
+page loads beyond --site-limit per second with Instagram's "please wait"
+page. Runs once with OUTBOUND_BACKEND=off and once with the shared local
+backend. Reports peak concurrent page loads, peak loads in any second,
+rate-limit pages served, check results and how long navigations queued
+for the budget.
+
+Usage: python benchmarks/bench_outbound.py [--monitors 24] [--processes 3] [--checks 3] [--interval 30]
+                                           [--page-load 0.3] [--site-limit 4] [--rate 3] [--burst 3]
+                                           [--concurrency 3] [--start-jitter 10] [--json]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_process(args, backend, outbound_path, accounts_for, site_lock, site_loads, start_at):
+    """One worker process: a thread per monitor, all starting at ``start_at``"""
+    os.environ.update({
+        'DATABASE_URL': f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench_outbound.db')}",
+        'METRICS_DIR': 'off',
+        'OUTBOUND_BACKEND': backend,
+        'OUTBOUND_PATH': outbound_path,
+        'OUTBOUND_RATE': str(args.rate),
+        'OUTBOUND_BURST': str(args.burst),
+        'OUTBOUND_CONCURRENCY': str(args.concurrency),
+        'OUTBOUND_START_JITTER': str(args.start_jitter),
+        'OUTBOUND_MAX_WAIT': str(args.interval),
+    })
+    import monitor as app_module
+    import telemetry
+    from rate_limit import Throttled
+    from scraper_fixtures import FakeDriver, SiteLimit
+
+    accounts = {name: [(f'{name}.viewer_{i:02d}', i % 10 == 0) for i in range(50)] for name in accounts_for}
+    site = SiteLimit(args.site_limit, lock=site_lock, loads=site_loads)
+    loads, results = [], {}
+    lock = threading.Lock()
+
+    def monitor(account):
+        instagram = app_module.InstagramMonitor(user_id=0, instagram_username=account)
+        instagram.harvest_mode = 'visible'
+        instagram.wait_timeout = 0.5
+        instagram.ring_grace = 0.2
+        driver = FakeDriver(accounts, page_load=args.page_load, site=site)
+        get = driver.get
+
+        def timed_get(url):
+            started = time.time()
+            try:
+                get(url)
+            finally:
+                with lock:
+                    loads.append((started, time.time()))
+
+        driver.get = timed_get
+        instagram.driver = driver
+        time.sleep(max(start_at - time.time(), 0) + app_module.outbound.start_delay())
+        for _ in range(args.checks):
+            began = time.time()
+            try:
+                result = 'story' if instagram.go_to_profile() and instagram.get_story_data()['viewers'] else 'failed'
+            except Throttled:
+                result = 'throttled'
+            with lock:
+                results[result] = results.get(result, 0) + 1
+            time.sleep(max(began + args.interval - time.time(), 0))
+
+    threads = [threading.Thread(target=monitor, args=(account,)) for account in accounts_for]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    waits = [sample for _, sample in telemetry.outbound_wait_seconds.snapshot()['samples']]
+    return {
+        'loads': loads,
+        'results': results,
+        'refused': site.refused,
+        'wait_sum': sum(sample['sum'] for sample in waits),
+        'wait_count': sum(sample['count'] for sample in waits),
+    }
+
+
+def peak_concurrency(loads):
+    events = sorted([(start, 1) for start, _ in loads] + [(end, -1) for _, end in loads])
+    current = peak = 0
+    for _, change in events:
+        current += change
+        peak = max(peak, current)
+    return peak
+
+
+def peak_per_second(loads):
+    starts = sorted(start for start, _ in loads)
+    peak, first = 0, 0
+    for last, at in enumerate(starts):
+        while starts[first] <= at - 1.0:
+            first += 1
+        peak = max(peak, last - first + 1)
+    return peak
+
+
+def run(args, backend):
+    accounts = [f'account_{i:03d}' for i in range(args.monitors)]
+    shares = [accounts[i::args.processes] for i in range(args.processes)]
+    outbound_path = os.path.join(tempfile.mkdtemp(), 'outbound.db')
+    context = multiprocessing.get_context('spawn')
+    with context.Manager() as manager, ProcessPoolExecutor(args.processes, mp_context=context) as executor:
+        site_lock, site_loads = manager.Lock(), manager.list()
+        start_at = time.time() + 5  # time for every process to import the app
+        futures = [executor.submit(run_process, args, backend, outbound_path, share, site_lock, site_loads, start_at)
+                   for share in shares]
+        parts = [future.result() for future in futures]
+
+    loads = [load for part in parts for load in part['loads']]
+    results = {}
+    for part in parts:
+        for result, count in part['results'].items():
+            results[result] = results.get(result, 0) + count
+    wait_count = sum(part['wait_count'] for part in parts)
+    return {
+        'page_loads': len(loads),
+        'peak_concurrent_loads': peak_concurrency(loads),
+        'peak_loads_per_second': peak_per_second(loads),
+        'rate_limit_pages': sum(part['refused'] for part in parts),
+        'checks': results,
+        'mean_queue_wait_s': round(sum(part['wait_sum'] for part in parts) / wait_count, 2) if wait_count else 0,
+        'seconds': round(max(end for _, end in loads) - min(start for start, _ in loads), 1) if loads else 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--monitors', type=int, default=24)
+    parser.add_argument('--processes', type=int, default=3)
+    parser.add_argument('--checks', type=int, default=3, help='checks per monitor')
+    parser.add_argument('--interval', type=float, default=30, help='seconds between checks (fixed cadence)')
+    parser.add_argument('--page-load', type=float, default=0.3, help='seconds per page load')
+    parser.add_argument('--site-limit', type=int, default=4, help='page loads per second the site accepts')
+    parser.add_argument('--rate', type=float, default=3, help='OUTBOUND_RATE')
+    parser.add_argument('--burst', type=float, default=3, help='OUTBOUND_BURST')
+    parser.add_argument('--concurrency', type=int, default=3, help='OUTBOUND_CONCURRENCY')
+    parser.add_argument('--start-jitter', type=float, default=10, help='OUTBOUND_START_JITTER')
+    parser.add_argument('--json', action='store_true', help='print JSON instead of a table')
+    args = parser.parse_args()
+
+    results = {backend: run(args, backend) for backend in ('off', 'local')}
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"monitors={args.monitors} processes={args.processes} checks={args.checks} "
+          f"site_limit={args.site_limit}/s rate={args.rate}/s concurrency={args.concurrency}")
+    print(f"{'budget':<7} {'loads':>6} {'peak conc':>10} {'peak/s':>7} {'429 pages':>10} "
+          f"{'wait s':>7} {'seconds':>8}  checks")
+    for backend, result in results.items():
+        print(f"{backend:<7} {result['page_loads']:>6} {result['peak_concurrent_loads']:>10} "
+              f"{result['peak_loads_per_second']:>7} {result['rate_limit_pages']:>10} "
+              f"{result['mean_queue_wait_s']:>7} {result['seconds']:>8}  {result['checks']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Ingest pipeline benchmark: inline writes vs the batched writer
+Scraper threads produce snapshots for their accounts as fast as the
+simulated scrape time allows and hand them to ingest, either inline
+(write_snapshots per scrape, as monitors did before) or through
+IngestPipeline. Reports how long scrapers were stalled by ingest,
+snapshots written per second and database commits.
+
+Usage: python benchmarks/bench_pipeline.py [--accounts 20] [--scrapes 10] [--viewers 300]
+                                           [--scrapers 4] [--scrape-ms 50] [--db-url URL] [--json]
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+def scrape_stream(accounts, scrapes, viewers, seed=7):
+    """Per-account viewer lists that grow between scrapes, like a fresh story"""
+    rng = random.Random(seed)
+    stream = []
+    for round_ in range(1, scrapes + 1):
+        for user_id in accounts:
+            seen = [f'viewer{user_id}_{i}' for i in range(viewers * round_ // scrapes)]
+            stream.append((user_id, {'viewers': seen, 'likes': rng.sample(seen, len(seen) // 10)}))
+    return stream
+
+
+def run(mode, app_module, stream, args, journal_dir):
+    from pipeline import IngestPipeline, Journal, make_snapshot
+
+    commits = [0]
+
+    def count_commit(session):
+        commits[0] += 1
+
+    from sqlalchemy import event
+    event.listen(app_module.db.session, 'after_commit', count_commit)
+
+    pipeline = None
+    if mode == 'pipeline':
+        pipeline = IngestPipeline(app_module.write_snapshots, queue_size=args.queue_size,
+                                  batch_size=args.batch_size, batch_wait=args.batch_wait,
+                                  writers=args.writers, journal=Journal(journal_dir))
+        pipeline.start()
+
+    lock = threading.Lock()
+    pending = list(stream)
+    stalls = []
+
+    def scraper():
+        while True:
+            with lock:
+                if not pending:
+                    return
+                user_id, story_data = pending.pop(0)
+            time.sleep(args.scrape_ms / 1000)
+            snapshot = make_snapshot(user_id, story_data, {'user_id': user_id})
+            started = time.perf_counter()
+            if pipeline is not None:
+                pipeline.submit(snapshot)
+            else:
+                app_module.write_snapshots([snapshot])
+            with lock:
+                stalls.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=scraper) for _ in range(args.scrapers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if pipeline is not None:
+        pipeline.stop(timeout=600)
+    elapsed = time.perf_counter() - started
+    event.remove(app_module.db.session, 'after_commit', count_commit)
+
+    stalls.sort()
+    return {
+        'snapshots': len(stream),
+        'seconds': round(elapsed, 2),
+        'snapshots_per_second': round(len(stream) / elapsed, 1),
+        'commits': commits[0],
+        'stall_mean_ms': round(sum(stalls) / len(stalls) * 1000, 2),
+        'stall_p95_ms': round(stalls[int(len(stalls) * 0.95)] * 1000, 2),
+        'batches': pipeline.stats['batches'] if pipeline else commits[0],
+    }
+
+
+def reset(app_module, accounts):
+    from models import User
+    with app_module.app.app_context():
+        app_module.db.drop_all()
+        app_module.db.create_all()
+        for user_id in accounts:
+            app_module.db.session.add(User(
+                id=user_id, username=f'bench{user_id}', email=f'bench{user_id}@example.com',
+                password_hash='-', instagram_username=f'account{user_id}'))
+        app_module.db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--accounts', type=int, default=20)
+    parser.add_argument('--scrapes', type=int, default=10, help='scrapes per account')
+    parser.add_argument('--viewers', type=int, default=300, help='viewers per story by the last scrape')
+    parser.add_argument('--scrapers', type=int, default=4, help='concurrent scraper threads')
+    parser.add_argument('--scrape-ms', type=float, default=50, help='simulated browser time per scrape')
+    parser.add_argument('--queue-size', type=int, default=100)
+    parser.add_argument('--batch-size', type=int, default=20)
+    parser.add_argument('--batch-wait', type=float, default=0.2)
+    parser.add_argument('--writers', type=int, default=1)
+    parser.add_argument('--db-url', default=None, help='database to use (default: a temporary SQLite file)')
+    parser.add_argument('--json', action='store_true', help='print JSON instead of a table')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = args.db_url or f"sqlite:///{os.path.join(workdir, 'bench_pipeline.db')}"
+    os.environ['INGEST_MODE'] = 'inline'  # the benchmark builds its own pipelines
+    import monitor as app_module
+
+    accounts = list(range(1, args.accounts + 1))
+    stream = scrape_stream(accounts, args.scrapes, args.viewers)
+    results = {}
+    for mode in ('inline', 'pipeline'):
+        reset(app_module, accounts)
+        with app_module.app.app_context():
+            results[mode] = run(mode, app_module, stream, args, os.path.join(workdir, f'journal-{mode}'))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"accounts={args.accounts} scrapes={args.scrapes} viewers={args.viewers} scrapers={args.scrapers}")
+    print(f"{'mode':<10} {'snapshots/s':>12} {'commits':>8} {'stall ms':>9} {'p95 ms':>8} {'seconds':>8}")
+    for mode, result in results.items():
+        print(f"{mode:<10} {result['snapshots_per_second']:>12} {result['commits']:>8} "
+              f"{result['stall_mean_ms']:>9} {result['stall_p95_ms']:>8} {result['seconds']:>8}")
+
+
+if __name__ == '__main__':
+    main()
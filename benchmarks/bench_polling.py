@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Polling benchmark: PollPolicy over simulated story timelines
+Replays each account's day on a simulated clock, checking it whenever the
+policy says it is due, and compares the checks spent with the fixed
+300-second cadence:
+
+- growing:       one story whose viewers keep arriving for --growth-hours
+- back_to_back:  an account that posts again before its ring expires, so a
+                 story is up for all of --days days
+- no_story:      an account that never has a story up
+- incremental:   the growing story scraped by InstagramMonitor in
+                 incremental harvest mode, so each scrape after the first
+                 returns only the newcomers plus one batch of stored viewers;
+                 record_scrape ingests it (SQLite in a temporary directory)
+                 and its count drives the policy
+
+Reported per timeline: checks, fixed-cadence checks, how long after the
+story day began its first check landed (worst day) and the largest
+interval used while viewers were still arriving. The run fails when the
+interval grows on a check that found more viewers, or when a new story day
+is not picked up at the minimum interval.
+
+Usage: python benchmarks/bench_polling.py [--days 3] [--viewers 500] [--growth-hours 6] [--batch 12]
+                                          [--min-interval 60] [--max-interval 1800] [--json]
+"""
+
+import os
+import sys
+import json
+import math
+import argparse
+import tempfile
+import contextlib
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from scheduling import BASELINE_INTERVAL, PollPolicy
+
+START = datetime(2026, 1, 5)  # a local midnight; days roll over at the story day boundary
+
+
+def growing(args):
+    """Viewers of one story posted at START, arriving fast at first"""
+    def viewers_at(t):
+        if t >= 24 * 3600:
+            return None
+        return int(args.viewers * (1 - math.exp(-t / (args.growth_hours * 3600 / 3))))
+    return viewers_at
+
+
+def back_to_back(args):
+    """A new story every morning before yesterday's expires; each day's viewers grow again"""
+    def viewers_at(t):
+        day_seconds = t % (24 * 3600)
+        return int(args.viewers * (1 - math.exp(-day_seconds / (args.growth_hours * 3600 / 3))))
+    return viewers_at
+
+
+def no_story(args):
+    return lambda t: None
+
+
+def story_check(viewers_at):
+    """check(t) -> (viewer count, story date) straight from a timeline"""
+    def check(t):
+        count = viewers_at(t)
+        return count, (START + timedelta(seconds=t)).date() if count is not None else None
+    return check
+
+
+def incremental_check(args):
+    """check(t) through InstagramMonitor.record_scrape, fed incremental harvests of the growing story"""
+    os.environ.update({
+        'DATABASE_URL': f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench_polling.db')}",
+        'METRICS_DIR': 'off',
+        'INGEST_MODE': 'inline',
+        'OUTBOUND_BACKEND': 'off',
+        'SESSION_STORE': 'off',
+    })
+    import monitor as app_module
+    from models import db
+
+    with app_module.app.app_context():
+        db.create_all()
+    instagram = app_module.InstagramMonitor(user_id=1, instagram_username='bench_polling')
+    instagram.harvest_mode = 'incremental'
+    viewers_at = growing(args)
+    everyone = [f'viewer_{i:05d}' for i in range(args.viewers)]
+    quiet = open(os.devnull, 'w')
+
+    def check(t):
+        count = viewers_at(t)
+        story_data = None
+        if count is not None:
+            newest_first = everyone[:count][::-1]
+            with app_module.app.app_context():
+                known = instagram.known_viewers()
+                new = sum(1 for username in newest_first if username not in known)
+                # Whole scroll batches, up to and including the first one of stored viewers
+                harvested = (math.ceil(new / args.batch) + 1) * args.batch if known else count
+                story_data = {'viewers': newest_first[:harvested], 'likes': []}
+        # record_scrape logs every ingest; keep the report readable
+        with app_module.app.app_context(), contextlib.redirect_stdout(quiet):
+            return instagram.record_scrape(story_data), instagram.story_date
+    return check
+
+
+TIMELINES = {
+    'growing': lambda args: story_check(growing(args)),
+    'back_to_back': lambda args: story_check(back_to_back(args)),
+    'no_story': lambda args: story_check(no_story(args)),
+    'incremental': incremental_check,
+}
+
+
+def simulate(name, args):
+    policy = PollPolicy(min_interval=args.min_interval, max_interval=args.max_interval)
+    state = policy.new_state()
+    check = TIMELINES[name](args)
+    # The monitor dates its stories by the real day, so its timeline stays within one
+    duration = (1 if name == 'incremental' else args.days) * 24 * 3600
+    t, checks, previous = 0, 0, None
+    first_check_of_day = {}
+    growing_interval = 0
+    failures = []
+
+    while t < duration:
+        count, story_date = check(t)
+        before = state.interval
+        delay = policy.next_interval(state, count, now=START.timestamp() + t, story_date=story_date)
+        checks += 1
+        if story_date is not None and story_date not in first_check_of_day:
+            first_check_of_day[story_date] = t % (24 * 3600)
+            if delay != args.min_interval:
+                failures.append(f"{name}: {story_date} started at {delay}s, not {args.min_interval}s")
+        if count is not None and previous is not None and count > previous:
+            growing_interval = max(growing_interval, delay)
+            if delay > before:
+                failures.append(f"{name}: interval grew {before}s -> {delay}s at t={t}s "
+                                f"while viewers went {previous} -> {count}")
+        previous = count
+        t += delay
+
+    return {
+        'timeline': name,
+        'checks': checks,
+        'fixed_checks': duration // BASELINE_INTERVAL,
+        'days_with_story': len(first_check_of_day),
+        'worst_first_check_seconds': max(first_check_of_day.values()) if first_check_of_day else None,
+        'max_interval_while_growing': growing_interval or None,
+    }, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--days', type=int, default=3)
+    parser.add_argument('--viewers', type=int, default=500, help='viewers each story ends up with')
+    parser.add_argument('--growth-hours', type=float, default=6, help='hours until ~95%% of viewers arrived')
+    parser.add_argument('--batch', type=int, default=12, help='viewer rows per scroll batch (incremental)')
+    parser.add_argument('--min-interval', type=int, default=60)
+    parser.add_argument('--max-interval', type=int, default=1800)
+    parser.add_argument('--json', action='store_true', help='print JSON instead of a table')
+    args = parser.parse_args()
+
+    results, failures = [], []
+    for name in TIMELINES:
+        result, failed = simulate(name, args)
+        results.append(result)
+        failures += failed
+
+    if args.json:
+        print(json.dumps({'results': results, 'failures': failures}, indent=2))
+    else:
+        print(f"days={args.days} viewers={args.viewers} growth={args.growth_hours}h "
+              f"interval={args.min_interval}-{args.max_interval}s")
+        for name in results[0]:
+            print(f"{name:<28}" + ''.join(f"{str(result[name]):>14}" for result in results))
+        for failure in failures:
+            print(f"FAIL {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
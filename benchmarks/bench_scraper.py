@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Offline scraper benchmark for InstagramMonitor
+Runs go_to_profile and get_story_data against the fixtures in
+scraper_fixtures.py, with a fake WebDriver (default) or headless Chrome
+pointed at a local fixture server. Reports scrapes per minute, WebDriver
+calls per scrape, bytes downloaded and requests blocked per scrape (see
+--block) and viewer/like extraction accuracy for each list size.
+
+In incremental harvest mode the monitor is primed with the oldest
+--known-fraction of viewers, as on a re-scrape of the same story; accuracy
+then counts what the database would hold afterwards.
+
+Usage: python benchmarks/bench_scraper.py [--driver fake|chrome] [--sizes 10,100,1000,5000]
+                                          [--scrapes 5] [--harvest-mode full|incremental|visible]
+                                          [--extraction-mode script|element]
+                                          [--block image,media,font,beacon|off] [--json]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from resource_blocking import ResourcePolicy
+from scraper_fixtures import FakeDriver, FixtureServer, load_accounts, synthetic_accounts
+
+
+def accuracy(found, expected):
+    """Precision and recall of a scraped username set"""
+    found, expected = set(found), set(expected)
+    hits = len(found & expected)
+    return {
+        'precision': round(hits / len(found), 4) if found else (1.0 if not expected else 0.0),
+        'recall': round(hits / len(expected), 4) if expected else 1.0,
+    }
+
+
+class CountingDriver:
+    """Counts the WebDriver protocol commands a real driver sends"""
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.calls = {}
+        execute = driver.execute
+
+        def counted(command, params=None):
+            self.calls[command] = self.calls.get(command, 0) + 1
+            return execute(command, params)
+
+        driver.execute = counted
+
+    @property
+    def call_count(self):
+        return sum(self.calls.values())
+
+
+def make_monitor(account, args, base_url):
+    from monitor import InstagramMonitor
+
+    monitor = InstagramMonitor(user_id=0, instagram_username=account)
+    monitor.base_url = base_url
+    monitor.extraction_mode = 'script' if args.extraction_mode == 'script' else 'element'
+    monitor.harvest_mode = args.harvest_mode
+    monitor.wait_timeout = args.wait_timeout
+    monitor.ring_grace = args.ring_grace
+    return monitor
+
+
+def scrape_once(monitor, driver, viewers, args, policy):
+    """One profile visit and viewer scrape; returns (seconds, calls, result, known, traffic)"""
+    known = set()
+    if args.harvest_mode == 'incremental' and viewers:
+        # Newest first, so the already-stored viewers are the tail of the list
+        keep = int(len(viewers) * args.known_fraction)
+        known = {username for username, _ in viewers[len(viewers) - keep:]} if keep else set()
+    monitor._known_viewers = known
+    # Prime known_viewers() for today's story so it skips the database
+    monitor._known_viewers_date = datetime.now().date()
+
+    monitor.driver = driver.driver if isinstance(driver, CountingDriver) else driver
+    policy.traffic(monitor.driver)
+    before = driver.call_count
+    started = time.perf_counter()
+    try:
+        data = monitor.get_story_data() if monitor.go_to_profile() else None
+    finally:
+        elapsed, calls = time.perf_counter() - started, driver.call_count - before
+        traffic = policy.traffic(monitor.driver)
+        monitor.driver = None
+    return elapsed, calls, data, known, traffic
+
+
+def run_account(account, viewers, driver, base_url, args, policy):
+    monitor = make_monitor(account, args, base_url)
+    seconds, calls, recalls, like_recalls, precisions, traffic = [], [], [], [], [], []
+    for _ in range(args.scrapes):
+        elapsed, count, data, known, scrape_traffic = scrape_once(monitor, driver, viewers, args, policy)
+        seconds.append(elapsed)
+        calls.append(count)
+        if scrape_traffic:
+            traffic.append(scrape_traffic)
+        if viewers is None:
+            precisions.append(1.0 if data is None else 0.0)
+            recalls.append(1.0 if data is None else 0.0)
+            like_recalls.append(1.0)
+            continue
+        data = data or {'viewers': [], 'likes': []}
+        expected = [username for username, _ in viewers]
+        expected_likes = [username for username, liked in viewers if liked]
+        viewer_score = accuracy(set(data['viewers']) | known, expected)
+        # Likes of already-stored viewers were recorded by the earlier scrape
+        known_likes = {username for username in expected_likes if username in known}
+        like_score = accuracy(set(data['likes']) | known_likes, expected_likes)
+        precisions.append(viewer_score['precision'])
+        recalls.append(viewer_score['recall'])
+        like_recalls.append(like_score['recall'])
+
+    total = sum(seconds)
+    return {
+        'viewers': len(viewers) if viewers is not None else 0,
+        'has_story': viewers is not None,
+        'scrapes': args.scrapes,
+        'scrapes_per_minute': round(args.scrapes / total * 60, 1) if total else None,
+        'seconds_per_scrape': round(total / args.scrapes, 4),
+        'webdriver_calls_per_scrape': round(sum(calls) / len(calls), 1),
+        'kb_per_scrape': round(sum(t['bytes'] for t in traffic) / len(traffic) / 1024, 1) if traffic else None,
+        'requests_per_scrape': round(sum(t['requests'] for t in traffic) / len(traffic), 1) if traffic else None,
+        'blocked_per_scrape': round(sum(sum(t['blocked'].values()) for t in traffic) / len(traffic), 1)
+                              if traffic else None,
+        'kb_saved_per_scrape': round(sum(t['bytes_saved'] for t in traffic) / len(traffic) / 1024, 1)
+                               if traffic else None,
+        'viewer_precision': min(precisions),
+        'viewer_recall': min(recalls),
+        'like_recall': min(like_recalls),
+        'steps': {step: round(value, 4) for step, value in monitor.step_timings.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--driver', choices=('fake', 'chrome'), default='fake')
+    parser.add_argument('--sizes', default='10,100,1000,5000')
+    parser.add_argument('--fixtures', default=None, help='recorded fixture JSON instead of synthetic accounts')
+    parser.add_argument('--scrapes', type=int, default=5, help='scrapes per account')
+    parser.add_argument('--harvest-mode', choices=('full', 'incremental', 'visible'), default='full')
+    parser.add_argument('--extraction-mode', choices=('script', 'element'), default='script')
+    parser.add_argument('--known-fraction', type=float, default=0.9)
+    parser.add_argument('--like-rate', type=float, default=0.1)
+    parser.add_argument('--call-latency-ms', type=float, default=1.0,
+                        help='simulated round trip per fake WebDriver call')
+    parser.add_argument('--wait-timeout', type=float, default=5)
+    parser.add_argument('--ring-grace', type=float, default=0.5)
+    parser.add_argument('--block', default='image,media,font,beacon',
+                        help='resource categories to block (SCRAPER_BLOCK); "off" loads everything')
+    parser.add_argument('--json', action='store_true', help='print JSON instead of a table')
+    args = parser.parse_args()
+
+    # Traffic is measured with blocking off too, as the baseline
+    categories = () if args.block == 'off' else [c.strip() for c in args.block.split(',') if c.strip()]
+    policy = ResourcePolicy(categories, measure=True)
+
+    os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench_scraper.db')}")
+    os.environ.setdefault('OUTBOUND_BACKEND', 'off')  # measure the scraper, not the host's request budget
+    if args.fixtures:
+        accounts = load_accounts(args.fixtures)
+    else:
+        accounts = synthetic_accounts([int(s) for s in args.sizes.split(',')], like_rate=args.like_rate)
+
+    results = {}
+    if args.driver == 'fake':
+        driver = FakeDriver(accounts, latency=args.call_latency_ms / 1000)
+        policy.install(driver)
+        for account, viewers in accounts.items():
+            results[account] = run_account(account, viewers, driver, driver.base_url, args, policy)
+    else:
+        import monitor
+        monitor.resource_policy = policy
+        with FixtureServer(accounts) as server:
+            chrome = monitor.setup_chrome()
+            try:
+                driver = CountingDriver(chrome)
+                for account, viewers in accounts.items():
+                    results[account] = run_account(account, viewers, driver, server.base_url, args, policy)
+            finally:
+                chrome.quit()
+
+    report = {'driver': args.driver, 'harvest_mode': args.harvest_mode,
+              'extraction_mode': args.extraction_mode, 'block': args.block, 'accounts': results}
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"driver={args.driver} harvest={args.harvest_mode} extraction={args.extraction_mode} block={args.block}")
+    print(f"{'account':<16} {'viewers':>8} {'scrapes/min':>12} {'calls/scrape':>13} {'KB/scrape':>10} "
+          f"{'blocked':>8} {'KB saved':>9} {'precision':>10} {'recall':>7} {'likes':>6}")
+    for account, result in results.items():
+        print(f"{account:<16} {result['viewers']:>8} {result['scrapes_per_minute'] or 0:>12.1f} "
+              f"{result['webdriver_calls_per_scrape']:>13.1f} {result['kb_per_scrape'] or 0:>10.1f} "
+              f"{result['blocked_per_scrape'] or 0:>8.1f} {result['kb_saved_per_scrape'] or 0:>9.1f} "
+              f"{result['viewer_precision']:>10.3f} {result['viewer_recall']:>7.3f} {result['like_recall']:>6.3f}")
+
+
+if __name__ == '__main__':
+    main()
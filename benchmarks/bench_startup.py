@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Monitor startup benchmark: time to first scrape after a restart
+Starts a fresh BrowserPool (as a restarted or redeployed worker does) and
+measures, for every account, the time until its first scrape completed:
+
+- cold:     no session store, every account logs in (the old behaviour)
+- warm:     sessions restored from the encrypted store written by a prior run
+- rejected: the stored sessions were revoked by Instagram, so every account
+            is redirected to the login page and falls back to a full login
+
+Browsers are FakeDrivers (scraper_fixtures.py) with a simulated browser
+startup and login cost, so the numbers show what the session store saves
+rather than what a particular machine's Chrome costs.
+
+Usage: python benchmarks/bench_startup.py [--accounts 20] [--pool-size 2]
+                                          [--startup-ms 1500] [--login-ms 4000] [--json]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from scraper_fixtures import FakeDriver, synthetic_accounts
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def first_scrapes(app_module, pool, accounts, args):
+    """Scrape every account once through ``pool``, pool-size accounts at a time"""
+    app_module.browser_pool = pool
+    started = time.perf_counter()
+    pending = list(enumerate(accounts, start=1))
+    lock = threading.Lock()
+    timings, failures, logins = [], [], []
+
+    def run():
+        while True:
+            with lock:
+                if not pending:
+                    return
+                user_id, account = pending.pop(0)
+            monitor = app_module.InstagramMonitor(user_id=user_id, instagram_username=account)
+            monitor.base_url = 'https://fixtures.local'
+            monitor.harvest_mode = 'visible'
+            monitor.wait_timeout = args.wait_timeout
+            monitor.ring_grace = args.wait_timeout
+            monitor._known_viewers_date = datetime.now().date()
+            try:
+                data = monitor.scrape()
+            except Exception as e:
+                failures.append(str(e))
+                continue
+            with lock:
+                timings.append(time.perf_counter() - started)
+                logins.append('login' in monitor.step_timings)
+                if data is None:
+                    failures.append(f'{account}: no story data')
+
+    threads = [threading.Thread(target=run) for _ in range(pool.size)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    pool.close()
+    return {
+        'accounts': len(accounts),
+        'logins': sum(logins),
+        'failures': len(failures),
+        'mean_seconds': round(sum(timings) / len(timings), 3) if timings else None,
+        'p50_seconds': round(percentile(timings, 0.5), 3) if timings else None,
+        'all_seconds': round(max(timings), 3) if timings else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--accounts', type=int, default=20)
+    parser.add_argument('--viewers', type=int, default=50, help='viewers on each story')
+    parser.add_argument('--pool-size', type=int, default=2)
+    parser.add_argument('--startup-ms', type=float, default=1500, help='simulated browser startup')
+    parser.add_argument('--login-ms', type=float, default=4000, help='simulated Instagram login')
+    parser.add_argument('--call-latency-ms', type=float, default=1.0)
+    parser.add_argument('--wait-timeout', type=float, default=1.0)
+    parser.add_argument('--json', action='store_true', help='print JSON instead of a table')
+    args = parser.parse_args()
+
+    os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench_startup.db')}")
+    os.environ['SESSION_STORE'] = 'db'
+    os.environ.setdefault('OUTBOUND_BACKEND', 'off')  # measure logins, not the host's request budget
+    import monitor as app_module
+    from models import User
+    from browser_pool import BrowserPool
+
+    with app_module.app.app_context():
+        app_module.db.create_all()
+        for user_id in range(1, args.accounts + 1):
+            app_module.db.session.merge(User(
+                id=user_id, username=f'bench{user_id}', email=f'bench{user_id}@example.com',
+                password_hash='-', instagram_username=f'story_{args.viewers}_{user_id}'))
+        app_module.db.session.commit()
+
+    store = app_module.session_store
+    if store is None:
+        sys.exit("The session store is unavailable (is the cryptography package installed?)")
+
+    viewers = synthetic_accounts([args.viewers], without_story=0)[f'story_{args.viewers}']
+    accounts = {f'story_{args.viewers}_{i}': viewers for i in range(1, args.accounts + 1)}
+    sessions = set()  # sessionids the fake Instagram accepts
+
+    def factory():
+        time.sleep(args.startup_ms / 1000)
+        return FakeDriver(accounts, latency=args.call_latency_ms / 1000,
+                          sessions=sessions, login_delay=args.login_ms / 1000)
+
+    def fresh_pool(session_store):
+        return BrowserPool(factory, size=args.pool_size, session_store=session_store,
+                           isolation_origins=('https://fixtures.local',))
+
+    names = list(accounts)
+    results = {'cold': first_scrapes(app_module, fresh_pool(None), names, args)}
+    first_scrapes(app_module, fresh_pool(store), names, args)  # a previous run that saves the sessions
+    results['warm'] = first_scrapes(app_module, fresh_pool(store), names, args)
+    sessions.clear()
+    results['rejected'] = first_scrapes(app_module, fresh_pool(store), names, args)
+
+    report = {'accounts': args.accounts, 'pool_size': args.pool_size, 'startup_ms': args.startup_ms,
+              'login_ms': args.login_ms, 'scenarios': results}
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"accounts={args.accounts} pool={args.pool_size} startup={args.startup_ms:.0f}ms login={args.login_ms:.0f}ms")
+    print(f"{'scenario':<10} {'logins':>7} {'failures':>9} {'mean s':>8} {'p50 s':>8} {'all s':>8}")
+    for name, result in results.items():
+        print(f"{name:<10} {result['logins']:>7} {result['failures']:>9} {result['mean_seconds']:>8} "
+              f"{result['p50_seconds']:>8} {result['all_seconds']:>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+"""
+Synthetic-data benchmark suite for ingest and page rendering
+Seeds User/Story/Viewer/StoryViewer with a configurable account shape, then
+times update_database and the dashboard, analytics, API and export pages. Reports
+latency percentiles, queries per operation and peak memory as JSON so runs
+can be compared across commits.
+
+Each database URL runs in its own subprocess (the app binds DATABASE_URL at
+import). Without --database-url a temporary SQLite file is used; add
+--postgres to also run against BENCH_POSTGRES_URL (default
+postgresql+psycopg2://localhost/instagram_monitor_bench).
+
+Usage: python benchmarks/bench_suite.py [--shape small|medium|large] [--users N] [--days N]
+                                        [--viewers N] [--postgres] [--output results.json]
+                                        [--compare previous.json]
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import subprocess
+import tempfile
+import tracemalloc
+from array import array
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+# users, days of daily stories, viewer pool per account
+SHAPES = {
+    'small': {'users': 5, 'days': 30, 'viewers': 1000},
+    'medium': {'users': 20, 'days': 180, 'viewers': 10000},
+    'large': {'users': 500, 'days': 730, 'viewers': 50000},
+}
+PAGES = ('/dashboard', '/analytics', '/api/stats', '/api/v1/stories', '/api/v1/viewers',
+         '/api/v1/stories/{story_id}/viewers', '/api/v1/export/story_viewers?format=csv',
+         '/api/v1/export/story_viewers?format=ndjson')
+BENCH_PASSWORD = 'bench'
+
+
+def daily_audiences(rng, pool, days, regular_share, regular_rate, casual_rate):
+    """Yield each day's viewer indexes: regulars watch most days, the long tail rarely"""
+    regulars = int(pool * regular_share)
+    casual_count = max(int((pool - regulars) * casual_rate), 0)
+    for _ in range(days):
+        audience = [i for i in range(regulars) if rng.random() < regular_rate]
+        audience += rng.sample(range(regulars, pool), min(casual_count, pool - regulars))
+        yield audience
+
+
+def seed(shape, seed_value, like_rate=0.1):
+    """Bulk-load the shape with core inserts; returns row counts"""
+    from sqlalchemy import insert, text
+    from werkzeug.security import generate_password_hash
+    from models import db, User, Story, Viewer, StoryViewer
+    from monitor import app
+    from store import rebuild_rollups
+
+    counts = {'users': 0, 'stories': 0, 'viewers': 0, 'story_viewers': 0}
+    password_hash = generate_password_hash(BENCH_PASSWORD)
+    # Stories end yesterday so the ingest workload starts a fresh story today
+    first_day = datetime.now().date() - timedelta(days=shape['days'])
+    story_id = link_id = viewer_id = 0
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        for user_index in range(shape['users']):
+            rng = random.Random(seed_value + user_index)
+            user_id = user_index + 1
+            db.session.execute(insert(User), [{
+                'id': user_id, 'username': f'bench_{user_id}', 'email': f'bench_{user_id}@bench.local',
+                'password_hash': password_hash, 'instagram_username': f'bench_account_{user_id}',
+            }])
+
+            views = [0] * shape['viewers']
+            likes = [0] * shape['viewers']
+            first_day_seen = [None] * shape['viewers']
+            last_day_seen = [None] * shape['viewers']
+            # Audiences are kept as int arrays so a two-year, 50k-viewer account fits in memory
+            days = []
+            audiences = daily_audiences(rng, shape['viewers'], shape['days'], shape['regular_share'],
+                                        shape['regular_rate'], shape['casual_rate'])
+            for day, audience in enumerate(audiences):
+                liked = array('i', (index for index in audience if rng.random() < like_rate))
+                days.append((array('i', audience), liked))
+                for index in audience:
+                    views[index] += 1
+                    first_day_seen[index] = day if first_day_seen[index] is None else first_day_seen[index]
+                    last_day_seen[index] = day
+                for index in liked:
+                    likes[index] += 1
+
+            def seen_at(day):
+                return datetime.combine(first_day + timedelta(days=day), datetime.min.time()) + timedelta(hours=12)
+
+            stories = []
+            for day, (viewed, liked) in enumerate(days):
+                stories.append({'id': story_id + day + 1, 'user_id': user_id,
+                                'story_date': first_day + timedelta(days=day),
+                                'total_views': len(viewed), 'total_likes': len(liked),
+                                'created_at': seen_at(day), 'last_checked': seen_at(day)})
+            viewers = [{'id': viewer_id + index + 1, 'user_id': user_id, 'username': f'viewer_{index:06d}',
+                        'total_views': views[index], 'total_likes': likes[index],
+                        'first_seen': seen_at(first_day_seen[index]), 'last_seen': seen_at(last_day_seen[index])}
+                       for index in range(shape['viewers']) if views[index]]
+            for table, rows in ((Story, stories), (Viewer, viewers)):
+                for start in range(0, len(rows), 5000):
+                    db.session.execute(insert(table), rows[start:start + 5000])
+
+            links = []
+            link_count = 0
+            for day, (viewed, liked) in enumerate(days):
+                liked = set(liked)
+                stamp = seen_at(day)
+                for index in viewed:
+                    link_id += 1
+                    links.append({'id': link_id, 'story_id': story_id + day + 1, 'viewer_id': viewer_id + index + 1,
+                                  'has_viewed': True, 'has_liked': index in liked,
+                                  'first_detected': stamp, 'last_updated': stamp})
+                if len(links) >= 5000 or day == len(days) - 1:
+                    db.session.execute(insert(StoryViewer), links)
+                    link_count += len(links)
+                    links = []
+            db.session.commit()
+            rebuild_rollups(user_id)
+
+            story_id += len(stories)
+            viewer_id += shape['viewers']
+            counts['users'] += 1
+            counts['stories'] += len(stories)
+            counts['viewers'] += len(viewers)
+            counts['story_viewers'] += link_count
+
+        if db.engine.dialect.name == 'postgresql':
+            # Explicit ids bypass the sequences; move them past the seeded rows
+            for table in ('user', 'story', 'viewer', 'story_viewer'):
+                db.session.execute(text(
+                    f"SELECT setval(pg_get_serial_sequence('\"{table}\"', 'id'), "
+                    f"(SELECT COALESCE(MAX(id), 1) FROM \"{table}\"))"))
+            db.session.commit()
+    return counts
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(int(q / 100 * len(ordered)), len(ordered) - 1)]
+
+
+def summarize(latencies, queries, python_peak):
+    return {
+        'ops': len(latencies),
+        'latency_ms': {
+            'p50': round(percentile(latencies, 50) * 1000, 3),
+            'p90': round(percentile(latencies, 90) * 1000, 3),
+            'p99': round(percentile(latencies, 99) * 1000, 3),
+            'max': round(max(latencies) * 1000, 3),
+            'mean': round(sum(latencies) / len(latencies) * 1000, 3),
+        },
+        'queries': {'mean': round(sum(queries) / len(queries), 2), 'max': max(queries)},
+        'python_peak_kb': round(python_peak / 1024, 1),
+        'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+class QueryCounter:
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+
+def timed_op(counter, op):
+    counter.count = 0
+    started = time.perf_counter()
+    op()
+    return time.perf_counter() - started, counter.count
+
+
+def peak_memory(op):
+    """Python heap high-water mark of one extra, untimed run"""
+    tracemalloc.start()
+    try:
+        op()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def ingest_workload(shape, sample_users, ticks, seed_value):
+    """A new story per sampled user, then re-scrapes as viewers trickle in"""
+    from models import db
+    from monitor import app, InstagramMonitor
+
+    rng = random.Random(seed_value)
+    latencies, queries, peak = [], [], 0
+    with app.app_context():
+        counter = QueryCounter(db.engine)
+        for user_id in sample_users:
+            monitor = InstagramMonitor(user_id, f'bench_account_{user_id}')
+            audience = next(daily_audiences(rng, shape['viewers'], 1, shape['regular_share'],
+                                            shape['regular_rate'], shape['casual_rate']))
+            names = [f'viewer_{index:06d}' for index in audience]
+            names += [f'new_viewer_{user_id}_{i}' for i in range(max(len(names) // 50, 1))]
+            rng.shuffle(names)
+            for tick in range(1, ticks + 1):
+                seen = names[:len(names) * tick // ticks]
+                story_data = {'viewers': seen, 'likes': seen[::10]}
+
+                def op():
+                    assert monitor.update_database(story_data), 'ingest failed'
+
+                elapsed, count = timed_op(counter, op)
+                latencies.append(elapsed)
+                queries.append(count)
+            peak = max(peak, peak_memory(op))
+    return summarize(latencies, queries, peak)
+
+
+def page_workloads(sample_users, requests, cache):
+    from app import create_app
+    from models import db, Story
+    from store import view_cache
+
+    app = create_app()
+    view_cache.enabled = cache
+    results = {}
+    with app.app_context():
+        counter = QueryCounter(db.engine)
+        story_ids = {user_id: db.session.query(db.func.max(Story.id)).filter(Story.user_id == user_id).scalar()
+                     for user_id in sample_users}
+        db.session.remove()
+
+        for page in PAGES:
+            latencies, queries, peak = [], [], 0
+            for user_id in sample_users:
+                client = app.test_client()
+                client.post('/login', data={'username': f'bench_{user_id}', 'password': BENCH_PASSWORD})
+                path = page.format(story_id=story_ids[user_id])
+
+                def op():
+                    # Read streamed bodies chunk by chunk, as a client would
+                    response = client.get(path, buffered=False)
+                    assert response.status_code == 200, (path, response.status_code)
+                    for _ in response.iter_encoded():
+                        pass
+                    response.close()
+
+                for _ in range(requests):
+                    elapsed, count = timed_op(counter, op)
+                    latencies.append(elapsed)
+                    queries.append(count)
+                peak = max(peak, peak_memory(op))
+            results[page.replace('{story_id}', 'id')] = summarize(latencies, queries, peak)
+    return results
+
+
+def run_child(args):
+    """Seed and run every workload against DATABASE_URL; writes JSON to --child-output"""
+    shape = resolve_shape(args)
+    started = time.perf_counter()
+    counts = seed(shape, args.seed)
+    seed_seconds = time.perf_counter() - started
+
+    rng = random.Random(args.seed)
+    sample_users = sorted(rng.sample(range(1, shape['users'] + 1), min(args.sample_users, shape['users'])))
+    from models import db
+    from monitor import app
+    with app.app_context():
+        dialect = db.engine.dialect.name
+    result = {
+        'dialect': dialect,
+        'seed': dict(counts, seconds=round(seed_seconds, 2)),
+        'workloads': {'ingest': ingest_workload(shape, sample_users, args.ticks, args.seed)},
+    }
+    result['workloads'].update(page_workloads(sample_users, args.requests, args.cache))
+    with open(args.child_output, 'w') as f:
+        json.dump(result, f)
+
+
+def resolve_shape(args):
+    shape = dict(SHAPES[args.shape])
+    for key in ('users', 'days', 'viewers'):
+        if getattr(args, key) is not None:
+            shape[key] = getattr(args, key)
+    shape.update(regular_share=args.regular_share, regular_rate=args.regular_rate, casual_rate=args.casual_rate)
+    return shape
+
+
+def run_backend(url, argv):
+    with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as f:
+        output = f.name
+    env = dict(os.environ, DATABASE_URL=url, CACHE_BACKEND='memory')
+    process = subprocess.run([sys.executable, os.path.abspath(__file__), *argv, '--child', '--child-output', output],
+                             env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    try:
+        if process.returncode != 0:
+            lines = [line for line in process.stderr.splitlines()
+                     if line.strip() and not line.startswith('(Background')]
+            return {'error': lines[-1] if lines else 'failed'}
+        with open(output) as f:
+            return json.load(f)
+    finally:
+        os.unlink(output)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(current, previous):
+    """Print p50/p99 and query-count changes against an earlier results file"""
+    print(f"{'backend':<12} {'workload':<30} {'p50 ms':>16} {'p99 ms':>16} {'queries':>14}")
+    for backend, result in current['results'].items():
+        before = previous.get('results', {}).get(backend, {}).get('workloads', {})
+        for name, now in result.get('workloads', {}).items():
+            old = before.get(name)
+            if not old:
+                continue
+            cells = []
+            for new_value, old_value in ((now['latency_ms']['p50'], old['latency_ms']['p50']),
+                                         (now['latency_ms']['p99'], old['latency_ms']['p99']),
+                                         (now['queries']['mean'], old['queries']['mean'])):
+                change = (new_value - old_value) / old_value * 100 if old_value else 0
+                cells.append(f"{new_value:.1f} ({change:+.0f}%)")
+            print(f"{backend:<12} {name:<30} {cells[0]:>16} {cells[1]:>16} {cells[2]:>14}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--shape', choices=SHAPES, default='small')
+    parser.add_argument('--users', type=int, default=None)
+    parser.add_argument('--days', type=int, default=None)
+    parser.add_argument('--viewers', type=int, default=None, help='viewer pool per account')
+    parser.add_argument('--regular-share', type=float, default=0.2, help='share of the pool that are regulars')
+    parser.add_argument('--regular-rate', type=float, default=0.8, help='chance a regular views a story')
+    parser.add_argument('--casual-rate', type=float, default=0.05, help='chance anyone else views a story')
+    parser.add_argument('--sample-users', type=int, default=5, help='accounts the workloads run against')
+    parser.add_argument('--ticks', type=int, default=10, help='scrapes of the new story per account')
+    parser.add_argument('--requests', type=int, default=20, help='requests per page per account')
+    parser.add_argument('--cache', action='store_true', help='keep the view cache on for page workloads')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--database-url', action='append', default=[])
+    parser.add_argument('--postgres', action='store_true')
+    parser.add_argument('--output', default=None, help='write JSON here instead of stdout')
+    parser.add_argument('--compare', default=None, help='earlier results file to diff against')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--child-output', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args)
+        return
+
+    urls = list(args.database_url)
+    if not urls:
+        urls.append(f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench_suite.db')}")
+    if args.postgres:
+        urls.append(os.environ.get('BENCH_POSTGRES_URL', 'postgresql+psycopg2://localhost/instagram_monitor_bench'))
+
+    # Everything but the parent-only options is passed through to the children
+    argv = [arg for arg in sys.argv[1:]]
+    for flag in ('--database-url', '--output', '--compare'):
+        while flag in argv:
+            index = argv.index(flag)
+            del argv[index:index + 2]
+    argv = [arg for arg in argv if arg != '--postgres' and not arg.startswith(('--database-url=', '--output=',
+                                                                                 '--compare='))]
+
+    report = {
+        'commit': git_commit(),
+        'created_at': datetime.utcnow().isoformat(),
+        'shape': resolve_shape(args),
+        'settings': {'sample_users': args.sample_users, 'ticks': args.ticks, 'requests': args.requests,
+                     'cache': args.cache, 'seed': args.seed},
+        'results': {},
+    }
+    for url in urls:
+        result = run_backend(url, argv)
+        report['results'][result.get('dialect') or url.split(':', 1)[0].split('+')[0]] = result
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
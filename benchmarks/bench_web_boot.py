@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Web tier boot benchmark: import time, cold start and RSS of a web worker
+Measures what every gunicorn web worker pays before serving a request:
+
+- import:  fresh interpreters import the web module (and build the app
+           where it is a factory); reports seconds and whether Selenium
+           or numpy came along
+- request: the first request after the import (/login, rendered)
+- rss:     resident memory of that interpreter after the first request
+- gunicorn: `gunicorn --workers N` from launch until /login answers,
+            then the resident memory of each worker process
+
+The schema is created beforehand with `flask db-upgrade`, as a deploy does.
+Point --tree at another checkout (e.g. a `git worktree` of an older commit)
+to measure it the same way.
+
+Usage: python benchmarks/bench_web_boot.py [--tree .] [--runs 5] [--workers 2] [--no-gunicorn] [--json]
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import statistics
+import subprocess
+import urllib.request
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Runs in a fresh interpreter inside the tree being measured
+CHILD = r"""
+import json, sys, time
+started = time.perf_counter()
+import app as web
+application = web.create_app() if hasattr(web, 'create_app') else web.app
+imported = time.perf_counter() - started
+client = application.test_client()
+started = time.perf_counter()
+status = client.get('/login').status_code
+request = time.perf_counter() - started
+rss = next(int(line.split()[1]) for line in open('/proc/self/status') if line.startswith('VmRSS'))
+print(json.dumps({'import_s': imported, 'first_request_s': request, 'status': status,
+                  'rss_mb': rss / 1024, 'selenium': 'selenium' in sys.modules,
+                  'numpy': 'numpy' in sys.modules}))
+"""
+
+
+def rss_mb(pid):
+    with open(f'/proc/{pid}/status') as f:
+        return next(int(line.split()[1]) for line in f if line.startswith('VmRSS')) / 1024
+
+
+def children(pid):
+    pids = []
+    for task in os.listdir(f'/proc/{pid}/task'):
+        with open(f'/proc/{pid}/task/{task}/children') as f:
+            pids += [int(child) for child in f.read().split()]
+    return pids
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def app_target(tree):
+    with open(os.path.join(tree, 'app.py')) as f:
+        return 'app:create_app()' if 'def create_app' in f.read() else 'app:app'
+
+
+def run_gunicorn(tree, env, workers):
+    port = free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', app_target(tree), '--bind', f'127.0.0.1:{port}',
+         '--workers', str(workers), '--worker-class', 'gthread', '--threads', '8'],
+        cwd=tree, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            try:
+                with urllib.request.urlopen(f'http://127.0.0.1:{port}/login', timeout=1) as response:
+                    response.read()
+                break
+            except OSError:
+                if process.poll() is not None:
+                    raise RuntimeError('gunicorn exited before serving')
+                time.sleep(0.02)
+        ready = time.perf_counter() - started
+        # Every worker imports the app; wait until all of them are up
+        deadline = time.time() + 30
+        while len(children(process.pid)) < workers and time.time() < deadline:
+            time.sleep(0.1)
+        time.sleep(1)
+        worker_rss = [rss_mb(pid) for pid in children(process.pid)]
+        return {'ready_s': ready, 'worker_rss_mb': worker_rss, 'master_rss_mb': rss_mb(process.pid)}
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--tree', default=ROOT, help='checkout to measure (default: this one)')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn web workers')
+    parser.add_argument('--no-gunicorn', action='store_true', help='skip the gunicorn measurement')
+    parser.add_argument('--json', action='store_true', help='print JSON instead of a table')
+    args = parser.parse_args()
+
+    tree = os.path.abspath(args.tree)
+    workdir = tempfile.mkdtemp()
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'bench_web_boot.db')}",
+               METRICS_DIR='off', OUTBOUND_PATH=os.path.join(workdir, 'outbound.db'),
+               INGEST_JOURNAL_DIR=os.path.join(workdir, 'journal'))
+    env['PYTHONPATH'] = tree
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'db-upgrade'], cwd=tree, env=env,
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    runs = []
+    for _ in range(args.runs):
+        output = subprocess.run([sys.executable, '-c', CHILD], cwd=tree, env=env, check=True,
+                                capture_output=True, text=True).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    results = {
+        'tree': tree,
+        'import_s': round(statistics.median(run['import_s'] for run in runs), 3),
+        'first_request_s': round(statistics.median(run['first_request_s'] for run in runs), 3),
+        'rss_mb': round(statistics.median(run['rss_mb'] for run in runs), 1),
+        'selenium_imported': any(run['selenium'] for run in runs),
+        'numpy_imported': any(run.get('numpy') for run in runs),
+    }
+    if not args.no_gunicorn:
+        boots = [run_gunicorn(tree, env, args.workers) for _ in range(min(args.runs, 3))]
+        results['gunicorn_ready_s'] = round(statistics.median(boot['ready_s'] for boot in boots), 2)
+        results['gunicorn_worker_rss_mb'] = round(statistics.median(
+            rss for boot in boots for rss in boot['worker_rss_mb']), 1)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for name, value in results.items():
+        print(f"{name:<24} {value}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,648 @@
+"""
+Offline Instagram-like fixtures for scraper benchmarks
+Synthetic accounts with a story and a "Seen by" viewer list, served two ways:
+
+- FixtureServer: a local HTTP server with profile, story and virtualized
+  viewer-list pages, for running InstagramMonitor in headless Chrome
+  (point INSTAGRAM_BASE_URL, or monitor.base_url, at server.base_url)
+- FakeDriver: an in-memory stand-in for selenium's WebDriver that models
+  the same pages and counts every call, for runs without a browser
+- FakeChrome: the same pages behind an in-process DevTools connection, for
+  running AsyncInstagramMonitor (cdp.py's CDPBrowserPool) without a browser
+
+Both render the viewer list like Instagram does: a fixed-height scroll box
+that only keeps the rows near the viewport in the DOM, newest viewer first,
+with a heart next to viewers who liked the story. Pages also pull in the
+scripts, images, story video, fonts and beacons listed in PAGE_RESOURCES,
+so resource blocking (resource_blocking.py) has something to refuse.
+"""
+
+import asyncio
+import html
+import itertools
+import json
+import random
+import secrets
+import threading
+import time
+from fnmatch import fnmatchcase
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+from selenium.common.exceptions import NoSuchElementException
+from selenium.webdriver.common.by import By
+
+from cdp import CDPError
+
+RATE_LIMIT_TEXT = 'Please wait a few minutes before you try again.'
+ROW_HEIGHT = 40
+VISIBLE_ROWS = 10
+OVERSCAN_ROWS = 5
+
+
+def synthetic_accounts(sizes, like_rate=0.1, seed=1, without_story=1):
+    """Accounts named story_<n> with n viewers each, plus accounts with no story up
+
+    Returns {account: [(username, liked), ...] or None}, newest viewer first.
+    """
+    rng = random.Random(seed)
+    accounts = {}
+    for size in sizes:
+        accounts[f'story_{size}'] = [(f'viewer.{size}_{i:05d}', rng.random() < like_rate) for i in range(size)]
+    for i in range(without_story):
+        accounts[f'no_story_{i}'] = None
+    return accounts
+
+
+def load_accounts(path):
+    """Recorded fixtures: {"account": [{"username": ..., "liked": ...}, ...] or null}"""
+    with open(path) as f:
+        raw = json.load(f)
+    return {account: None if viewers is None else [(v['username'], bool(v.get('liked'))) for v in viewers]
+            for account, viewers in raw.items()}
+
+
+# Pages
+
+DOCUMENT_BYTES = 30_000
+
+# Sub-resources each page loads: (path, kind, bytes); kind matches the
+# resource_blocking categories, None for what the page needs to work
+SHELL_RESOURCES = [('/static/bundle.js', None, 350_000), ('/static/app.css', None, 60_000),
+                   ('/static/font.woff2', 'font', 55_000), ('/ajax/bz', 'beacon', 600)]
+PAGE_RESOURCES = {
+    'home': SHELL_RESOURCES,
+    'profile': SHELL_RESOURCES + [('/img/avatar.jpg', 'image', 40_000)]
+               + [(f'/img/grid_{i}.jpg', 'image', 35_000) for i in range(12)],
+    'story': SHELL_RESOURCES + [('/img/avatar.jpg', 'image', 40_000), ('/media/story.mp4', 'media', 1_500_000),
+                                ('/logging_client_events', 'beacon', 900)],
+}
+RESOURCE_SIZES = {path: size for resources in PAGE_RESOURCES.values() for path, _, size in resources}
+
+
+def resource_tags(page):
+    """HTML that makes a browser fetch a page's PAGE_RESOURCES"""
+    tags = []
+    for path, kind, _ in PAGE_RESOURCES[page]:
+        if path.endswith('.js'):
+            tags.append(f'<script src="{path}"></script>')
+        elif path.endswith('.css'):
+            tags.append(f'<link rel="stylesheet" href="{path}">')
+        elif kind == 'font':
+            tags.append(f'<style>@font-face {{ font-family: ig; src: url({path}); }} body {{ font-family: ig; }}</style>')
+        elif kind == 'image':
+            tags.append(f'<img src="{path}" width="1" height="1" alt="">')
+        elif kind == 'media':
+            tags.append(f'<video src="{path}" muted autoplay width="1" height="1"></video>')
+        else:
+            tags.append(f'<script>fetch("{path}")</script>')
+    return ''.join(tags)
+
+
+HOME_PAGE = """<!doctype html><html><body><nav>Instagram</nav><main>Home</main>
+{resources}</body></html>"""
+
+PROFILE_PAGE = """<!doctype html><html><body><main>
+<header><h2>{account}</h2>{ring}</header>
+</main>{resources}</body></html>"""
+
+RING = ("<div role=\"button\" onclick=\"location.href='/stories/{account}/1/'\">"
+        "<canvas height=\"77\" width=\"77\"></canvas></div>")
+
+STORY_PAGE = """<!doctype html><html><head><style>
+.list {{ height: {list_height}px; overflow-y: auto; position: relative; }}
+.row {{ height: {row_height}px; position: absolute; left: 0; right: 0; }}
+</style></head><body><main>
+<header><a href="/{account}/" role="link">{account}</a></header>
+{resources}<span id="seen" onclick="openList()">Seen by {count}</span>
+<div role="dialog" id="dialog" style="display: none">
+  <div class="list" id="list"><div style="height: {total_height}px"></div></div>
+</div>
+</main><script>
+const VIEWERS = {viewers};
+const ROW = {row_height}, OVERSCAN = {overscan};
+const list = document.getElementById('list');
+function render() {{
+    const first = Math.floor(list.scrollTop / ROW);
+    const start = Math.max(0, first - OVERSCAN);
+    const end = Math.min(VIEWERS.length, first + Math.ceil(list.clientHeight / ROW) + OVERSCAN);
+    for (const row of Array.from(list.querySelectorAll('.row'))) {{
+        const index = +row.dataset.index;
+        if (index < start || index >= end) row.remove();
+    }}
+    for (let i = start; i < end; i++) {{
+        if (list.querySelector(`.row[data-index="${{i}}"]`)) continue;
+        const [username, liked] = VIEWERS[i];
+        const row = document.createElement('div');
+        row.className = 'row';
+        row.dataset.index = i;
+        row.style.top = (i * ROW) + 'px';
+        row.innerHTML = `<div><a href="/${{username}}/" role="link">${{username}}</a></div>` +
+            (liked ? '<span data-testid="heart">&#9829;</span>' : '');
+        list.appendChild(row);
+    }}
+}}
+// Rows render a frame after the scroll, like a virtualized list
+list.addEventListener('scroll', () => setTimeout(render, 16));
+function openList() {{
+    document.getElementById('dialog').style.display = 'block';
+    setTimeout(render, 16);
+}}
+</script></body></html>"""
+
+
+def story_page(account, viewers):
+    return STORY_PAGE.format(
+        account=html.escape(account), count=len(viewers), viewers=json.dumps(viewers),
+        row_height=ROW_HEIGHT, overscan=OVERSCAN_ROWS, list_height=ROW_HEIGHT * VISIBLE_ROWS,
+        total_height=ROW_HEIGHT * len(viewers), resources=resource_tags('story'),
+    )
+
+
+class FixtureServer:
+    """Serves the fixture pages on 127.0.0.1 from a background thread"""
+
+    def __init__(self, accounts, port=0):
+        self.accounts = accounts
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests += 1
+                path = urlparse(self.path).path
+                if path in RESOURCE_SIZES:
+                    self.send_response(200)
+                    self.send_header('Content-Length', str(RESOURCE_SIZES[path]))
+                    self.end_headers()
+                    self.wfile.write(resource_body(path))
+                    return
+                body = server.page(path)
+                self.send_response(200 if body else 404)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.end_headers()
+                self.wfile.write((body or 'Not found').encode())
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.base_url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def page(self, path):
+        parts = [part for part in path.split('/') if part]
+        if not parts:
+            return HOME_PAGE.format(resources=resource_tags('home'))
+        if parts[0] == 'stories' and len(parts) >= 2 and self.accounts.get(parts[1]):
+            return story_page(parts[1], self.accounts[parts[1]])
+        if parts[0] in self.accounts:
+            ring = RING.format(account=parts[0]) if self.accounts[parts[0]] else ''
+            return PROFILE_PAGE.format(account=html.escape(parts[0]), ring=ring, resources=resource_tags('profile'))
+        return None
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def resource_body(path):
+    """Filler of the resource's size; comments for scripts and stylesheets"""
+    size = RESOURCE_SIZES[path]
+    if path.endswith(('.js', '.css')):
+        return b'/*' + b' ' * (size - 4) + b'*/'
+    return bytes(size)
+
+
+# Fake WebDriver
+
+class SiteLimit:
+    """Instagram's side of rate limiting: page loads beyond ``limit`` in any ``window`` seconds are refused
+
+    Pass a lock and list from a multiprocessing Manager to share one site
+    between processes.
+    """
+
+    def __init__(self, limit, window=1.0, lock=None, loads=None):
+        self.limit = limit
+        self.window = window
+        self.lock = lock or threading.Lock()
+        self.loads = loads if loads is not None else []
+        self.refused = 0
+
+    def admit(self):
+        now = time.time()
+        with self.lock:
+            recent = [at for at in self.loads if at > now - self.window]
+            admitted = len(recent) < self.limit
+            if admitted:
+                recent.append(now)
+            self.loads[:] = recent
+        self.refused += 0 if admitted else 1
+        return admitted
+
+
+class FakeElement:
+    def __init__(self, driver, kind, text='', href=None, parent=None, row=None):
+        self.driver = driver
+        self.kind = kind
+        self._text = text
+        self.href = href
+        self.parent = parent
+        self.row = row  # viewer index for links and rows in the list
+
+    @property
+    def text(self):
+        self.driver.record('element_text')
+        return self._text
+
+    def is_displayed(self):
+        self.driver.record('is_displayed')
+        return True
+
+    def get_attribute(self, name):
+        self.driver.record('get_attribute')
+        return self.href if name == 'href' else None
+
+    def find_element(self, by, value):
+        self.driver.record('element_find_element')
+        if by == By.XPATH and value in ('..', '../..'):
+            element = self.parent if value == '..' else (self.parent.parent if self.parent else None)
+            if element is not None:
+                return element
+        raise NoSuchElementException(value)
+
+    def find_elements(self, by, value):
+        self.driver.record('element_find_elements')
+        if self.kind == 'row' and self.driver.viewers[self.row][1]:
+            return [FakeElement(self.driver, 'heart', parent=self)]
+        return []
+
+
+class FakeDriver:
+    """Just enough of selenium's WebDriver for InstagramMonitor's scrape path
+
+    Every call is counted in ``calls`` (by name) and can be given a simulated
+    round-trip latency, so WebDriver calls per scrape are comparable with a
+    real browser.
+
+    ``page_load`` seconds are spent on every navigation. With a ``site``
+    (SiteLimit) navigations over Instagram's rate limit land on its "please
+    wait" page instead.
+
+    With a ``sessions`` set the fake site requires a login: loading the home
+    page takes ``login_delay`` seconds and issues a sessionid cookie (added to
+    the set), and profiles visited without a cookie from the set redirect to
+    /accounts/login/. Drivers sharing one set model one Instagram; clearing it
+    revokes every session.
+    """
+
+    def __init__(self, accounts, base_url='https://fixtures.local', latency=0.0,
+                 sessions=None, login_delay=0.0, page_load=0.0, site=None):
+        self.accounts = accounts
+        self.base_url = base_url
+        self.latency = latency
+        self.page_load = page_load
+        self.site = site
+        self.sessions = sessions
+        self.login_delay = login_delay
+        self.cookies = []
+        self.blocked_urls = []
+        self.performance_log = []
+        self.calls = {}
+        self.current_url = 'about:blank'
+        self.viewers = []
+        self.dialog_open = False
+        self.first_row = 0
+        self._page = None
+        self._account = None
+
+    def record(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    @property
+    def call_count(self):
+        return sum(self.calls.values())
+
+    # Navigation
+
+    def get(self, url):
+        self.record('get')
+        self.current_url = url
+        parts = [part for part in urlparse(url).path.split('/') if part]
+        self.dialog_open = False
+        self.first_row = 0
+        self.viewers = []
+        if self.page_load:
+            time.sleep(self.page_load)
+        if self.site is not None and urlparse(url).scheme != 'about' and not self.site.admit():
+            self._page, self._account = 'rate_limited', None
+        elif not parts:
+            self._page, self._account = 'home', None
+            if self.sessions is not None and not self._logged_in():
+                self._log_in()
+        elif self.sessions is not None and not self._logged_in() and urlparse(url).scheme != 'about':
+            self._page, self._account = 'login', None
+            self.current_url = f"{self.base_url}/accounts/login/"
+        elif parts[0] == 'stories' and len(parts) >= 2 and self.accounts.get(parts[1]):
+            self._page, self._account = 'story', parts[1]
+            self.viewers = self.accounts[parts[1]]
+        elif parts[0] in self.accounts:
+            self._page, self._account = 'profile', parts[0]
+        else:
+            self._page, self._account = 'not_found', None
+        if self._page in PAGE_RESOURCES:
+            self._load_resources(self._page)
+
+    @property
+    def page_source(self):
+        self.record('page_source')
+        if self._page == 'rate_limited':
+            return f"<html><body><p>{RATE_LIMIT_TEXT}</p></body></html>"
+        return f"<html><body><main>{self._page}</main></body></html>"
+
+    def _load_resources(self, page):
+        """Log the document and its sub-resources like Chrome's performance log"""
+        origin = f"{urlparse(self.base_url).scheme}://{urlparse(self.base_url).netloc}"
+        requests = [(self.current_url, DOCUMENT_BYTES)] + [(origin + path, size) for path, _, size in PAGE_RESOURCES[page]]
+        for url, size in requests:
+            request_id = str(len(self.performance_log))
+            self._log_network('Network.requestWillBeSent', requestId=request_id, request={'url': url})
+            if any(fnmatchcase(url, pattern) for pattern in self.blocked_urls):
+                self._log_network('Network.loadingFailed', requestId=request_id, blockedReason='inspector')
+            else:
+                self._log_network('Network.loadingFinished', requestId=request_id, encodedDataLength=size)
+
+    def _log_network(self, method, **params):
+        self.performance_log.append({'message': json.dumps({'message': {'method': method, 'params': params}})})
+
+    def get_log(self, log_type):
+        self.record('get_log')
+        entries, self.performance_log = self.performance_log, []
+        return entries if log_type == 'performance' else []
+
+    def _logged_in(self):
+        return any(cookie['name'] == 'sessionid' and cookie['value'] in self.sessions for cookie in self.cookies)
+
+    def _log_in(self):
+        time.sleep(self.login_delay)
+        token = secrets.token_hex(16)
+        self.sessions.add(token)
+        self.cookies = [c for c in self.cookies if c['name'] != 'sessionid']
+        self.cookies.append({'name': 'sessionid', 'value': token, 'domain': '.instagram.com', 'path': '/',
+                             'secure': True, 'httpOnly': True, 'expires': time.time() + 90 * 86400,
+                             'session': False})
+
+    def execute_cdp_cmd(self, command, params):
+        """The DevTools commands BrowserPool uses to isolate sessions"""
+        self.record('execute_cdp_cmd')
+        if command == 'Network.getAllCookies':
+            return {'cookies': [dict(cookie) for cookie in self.cookies]}
+        if command == 'Network.setCookies':
+            names = {cookie['name'] for cookie in params['cookies']}
+            self.cookies = [c for c in self.cookies if c['name'] not in names]
+            self.cookies += [dict(cookie, session='expires' not in cookie) for cookie in params['cookies']]
+        elif command == 'Network.clearBrowserCookies':
+            self.cookies = []
+        elif command == 'Network.setBlockedURLs':
+            self.blocked_urls = list(params['urls'])
+        return {}
+
+    def execute_script(self, script, *args):
+        self.record('execute_script')
+        if 'document.readyState' in script:
+            return 'complete'
+        if 'click()' in script and args:
+            self._click(args[0])
+        return None
+
+    def _click(self, element):
+        if element.kind == 'ring':
+            self.get(f"{self.base_url}/stories/{self._account}/1/")
+        elif element.kind == 'seen_by':
+            self.dialog_open = True
+
+    # Lookups
+
+    def find_element(self, by, value):
+        elements = self.find_elements(by, value, record=False)
+        self.record('find_element')
+        if not elements:
+            raise NoSuchElementException(value)
+        return elements[0]
+
+    def find_elements(self, by, value, record=True):
+        if record:
+            self.record('find_elements')
+        if by == By.CSS_SELECTOR:
+            if value == 'main, form, nav':
+                return [FakeElement(self, 'main')] if self._page in ('home', 'login', 'profile', 'story') else []
+            if value == 'header':
+                return [FakeElement(self, 'header')] if self._page in ('profile', 'story') else []
+            if 'canvas' in value:
+                if self._page == 'profile' and self.accounts.get(self._account) and '77' in value:
+                    ring = FakeElement(self, 'ring')
+                    return [FakeElement(self, 'canvas', parent=ring)]
+                return []
+            if value == "div[role='dialog'] a[href*='/']":
+                return self._row_links()[:1]
+            if value.startswith('a[href'):
+                return self._page_links()
+            return []
+        if by == By.XPATH and 'Seen by' in value:
+            if self._page == 'story':
+                return [FakeElement(self, 'seen_by', text=f"Seen by {len(self.viewers)}")]
+        return []
+
+    def _rendered_range(self):
+        if not self.dialog_open:
+            return range(0)
+        start = max(0, self.first_row - OVERSCAN_ROWS)
+        return range(start, min(len(self.viewers), self.first_row + VISIBLE_ROWS + OVERSCAN_ROWS))
+
+    def _row_links(self):
+        links = []
+        for index in self._rendered_range():
+            username = self.viewers[index][0]
+            row = FakeElement(self, 'row', row=index)
+            cell = FakeElement(self, 'cell', parent=row)
+            links.append(FakeElement(self, 'link', text=username, href=f"{self.base_url}/{username}/",
+                                     parent=cell, row=index))
+        return links
+
+    def _page_links(self):
+        links = []
+        if self._page == 'story':
+            links.append(FakeElement(self, 'link', text=self._account, href=f"{self.base_url}/{self._account}/"))
+        return links + self._row_links()
+
+    def execute_async_script(self, script, *args):
+        """Models VIEWER_EXTRACTION_SCRIPT: read the rendered rows, then scroll one page"""
+        self.record('execute_async_script')
+        scroll = args[2] if len(args) > 2 else False
+        entries = [{'href': link.href, 'text': link._text,
+                    'liked': link.row is not None and self.viewers[link.row][1]}
+                   for link in self._page_links()]
+        if not scroll or not self.dialog_open or len(self.viewers) <= VISIBLE_ROWS:
+            return {'entries': entries, 'atEnd': True}
+        before = self.first_row
+        self.first_row = min(before + VISIBLE_ROWS, len(self.viewers) - VISIBLE_ROWS)
+        return {'entries': entries, 'atEnd': self.first_row <= before}
+
+    def quit(self):
+        self.record('quit')
+
+
+# Fake DevTools browser
+
+class FakeChrome:
+    """A browser for CDPBrowserPool (cdp.py) without Chrome
+
+    Stands in for a ChromeProcess: ``connection`` answers the DevTools
+    commands the asyncio engine sends, with one FakeDriver page per browser
+    context, so pages, cookies, logins and the site's rate limit behave as
+    with FakeDriver. Each command costs ``latency`` seconds and each
+    navigation ``page_load`` (plus ``login_delay`` when it logs in), awaited
+    instead of slept. Story ring clicks navigate in the background, as in a
+    browser.
+    """
+
+    def __init__(self, accounts, base_url='https://fixtures.local', latency=0.0,
+                 sessions=None, login_delay=0.0, page_load=0.0, site=None):
+        self.connection = FakeConnection(accounts, base_url, latency, sessions, login_delay, page_load, site)
+
+    def rss_mb(self):
+        return None
+
+    async def close(self):
+        self.connection.closed = True
+
+
+class FakeConnection:
+    def __init__(self, accounts, base_url, latency, sessions, login_delay, page_load, site):
+        self.accounts = accounts
+        self.base_url = base_url
+        self.latency = latency
+        self.sessions = sessions
+        self.login_delay = login_delay
+        self.page_load = page_load
+        self.site = site
+        self.closed = False
+        self.calls = {}
+        self._ids = itertools.count(1)
+        self._contexts = {}  # browser context id -> FakeDriver
+        self._targets = {}  # target id -> browser context id
+        self._tabs = {}  # session id -> target id
+        self._network = set()  # session ids with Network enabled
+        self._listeners = {}
+
+    def listen(self, session_id, callback):
+        self._listeners[session_id] = callback
+
+    def unlisten(self, session_id):
+        self._listeners.pop(session_id, None)
+
+    async def close(self):
+        self.closed = True
+
+    async def send(self, method, params=None, session_id=None):
+        if self.closed:
+            raise CDPError(f"browser connection closed ({method})")
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        params = params or {}
+        if method == 'Target.createBrowserContext':
+            context_id = f'context-{next(self._ids)}'
+            self._contexts[context_id] = FakeDriver(self.accounts, self.base_url, sessions=self.sessions, site=self.site)
+            return {'browserContextId': context_id}
+        if method == 'Target.createTarget':
+            target_id = f'target-{next(self._ids)}'
+            self._targets[target_id] = params['browserContextId']
+            return {'targetId': target_id}
+        if method == 'Target.attachToTarget':
+            tab = f'session-{next(self._ids)}'
+            self._tabs[tab] = params['targetId']
+            return {'sessionId': tab}
+        if method == 'Target.disposeBrowserContext':
+            self._contexts.pop(params['browserContextId'], None)
+            return {}
+        if method == 'Storage.getCookies':
+            return self._contexts[params['browserContextId']].execute_cdp_cmd('Network.getAllCookies', {})
+        if method == 'Storage.setCookies':
+            return self._contexts[params['browserContextId']].execute_cdp_cmd('Network.setCookies', params)
+        driver = self._driver(session_id)
+        if method == 'Network.enable':
+            self._network.add(session_id)
+        elif method == 'Network.setBlockedURLs':
+            driver.execute_cdp_cmd(method, params)
+        elif method == 'Page.navigate':
+            asyncio.get_running_loop().create_task(self._navigate(session_id, params['url']))
+            return {'frameId': session_id}
+        elif method == 'Runtime.evaluate':
+            return {'result': {'type': 'object', 'value': self._evaluate(session_id, driver, params['expression'])}}
+        return {}
+
+    def _driver(self, session_id):
+        try:
+            return self._contexts[self._targets[self._tabs[session_id]]]
+        except KeyError:
+            raise CDPError(f"No session with given id: {session_id}") from None
+
+    async def _navigate(self, session_id, url):
+        driver = self._driver(session_id)
+        delay = self.page_load
+        if self.sessions is not None and not urlparse(url).path.strip('/') and not driver._logged_in():
+            delay += self.login_delay
+        if delay:
+            await asyncio.sleep(delay)
+        driver.get(url)
+        events = [json.loads(entry['message'])['message'] for entry in driver.get_log('performance')]
+        listener = self._listeners.get(session_id)
+        if listener is None:
+            return
+        if session_id in self._network:
+            for event in events:
+                listener(event['method'], event['params'])
+        listener('Page.loadEventFired', {'timestamp': time.monotonic()})
+
+    def _evaluate(self, session_id, driver, expression):
+        """Models monitor.py's in-page functions, recognized by their text"""
+        if expression.startswith('new Promise(done =>'):
+            start = expression.rindex('.apply(null, ') + len('.apply(null, ')
+            args = json.loads(expression[start:expression.rindex('.concat([done])')])
+            return driver.execute_async_script('', *args)
+        # cdp.call_expression: "(function)(arg, ...)"
+        split = expression.rindex(')(')
+        function, args = expression[:split + 1], json.loads(f"[{expression[split + 2:-1]}]")
+        if 'document.readyState' in function:
+            return bool(driver.find_elements(By.CSS_SELECTOR, 'main, form, nav'))
+        if "querySelector('header')" in function:
+            return bool(driver.find_elements(By.CSS_SELECTOR, 'header')) or '/accounts/login' in driver.current_url
+        if 'location.href.includes(part)' in function:
+            return args[0] in driver.current_url
+        if "div[role='dialog']" in function:
+            return bool(driver.find_elements(By.CSS_SELECTOR, "div[role='dialog'] a[href*='/']"))
+        if 'outerHTML' in function:
+            return driver.page_source
+        if 'location.href' in function:
+            return driver.current_url
+        if 'canvas' in function:
+            ring = next((canvas.parent for selector in args[0]
+                         for canvas in driver.find_elements(By.CSS_SELECTOR, selector)), None)
+            if ring is not None and args[1]:
+                url = f"{self.base_url}/stories/{driver._account}/1/"
+                asyncio.get_running_loop().create_task(self._navigate(session_id, url))
+            return ring is not None
+        if 'XPathResult' in function:
+            seen_by = next((element for xpath in args[0] for element in driver.find_elements(By.XPATH, xpath)), None)
+            if seen_by is not None and args[1]:
+                driver.dialog_open = True
+            return seen_by is not None
+        raise CDPError(f"fixture cannot evaluate {function[:40]!r}")
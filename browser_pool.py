@@ -0,0 +1,333 @@
+"""
+Shared headless browser pool for Instagram monitors
+N monitored accounts share K browsers, each checked out for a single scrape
+"""
+
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+import telemetry
+from sessions import cookie_digest, session_cookies_valid
+from telemetry import log_event
+
+# Cookie fields accepted by the DevTools Network.setCookies command
+COOKIE_PARAM_FIELDS = ('name', 'value', 'domain', 'path', 'secure', 'httpOnly', 'sameSite', 'expires')
+
+
+class PoolTimeout(Exception):
+    """No browser became available within the checkout timeout"""
+
+
+class PooledBrowser:
+    """A pooled driver plus the bookkeeping used to decide when to recycle it"""
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.uses = 0
+        self.created_at = time.time()
+        self.account = None
+        self.needs_login = False
+
+
+class CookieJars:
+    """Per-account cookie jars, in memory and (with a ``session_store``) in the database
+
+    Shared by the Selenium and DevTools browser pools. A jar missing from
+    memory is loaded from the store and used only if it still holds a live
+    login cookie; a jar is written back only when its cookies changed.
+    """
+
+    def __init__(self, session_store=None):
+        self.session_store = session_store
+        self._lock = threading.Lock()
+        self._jars = {}
+        self._stored_digests = {}  # account -> digest of the jar last written to the store
+
+    def load(self, account):
+        """The account's jar from memory or the store, or None when it has to log in"""
+        with self._lock:
+            cookies = self._jars.get(account)
+        source = 'memory' if cookies is not None else None
+        if cookies is None and self.session_store is not None:
+            cookies = self._load_stored(account)
+            source = 'store' if cookies is not None else None
+        telemetry.session_restores_total.inc(source=source or 'none')
+        return cookies
+
+    def remember(self, account, cookies):
+        with self._lock:
+            self._jars[account] = cookies
+
+    def forget(self, account):
+        with self._lock:
+            self._jars.pop(account, None)
+            self._stored_digests.pop(account, None)
+
+    def invalidate(self, account):
+        self.forget(account)
+        if self.session_store is not None:
+            try:
+                self.session_store.delete(account)
+            except Exception as e:
+                log_event('session_store_failed', level='error', action='delete', error=str(e), account=account)
+
+    def _load_stored(self, account):
+        """A stored jar that still holds a live login cookie, or None"""
+        try:
+            cookies = self.session_store.load(account)
+        except Exception as e:
+            log_event('session_store_failed', level='error', action='load', error=str(e), account=account)
+            return None
+        if not session_cookies_valid(cookies):
+            if cookies is not None:
+                telemetry.session_restores_total.inc(source='store_expired')
+            return None
+        with self._lock:
+            self._jars[account] = cookies
+            self._stored_digests[account] = cookie_digest(cookies)
+        return cookies
+
+    def store(self, account, cookies):
+        """Write a jar to the store when its cookies changed since the last write"""
+        if self.session_store is None or not session_cookies_valid(cookies):
+            return
+        digest = cookie_digest(cookies)
+        with self._lock:
+            if self._stored_digests.get(account) == digest:
+                return
+        try:
+            self.session_store.save(account, cookies)
+        except Exception as e:
+            log_event('session_store_failed', level='error', action='save', error=str(e), account=account)
+            return
+        with self._lock:
+            self._stored_digests[account] = digest
+
+
+def cookie_params(cookies):
+    """DevTools cookies as Network.setCookies / Storage.setCookies parameters"""
+    saved = []
+    for cookie in cookies:
+        param = {field: cookie[field] for field in COOKIE_PARAM_FIELDS if field in cookie}
+        if cookie.get('session'):
+            param.pop('expires', None)
+        saved.append(param)
+    return saved
+
+
+class BrowserPool:
+    """Bounded pool of browsers with per-account session isolation
+
+    Each checkout restores the account's cookie jar into a clean browser and
+    each return saves it back and wipes the browser, so accounts never see
+    each other's sessions. With a ``session_store`` the jars also outlive the
+    process: a jar missing from memory is loaded from the store and used if
+    it still holds a live login cookie. Browsers are health-checked on checkout and
+    recycled after ``max_uses`` scrapes or once their process tree exceeds
+    ``max_rss_mb``.
+    """
+
+    def __init__(self, factory, size=2, max_uses=50, max_rss_mb=None,
+                 checkout_timeout=300, isolation_origins=('https://www.instagram.com',),
+                 session_store=None):
+        self._factory = factory
+        self.size = size
+        self.max_uses = max_uses
+        self.max_rss_mb = max_rss_mb
+        self.checkout_timeout = checkout_timeout
+        self.isolation_origins = isolation_origins
+        self.session_store = session_store
+        self.sessions = CookieJars(session_store)
+
+        self._cond = threading.Condition()
+        self._idle = []
+        self._browsers = set()  # every open browser, idle or checked out
+        self._created = 0
+        self.stats = {'created': 0, 'recycled': 0, 'unhealthy': 0, 'checkouts': 0, 'waits': 0}
+
+    @contextmanager
+    def checkout(self, account, timeout=None):
+        """Borrow a browser for one scrape on behalf of ``account``"""
+        browser = self._acquire(self.checkout_timeout if timeout is None else timeout)
+        try:
+            self._restore_session(browser, account)
+        except Exception:
+            self._discard(browser)
+            raise
+
+        try:
+            yield browser
+        finally:
+            self._release(browser, account)
+
+    def forget(self, account):
+        """Drop the in-memory session of an account this process stopped monitoring"""
+        self.sessions.forget(account)
+
+    def invalidate(self, account):
+        """Discard a session Instagram rejected, in memory and in the store"""
+        self.sessions.invalidate(account)
+
+    def close(self):
+        """Quit every idle browser"""
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._created -= len(idle)
+            self._browsers.difference_update(idle)
+            self._cond.notify_all()
+        for browser in idle:
+            self._quit(browser)
+
+    @property
+    def open_count(self):
+        return len(self._browsers)
+
+    def rss_mb(self):
+        """Resident memory of every open browser's process tree in MB"""
+        with self._cond:
+            browsers = list(self._browsers)
+        sizes = [browser_rss_mb(browser.driver) for browser in browsers]
+        return sum(size for size in sizes if size is not None)
+
+    def _acquire(self, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            create = False
+            with self._cond:
+                while not self._idle and self._created >= self.size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeout(f"No browser available after {timeout}s")
+                    self.stats['waits'] += 1
+                    self._cond.wait(remaining)
+                if self._idle:
+                    browser = self._idle.pop()
+                else:
+                    self._created += 1
+                    create = True
+
+            if create:
+                try:
+                    browser = PooledBrowser(self._factory())
+                except Exception:
+                    with self._cond:
+                        self._created -= 1
+                        self._cond.notify()
+                    raise
+                self.stats['created'] += 1
+                with self._cond:
+                    self._browsers.add(browser)
+            elif not self._is_healthy(browser):
+                self.stats['unhealthy'] += 1
+                self._discard(browser)
+                continue
+
+            self.stats['checkouts'] += 1
+            return browser
+
+    def _release(self, browser, account):
+        browser.uses += 1
+        try:
+            cookies = self._save_session(browser)
+            self.sessions.remember(account, cookies)
+            self._clear_session(browser)
+        except Exception as e:
+            log_event('browser_release_failed', level='error', error=str(e), account=account)
+            self._discard(browser)
+            return
+        self.sessions.store(account, cookies)
+
+        if browser.uses >= self.max_uses or self._over_memory(browser):
+            self.stats['recycled'] += 1
+            self._discard(browser)
+            return
+
+        with self._cond:
+            self._idle.append(browser)
+            self._cond.notify()
+
+    def _discard(self, browser):
+        self._quit(browser)
+        with self._cond:
+            self._created -= 1
+            self._browsers.discard(browser)
+            self._cond.notify()
+
+    def _quit(self, browser):
+        try:
+            browser.driver.quit()
+        except Exception:
+            pass
+
+    def _is_healthy(self, browser):
+        try:
+            browser.driver.execute_script("return 1")
+        except Exception:
+            return False
+        return not self._over_memory(browser)
+
+    def _over_memory(self, browser):
+        if not self.max_rss_mb:
+            return False
+        rss = browser_rss_mb(browser.driver)
+        return rss is not None and rss > self.max_rss_mb
+
+    def _restore_session(self, browser, account):
+        cookies = self.sessions.load(account)
+        browser.account = account
+        browser.needs_login = cookies is None
+        if cookies:
+            browser.driver.execute_cdp_cmd('Network.setCookies', {'cookies': cookies})
+
+    def _save_session(self, browser):
+        return cookie_params(browser.driver.execute_cdp_cmd('Network.getAllCookies', {})['cookies'])
+
+    def _clear_session(self, browser):
+        driver = browser.driver
+        driver.execute_cdp_cmd('Network.clearBrowserCookies', {})
+        for origin in self.isolation_origins:
+            driver.execute_cdp_cmd('Storage.clearDataForOrigin',
+                                   {'origin': origin, 'storageTypes': 'all'})
+        driver.get('about:blank')
+        browser.account = None
+
+
+def browser_rss_mb(driver):
+    """Resident memory of a driver's process tree in MB (None if unavailable)"""
+    service = getattr(driver, 'service', None)
+    process = getattr(service, 'process', None)
+    if process is None:
+        return None
+    return process_tree_rss_mb(process.pid)
+
+
+def process_tree_rss_mb(root_pid):
+    """Sum RSS over a process and all its descendants using /proc"""
+    if not os.path.isdir('/proc'):
+        return None
+
+    children = {}
+    rss_pages = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                stat = f.read()
+            with open(f'/proc/{entry}/statm') as f:
+                rss_pages[int(entry)] = int(f.read().split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        # The command name may contain spaces, so split after its closing paren
+        ppid = int(stat.rsplit(')', 1)[1].split()[1])
+        children.setdefault(ppid, []).append(int(entry))
+
+    total = 0
+    stack = [root_pid]
+    while stack:
+        pid = stack.pop()
+        total += rss_pages.get(pid, 0)
+        stack.extend(children.get(pid, []))
+    return total * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
@@ -0,0 +1,216 @@
+"""
+Read-through cache for per-user views
+An in-process LRU with TTL in front of a shared backend (a SQLite file
+shared by the processes on one host by default, or Redis across hosts).
+Entries are keyed by a per-user version that writers bump after
+committing, so a bump makes every older entry unreachable, and by the
+user's data version read from the database, so an ingest that could not
+bump this cache (a worker on another host) still does.
+"""
+
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import telemetry
+from telemetry import log_event
+
+
+class LRUCache:
+    """Thread-safe in-process LRU with a per-entry TTL"""
+
+    def __init__(self, max_entries=2048, ttl=30):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + (ttl or self.ttl))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class RedisBackend:
+    """Shared backend on Redis (needs the optional ``redis`` package)"""
+
+    def __init__(self, url):
+        import redis
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        raw = self._client.get(key)
+        return None if raw is None else pickle.loads(raw)
+
+    def set(self, key, value, ttl):
+        self._client.set(key, pickle.dumps(value), ex=int(ttl))
+
+    def incr(self, key):
+        return self._client.incr(key)
+
+    def get_version(self, key):
+        raw = self._client.get(key)
+        return int(raw) if raw is not None else 0
+
+
+class LocalSharedBackend:
+    """Stand-in for a shared cache: a SQLite file shared by the processes on one host"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, expires_at REAL)")
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._connect().execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return None
+        return pickle.loads(row[0])
+
+    def set(self, key, value, ttl):
+        conn = self._connect()
+        conn.execute("INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                     (key, pickle.dumps(value), time.time() + ttl))
+        # Keep the file small: drop expired entries now and then
+        self._writes += 1
+        if self._writes % 500 == 0:
+            conn.execute("DELETE FROM cache WHERE expires_at < ?", (time.time(),))
+
+    def incr(self, key):
+        conn = self._connect()
+        conn.execute("INSERT INTO cache (key, value, expires_at) VALUES (?, ?, NULL) "
+                     "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1", (key, 1))
+        return self.get_version(key)
+
+    def get_version(self, key):
+        row = self._connect().execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone()
+        return int(row[0]) if row is not None else 0
+
+
+class ViewCache:
+    """Per-user read-through cache with version-key invalidation
+
+    ``data_version(user_id)``, when given, returns something that changes
+    whenever the user's data does; it runs inside the view, so it reads the
+    same database (primary or replica) as the view itself.
+    """
+
+    def __init__(self, local=None, shared=None, ttl=30, enabled=True, data_version=None):
+        self.local = local or LRUCache(ttl=ttl)
+        self.shared = shared
+        self.ttl = ttl
+        self.enabled = enabled
+        self.data_version = data_version
+        self._versions = {}  # used when there is no shared backend
+        self._versions_lock = threading.Lock()
+        self.stats = {'hits': 0, 'shared_hits': 0, 'misses': 0, 'bumps': 0}
+        self._stats_lock = threading.Lock()
+
+    def version(self, user_id):
+        key = f"version:{user_id}"
+        if self.shared is not None:
+            return self.shared.get_version(key)
+        return self._versions.get(key, 0)
+
+    def bump(self, user_id):
+        """Invalidate everything cached for a user; call after committing their data"""
+        self._count('bumps')
+        telemetry.view_cache_bumps_total.inc()
+        key = f"version:{user_id}"
+        if self.shared is not None:
+            try:
+                self.shared.incr(key)
+                return
+            except Exception as e:
+                log_event('cache_bump_failed', level='warning', error=str(e), user_id=user_id)
+        with self._versions_lock:
+            self._versions[key] = self._versions.get(key, 0) + 1
+
+    def get_or_compute(self, user_id, name, compute):
+        """Return the cached ``name`` view for a user, computing it on a miss"""
+        if not self.enabled:
+            return compute()
+        # Database errors propagate: a replica view falls back to the primary on them
+        data_version = self.data_version(user_id) if self.data_version else None
+        try:
+            key = f"{name}:{user_id}:{self.version(user_id)}:{data_version}"
+        except Exception as e:
+            log_event('cache_unavailable', level='warning', error=str(e))
+            return compute()
+
+        value = self.local.get(key)
+        if value is not None:
+            self._count('hits', 'hit')
+            return value
+        if self.shared is not None:
+            try:
+                value = self.shared.get(key)
+            except Exception as e:
+                log_event('cache_unavailable', level='warning', error=str(e))
+                value = None
+            if value is not None:
+                self._count('shared_hits', 'shared_hit')
+                self.local.set(key, value)
+                return value
+
+        self._count('misses', 'miss')
+        value = compute()
+        self.local.set(key, value)
+        if self.shared is not None:
+            try:
+                self.shared.set(key, value, self.ttl)
+            except Exception as e:
+                log_event('cache_unavailable', level='warning', error=str(e))
+        return value
+
+    def _count(self, stat, result=None):
+        with self._stats_lock:
+            self.stats[stat] += 1
+        if result is not None:
+            telemetry.view_cache_requests_total.inc(result=result)
+
+
+def view_cache_from_env(data_version=None):
+    """Build the cache from CACHE_BACKEND (local, redis, memory or off)"""
+    backend = os.environ.get('CACHE_BACKEND', 'local')
+    ttl = int(os.environ.get('CACHE_TTL', 30))
+    local = LRUCache(max_entries=int(os.environ.get('CACHE_MAX_ENTRIES', 2048)), ttl=ttl)
+    if backend == 'off':
+        return ViewCache(local, ttl=ttl, enabled=False)
+    if backend == 'redis':
+        return ViewCache(local, RedisBackend(os.environ['REDIS_URL']), ttl=ttl, data_version=data_version)
+    if backend == 'local':
+        path = os.environ.get('CACHE_PATH', '/tmp/instagram_monitor_cache.db')
+        return ViewCache(local, LocalSharedBackend(path), ttl=ttl, data_version=data_version)
+    return ViewCache(local, ttl=ttl, data_version=data_version)
@@ -0,0 +1,507 @@
+"""
+Chrome DevTools Protocol client for the asyncio scraping engine
+Chrome is driven over its DevTools websocket instead of chromedriver: one
+connection per browser carries the commands and events of all its tabs
+(flattened target sessions), so one event loop drives every scrape in the
+process. CDPBrowserPool shares a few browsers between many accounts, one
+tab in its own browser context per scrape; a context has its own cookie
+jar, so accounts stay isolated without wiping a shared browser.
+"""
+
+import asyncio
+import itertools
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from contextlib import asynccontextmanager
+from urllib.parse import urlparse
+
+from wsproto import ConnectionType, WSConnection
+from wsproto.events import AcceptConnection, CloseConnection, Ping, RejectConnection, Request, TextMessage
+
+from browser_pool import CookieJars, PoolTimeout, cookie_params, process_tree_rss_mb
+from telemetry import log_event
+
+CHROME_BINARIES = ('google-chrome', 'google-chrome-stable', 'chromium', 'chromium-browser', 'chrome')
+CHROME_ARGS = [
+    '--headless=new', '--no-sandbox', '--disable-dev-shm-usage', '--disable-gpu', '--disable-extensions',
+    '--no-first-run', '--no-default-browser-check', '--log-level=3', '--remote-debugging-port=0',
+]
+COMMAND_TIMEOUT = 60  # seconds; a command Chrome never answers fails instead of hanging the scrape
+
+
+class CDPError(Exception):
+    """A DevTools command failed, or the connection to the browser was lost"""
+
+
+class CDPConnection:
+    """JSON commands and events over one browser's DevTools websocket
+
+    Command results are matched to callers by id; events carry the
+    sessionId of the tab they came from and go to that tab's CDPSession.
+    """
+
+    def __init__(self, reader, writer, websocket):
+        self._reader = reader
+        self._writer = writer
+        self._ws = websocket
+        self._ids = itertools.count(1)
+        self._pending = {}  # command id -> future
+        self._listeners = {}  # session id -> callback(method, params)
+        self.closed = False
+        self._reader_task = asyncio.get_running_loop().create_task(self._read_loop())
+
+    @classmethod
+    async def connect(cls, url):
+        """Open the websocket at a ws://host:port/devtools/browser/<id> URL"""
+        parsed = urlparse(url)
+        reader, writer = await asyncio.open_connection(parsed.hostname, parsed.port, limit=2 ** 24)
+        websocket = WSConnection(ConnectionType.CLIENT)
+        writer.write(websocket.send(Request(host=parsed.netloc, target=parsed.path)))
+        await writer.drain()
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                writer.close()
+                raise CDPError(f"connection closed during the websocket handshake ({url})")
+            websocket.receive_data(data)
+            for event in websocket.events():
+                if isinstance(event, AcceptConnection):
+                    return cls(reader, writer, websocket)
+                if isinstance(event, RejectConnection):
+                    writer.close()
+                    raise CDPError(f"websocket rejected with status {event.status_code} ({url})")
+
+    async def send(self, method, params=None, session_id=None):
+        """Run a command (in a tab when ``session_id`` is given) and return its result"""
+        if self.closed:
+            raise CDPError(f"browser connection closed ({method})")
+        message_id = next(self._ids)
+        message = {'id': message_id, 'method': method, 'params': params or {}}
+        if session_id:
+            message['sessionId'] = session_id
+        future = asyncio.get_running_loop().create_future()
+        self._pending[message_id] = future
+        try:
+            self._writer.write(self._ws.send(TextMessage(data=json.dumps(message))))
+            await self._writer.drain()
+            return await asyncio.wait_for(future, COMMAND_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise CDPError(f"no answer to {method} after {COMMAND_TIMEOUT}s") from None
+        except ConnectionError as e:
+            raise CDPError(f"browser connection lost ({method}): {e}") from e
+        finally:
+            self._pending.pop(message_id, None)
+
+    def listen(self, session_id, callback):
+        self._listeners[session_id] = callback
+
+    def unlisten(self, session_id):
+        self._listeners.pop(session_id, None)
+
+    async def close(self):
+        if not self.closed:
+            self.closed = True
+            try:
+                self._writer.write(self._ws.send(CloseConnection(code=1000)))
+                await self._writer.drain()
+            except Exception:
+                pass
+        self._writer.close()
+        self._reader_task.cancel()
+
+    async def _read_loop(self):
+        parts = []
+        try:
+            while True:
+                data = await self._reader.read(1 << 16)
+                self._ws.receive_data(data or None)
+                if not data:
+                    return
+                for event in self._ws.events():
+                    if isinstance(event, TextMessage):
+                        # Large results (page HTML) arrive in several frames
+                        parts.append(event.data)
+                        if event.message_finished:
+                            self._dispatch(json.loads(''.join(parts)))
+                            parts = []
+                    elif isinstance(event, Ping):
+                        self._writer.write(self._ws.send(event.response()))
+                    elif isinstance(event, CloseConnection):
+                        return
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.closed = True
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(CDPError("browser connection closed"))
+
+    def _dispatch(self, message):
+        if 'id' in message:
+            future = self._pending.get(message['id'])
+            if future is None or future.done():
+                return
+            if 'error' in message:
+                future.set_exception(CDPError(message['error'].get('message', 'command failed')))
+            else:
+                future.set_result(message.get('result', {}))
+            return
+        listener = self._listeners.get(message.get('sessionId'))
+        if listener is not None:
+            listener(message.get('method'), message.get('params', {}))
+
+
+class CDPSession:
+    """One attached tab: its commands, in-page function calls and the events it emitted"""
+
+    def __init__(self, connection, session_id):
+        self.connection = connection
+        self.session_id = session_id
+        self.network_events = []  # (method, params) of Network.* events since the last drain
+        self._waiters = {}  # event method -> futures waiting for its next occurrence
+        connection.listen(session_id, self._on_event)
+
+    async def send(self, method, **params):
+        return await self.connection.send(method, params, self.session_id)
+
+    def next_event(self, method):
+        """Future for the next ``method`` event; create it before the command that triggers it"""
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(method, []).append(future)
+        return future
+
+    async def evaluate(self, expression, await_promise=False):
+        """Value of a JavaScript expression in the page (awaited when it is a Promise)"""
+        result = await self.send('Runtime.evaluate', expression=expression, returnByValue=True,
+                                 awaitPromise=await_promise)
+        if 'exceptionDetails' in result:
+            details = result['exceptionDetails']
+            raise CDPError(details.get('exception', {}).get('description') or details.get('text', 'script failed'))
+        return result.get('result', {}).get('value')
+
+    async def call(self, function, *args):
+        """Call a JavaScript function expression in the page with JSON arguments"""
+        return await self.evaluate(call_expression(function, *args))
+
+    async def navigate(self, url, timeout):
+        """Load ``url``, waiting up to ``timeout`` seconds for its load event
+
+        A page still loading after that is left to the caller's readiness
+        checks, as with a WebDriver page load.
+        """
+        loaded = self.next_event('Page.loadEventFired')
+        result = await self.send('Page.navigate', url=url)
+        if result.get('errorText'):
+            loaded.cancel()
+            raise CDPError(f"navigation to {url} failed: {result['errorText']}")
+        try:
+            await asyncio.wait_for(loaded, timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def drain_network_events(self):
+        events, self.network_events = self.network_events, []
+        return events
+
+    def detach(self):
+        self.connection.unlisten(self.session_id)
+        for futures in self._waiters.values():
+            for future in futures:
+                future.cancel()
+        self._waiters = {}
+
+    def _on_event(self, method, params):
+        if method.startswith('Network.'):
+            self.network_events.append((method, params))
+        for future in self._waiters.pop(method, ()):
+            if not future.done():
+                future.set_result(params)
+
+
+def call_expression(function, *args):
+    """``(function)(arg, ...)`` with the arguments as JSON literals"""
+    return f"({function})({', '.join(json.dumps(arg) for arg in args)})"
+
+
+class ChromeProcess:
+    """A headless Chrome started with remote debugging, and its DevTools connection"""
+
+    def __init__(self, process, connection, user_data_dir):
+        self.process = process
+        self.connection = connection
+        self.user_data_dir = user_data_dir
+
+    def rss_mb(self):
+        return process_tree_rss_mb(self.process.pid)
+
+    async def close(self):
+        try:
+            await asyncio.wait_for(self.connection.send('Browser.close'), 5)
+        except Exception:
+            pass
+        await self.connection.close()
+        try:
+            await asyncio.wait_for(self.process.wait(), 5)
+        except asyncio.TimeoutError:
+            self.process.kill()
+            await self.process.wait()
+        shutil.rmtree(self.user_data_dir, ignore_errors=True)
+
+
+def chrome_binary():
+    """CHROME_BINARY, else the first Chrome or Chromium on the PATH"""
+    binary = os.environ.get('CHROME_BINARY')
+    if binary:
+        return binary
+    for name in CHROME_BINARIES:
+        path = shutil.which(name)
+        if path:
+            return path
+    raise CDPError("Chrome not found; install it or set CHROME_BINARY")
+
+
+async def launch_chrome(extra_args=(), startup_timeout=30):
+    """Start a headless Chrome and connect to it
+
+    Chrome picks a free debugging port and writes it, with the browser's
+    websocket path, to DevToolsActivePort in its profile directory.
+    """
+    user_data_dir = tempfile.mkdtemp(prefix='instagram-monitor-chrome-')
+    process = await asyncio.create_subprocess_exec(
+        chrome_binary(), *CHROME_ARGS, *extra_args, f'--user-data-dir={user_data_dir}', 'about:blank',
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    port_file = os.path.join(user_data_dir, 'DevToolsActivePort')
+    deadline = time.monotonic() + startup_timeout
+    try:
+        while True:
+            try:
+                with open(port_file) as f:
+                    lines = f.read().split()
+                if len(lines) == 2:
+                    break
+            except FileNotFoundError:
+                pass
+            if process.returncode is not None:
+                raise CDPError(f"Chrome exited during startup (status {process.returncode})")
+            if time.monotonic() > deadline:
+                raise CDPError(f"Chrome did not open its DevTools port within {startup_timeout}s")
+            await asyncio.sleep(0.05)
+        connection = await CDPConnection.connect(f"ws://127.0.0.1:{lines[0]}{lines[1]}")
+    except BaseException:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        shutil.rmtree(user_data_dir, ignore_errors=True)
+        raise
+    return ChromeProcess(process, connection, user_data_dir)
+
+
+class CDPTab:
+    """A tab in its own browser context, checked out for one scrape"""
+
+    def __init__(self, browser, context_id, session):
+        self.browser = browser
+        self.context_id = context_id
+        self.session = session
+        self.account = None
+        self.needs_login = False
+
+
+class PooledChrome:
+    def __init__(self, chrome):
+        self.chrome = chrome
+        self.tabs = 0
+        self.uses = 0
+        self.retiring = False
+
+
+class CDPBrowserPool:
+    """Tabs in a few shared browsers, one fresh browser context per scrape
+
+    At most ``size`` browsers run ``tabs_per_browser`` scrapes each; a new
+    browser is started only when every open one is full. Each checkout
+    gets a new context with the account's cookies restored and disposes of
+    it afterwards, keeping the jar (CookieJars, as in BrowserPool), so
+    accounts never share a session. ``setup`` is awaited with every new
+    tab's CDPSession. Browsers are replaced after ``max_uses`` scrapes or
+    when their connection drops. ``launch`` is a coroutine function
+    returning a ChromeProcess (or anything with its connection and close()).
+    """
+
+    def __init__(self, launch, size=2, tabs_per_browser=8, max_uses=500, checkout_timeout=300,
+                 setup=None, session_store=None):
+        self._launch = launch
+        self.size = size
+        self.tabs_per_browser = tabs_per_browser
+        self.max_uses = max_uses
+        self.checkout_timeout = checkout_timeout
+        self._setup = setup
+        self.sessions = CookieJars(session_store)
+
+        self._browsers = []
+        self._slots = None  # created on first use, in the loop that runs the scrapes
+        self._launching = None
+        self.stats = {'created': 0, 'recycled': 0, 'unhealthy': 0, 'checkouts': 0, 'waits': 0}
+
+    @asynccontextmanager
+    async def checkout(self, account, timeout=None):
+        """Borrow a tab for one scrape on behalf of ``account``"""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.size * self.tabs_per_browser)
+            self._launching = asyncio.Lock()
+        if self._slots.locked():
+            self.stats['waits'] += 1
+        timeout = self.checkout_timeout if timeout is None else timeout
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout)
+        except asyncio.TimeoutError:
+            raise PoolTimeout(f"No browser tab available after {timeout}s") from None
+        try:
+            tab = await self._open_tab(account)
+            self.stats['checkouts'] += 1
+            try:
+                yield tab
+            finally:
+                await self._close_tab(tab, account)
+        finally:
+            self._slots.release()
+
+    def forget(self, account):
+        """Drop the in-memory session of an account this process stopped monitoring"""
+        self.sessions.forget(account)
+
+    def invalidate(self, account):
+        """Discard a session Instagram rejected, in memory and in the store"""
+        self.sessions.invalidate(account)
+
+    async def close(self):
+        """Close every browser"""
+        browsers, self._browsers = self._browsers, []
+        for browser in browsers:
+            await browser.chrome.close()
+
+    @property
+    def open_count(self):
+        return len(self._browsers)
+
+    @property
+    def tab_count(self):
+        return sum(browser.tabs for browser in self._browsers)
+
+    def rss_mb(self):
+        """Resident memory of every open browser's process tree in MB"""
+        sizes = [browser.chrome.rss_mb() for browser in list(self._browsers)]
+        return sum(size for size in sizes if size is not None)
+
+    async def _browser(self):
+        """The least busy open browser with a free tab, starting one if all are full"""
+        async with self._launching:
+            for browser in [b for b in self._browsers if b.chrome.connection.closed]:
+                self.stats['unhealthy'] += 1
+                await self._discard(browser)
+            available = [b for b in self._browsers if not b.retiring and b.tabs < self.tabs_per_browser]
+            if not available:
+                browser = PooledChrome(await self._launch())
+                self.stats['created'] += 1
+                self._browsers.append(browser)
+                return browser
+            return min(available, key=lambda b: b.tabs)
+
+    async def _open_tab(self, account):
+        browser = await self._browser()
+        connection = browser.chrome.connection
+        browser.tabs += 1
+        context_id, tab = None, None
+        try:
+            context_id = (await connection.send('Target.createBrowserContext',
+                                                {'disposeOnDetach': True}))['browserContextId']
+            target_id = (await connection.send('Target.createTarget',
+                                               {'url': 'about:blank', 'browserContextId': context_id}))['targetId']
+            session_id = (await connection.send('Target.attachToTarget',
+                                                {'targetId': target_id, 'flatten': True}))['sessionId']
+            tab = CDPTab(browser, context_id, CDPSession(connection, session_id))
+            if self._setup is not None:
+                await self._setup(tab.session)
+            await self._restore_session(tab, account)
+        except Exception:
+            if tab is not None:
+                tab.session.detach()
+            await self._dispose_context(browser, context_id)
+            if connection.closed:
+                self.stats['unhealthy'] += 1
+                await self._discard(browser)
+            raise
+        return tab
+
+    async def _close_tab(self, tab, account):
+        browser = tab.browser
+        browser.uses += 1
+        cookies = None
+        try:
+            cookies = cookie_params((await browser.chrome.connection.send(
+                'Storage.getCookies', {'browserContextId': tab.context_id}))['cookies'])
+            self.sessions.remember(account, cookies)
+        except Exception as e:
+            log_event('browser_release_failed', level='error', error=str(e), account=account)
+        tab.session.detach()
+        await self._dispose_context(browser, tab.context_id)
+        if cookies is not None and self.sessions.session_store is not None:
+            # The store is the database; keep it off the event loop
+            await asyncio.to_thread(self.sessions.store, account, cookies)
+
+        if not browser.retiring and (browser.uses >= self.max_uses or browser.chrome.connection.closed):
+            browser.retiring = True
+            self.stats['recycled'] += 1
+        if browser.retiring and browser.tabs == 0 and browser in self._browsers:
+            await self._discard(browser)
+
+    async def _dispose_context(self, browser, context_id):
+        browser.tabs -= 1
+        if context_id is None:
+            return
+        try:
+            await browser.chrome.connection.send('Target.disposeBrowserContext', {'browserContextId': context_id})
+        except CDPError:
+            pass
+
+    async def _discard(self, browser):
+        if browser in self._browsers:
+            self._browsers.remove(browser)
+        try:
+            await browser.chrome.close()
+        except Exception:
+            pass
+
+    async def _restore_session(self, tab, account):
+        if self.sessions.session_store is None:
+            cookies = self.sessions.load(account)
+        else:
+            # A jar missing from memory is read from the database
+            cookies = await asyncio.to_thread(self.sessions.load, account)
+        tab.account = account
+        tab.needs_login = cookies is None
+        if cookies:
+            await tab.browser.chrome.connection.send(
+                'Storage.setCookies', {'cookies': cookies, 'browserContextId': tab.context_id})
+
+
+class LoopThread:
+    """An asyncio event loop running in a daemon thread, for callers that are not coroutines"""
+
+    def __init__(self, name='cdp-engine'):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, coroutine):
+        """Schedule a coroutine on the loop; returns a concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
@@ -0,0 +1,180 @@
+"""
+Database connection pools and read-replica routing
+Web workers and monitor workers need differently sized pools: a gunicorn
+web worker serves one request per thread, a monitor worker holds
+connections for its scrape threads and ingest writers. DB_POOL_* settings
+apply to both roles and WEB_DB_POOL_* / WORKER_DB_POOL_* override them for
+one. Every pool reports checkout waits, overflow and timeouts to /metrics.
+
+With DATABASE_REPLICA_URL set, web views marked @read_replica (dashboard,
+analytics, api_stats) run their queries on the replica. A replica that
+fails is skipped for REPLICA_RETRY_SECONDS and the view runs again on the
+primary; a user who just submitted a form reads from the primary for
+REPLICA_STICKY_SECONDS, so replication lag never hides their own change.
+Cached views are keyed on the data version the replica itself reports
+(see cache.py), so the cache stops serving replica data once it caught up.
+"""
+
+import os
+import time
+from functools import wraps
+
+from flask import current_app, g, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine
+from sqlalchemy.exc import InterfaceError, OperationalError, TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+import telemetry
+from telemetry import log_event
+
+# Per-role defaults; web matches the 8 gthread threads per worker in the Procfile
+POOL_DEFAULTS = {
+    'web': {'pool_size': 8, 'max_overflow': 4},
+    'worker': {'pool_size': 4, 'max_overflow': 8},
+}
+
+
+def _setting(role, name, default, cast=int):
+    value = os.environ.get(f'{role.upper()}_{name}') or os.environ.get(name)
+    return default if value is None else cast(value)
+
+
+def _flag(value):
+    return value.strip().lower() not in ('0', 'false', 'off', 'no')
+
+
+def engine_options(role, url, pool='primary'):
+    """create_engine() options for a process of ``role`` ('web' or 'worker')"""
+    if role not in POOL_DEFAULTS:
+        raise ValueError(f"Unknown database role: {role}")
+    if url.startswith('sqlite') and (':memory:' in url or url.rstrip('/') == 'sqlite:'):
+        return {}  # one shared connection (Flask-SQLAlchemy's StaticPool); nothing to size
+    defaults = POOL_DEFAULTS[role]
+    return {
+        'poolclass': metered_pool(role, pool),
+        'pool_size': _setting(role, 'DB_POOL_SIZE', defaults['pool_size']),
+        'max_overflow': _setting(role, 'DB_MAX_OVERFLOW', defaults['max_overflow']),
+        'pool_timeout': _setting(role, 'DB_POOL_TIMEOUT', 30, float),
+        'pool_recycle': _setting(role, 'DB_POOL_RECYCLE', 1800),
+        'pool_pre_ping': _setting(role, 'DB_POOL_PRE_PING', True, _flag),
+    }
+
+
+class MeteredQueuePool(QueuePool):
+    """QueuePool that reports checkout time, connections in use, overflow and timeouts"""
+
+    labels = {}
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            telemetry.db_pool_timeouts_total.inc(**self.labels)
+            raise
+        telemetry.db_pool_checkout_seconds.observe(time.perf_counter() - started, **self.labels)
+        self._report()
+        return connection
+
+    def _do_return_conn(self, record):
+        super()._do_return_conn(record)
+        self._report()
+
+    def _report(self):
+        telemetry.db_pool_checked_out.set(self.checkedout(), **self.labels)
+        telemetry.db_pool_overflow.set(max(self.overflow(), 0), **self.labels)
+
+
+def metered_pool(role, pool):
+    # A class per engine: engine.dispose() rebuilds the pool from self.__class__, labels included
+    return type('MeteredQueuePool', (MeteredQueuePool,), {'labels': {'role': role, 'pool': pool}})
+
+
+class ReplicaRouter:
+    """A web app's replica engine, and whether it is currently worth trying"""
+
+    def __init__(self, engine, retry_seconds=30, sticky_seconds=10):
+        self.engine = engine
+        self.retry_seconds = retry_seconds
+        self.sticky_seconds = sticky_seconds
+        self._down_until = 0.0
+
+    @property
+    def available(self):
+        return time.monotonic() >= self._down_until
+
+    def fallback(self, reason, error=None):
+        """Count a view sent back to the primary; errors bench the replica for retry_seconds"""
+        telemetry.db_replica_fallbacks_total.inc(reason=reason)
+        if error is not None:
+            self._down_until = time.monotonic() + self.retry_seconds
+            log_event('replica_unavailable', level='warning', error=str(error).splitlines()[0],
+                      retry_in=self.retry_seconds)
+
+
+def replica_from_env(role='web'):
+    """DATABASE_REPLICA_URL=postgresql://... (unset: every query goes to the primary)"""
+    url = os.environ.get('DATABASE_REPLICA_URL')
+    if not url:
+        return None
+    return ReplicaRouter(create_engine(url, **engine_options(role, url, pool='replica')),
+                         retry_seconds=float(os.environ.get('REPLICA_RETRY_SECONDS', 30)),
+                         sticky_seconds=float(os.environ.get('REPLICA_STICKY_SECONDS', 10)))
+
+
+class RoutingSession(Session):
+    """Flask-SQLAlchemy session that sends the queries of @read_replica views to the replica"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        replica = g.get('db_replica')
+        if bind is None and replica is not None and not self._flushing:
+            return replica.engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def read_replica(view):
+    """Run a read-only view's queries on the replica, falling back to the primary
+
+    The view may run twice (replica, then primary), so it must not write.
+    Views cached in store.view_cache stay correct on a lagging replica: the
+    cache key includes the rollups' updated_at, read here from the replica
+    too, so what a lagging replica computed is only found again while the
+    replica still reports that version.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        replica = current_app.extensions.get('db_replica')
+        if replica is None:
+            return view(*args, **kwargs)
+        if not replica.available:
+            replica.fallback('unavailable')
+            return view(*args, **kwargs)
+        if session.get('db_primary_until', 0) > time.time():
+            telemetry.db_routed_views_total.inc(target='primary_sticky')
+            return view(*args, **kwargs)
+        g.db_replica = replica
+        try:
+            response = view(*args, **kwargs)
+            telemetry.db_routed_views_total.inc(target='replica')
+            return response
+        except PoolTimeoutError:
+            replica.fallback('pool_timeout')
+        except (OperationalError, InterfaceError) as e:
+            replica.fallback('error', e)
+        finally:
+            g.pop('db_replica', None)
+        # Drop whatever the failed attempt loaded before reading it again from the primary
+        db_session = current_app.extensions['sqlalchemy'].session
+        db_session.rollback()
+        db_session.expunge_all()
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def pin_writers_to_primary(response):
+    """after_request hook: a user who submitted something reads from the primary for a while"""
+    replica = current_app.extensions.get('db_replica')
+    if replica is not None and request.method not in ('GET', 'HEAD', 'OPTIONS'):
+        session['db_primary_until'] = time.time() + replica.sticky_seconds
+    return response
@@ -0,0 +1,135 @@
+"""
+Live ingest event fan-out for Server-Sent Events
+One poller thread per process reads new events from a shared source (the
+ingest_event table) and hands them to every local subscriber of that user
+"""
+
+import queue
+import threading
+import time
+
+from telemetry import record_failure
+
+
+class EventHub:
+    """Per-process pub/sub keyed by user id
+
+    ``fetch(after_id)`` returns up to ``fetch_limit`` ``(event_id, user_id,
+    payload)`` rows with ids greater than ``after_id``, in id order;
+    ``latest()`` returns the newest event id. Events published in this
+    process with ``publish`` skip the poll.
+
+    Ids are assigned at insert but become visible at commit, so with several
+    writers a lower id can show up after a higher one. Ids skipped over are
+    kept as gaps and re-read for ``gap_seconds`` (a rolled-back insert never
+    fills its gap).
+    """
+
+    def __init__(self, fetch, latest, poll_interval=1.0, prune=None, prune_interval=600,
+                 subscriber_queue_size=100, max_subscribers=None, fetch_limit=1000, gap_seconds=60,
+                 max_gaps=1000):
+        self._fetch = fetch
+        self._latest = latest
+        self._prune = prune
+        self.poll_interval = poll_interval
+        self.prune_interval = prune_interval
+        self.subscriber_queue_size = subscriber_queue_size
+        self.max_subscribers = max_subscribers
+        self.fetch_limit = fetch_limit
+        self.gap_seconds = gap_seconds
+        self.max_gaps = max_gaps
+
+        self._lock = threading.Lock()
+        self._subscribers = {}  # user id -> set of queues
+        self._subscriber_count = 0
+        self._thread = None
+        self._last_id = None
+        self._gaps = {}  # unseen ids below _last_id -> monotonic time they were skipped
+        self.stats = {'polls': 0, 'delivered': 0, 'dropped': 0, 'rejected': 0, 'late': 0}
+
+    @property
+    def subscriber_count(self):
+        return self._subscriber_count
+
+    def subscribe(self, user_id):
+        """A queue of the user's events, or None when this process already has max_subscribers"""
+        subscription = queue.Queue(maxsize=self.subscriber_queue_size)
+        with self._lock:
+            if self.max_subscribers is not None and self._subscriber_count >= self.max_subscribers:
+                self.stats['rejected'] += 1
+                return None
+            self._subscribers.setdefault(user_id, set()).add(subscription)
+            self._subscriber_count += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._poll_loop, daemon=True)
+                self._thread.start()
+        return subscription
+
+    def unsubscribe(self, user_id, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(user_id)
+            if subscribers and subscription in subscribers:
+                subscribers.discard(subscription)
+                self._subscriber_count -= 1
+                if not subscribers:
+                    del self._subscribers[user_id]
+
+    def publish(self, event_id, user_id, payload):
+        """Deliver an event to this process's subscribers of ``user_id``"""
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, ()))
+        for subscription in subscribers:
+            try:
+                subscription.put_nowait((event_id, payload))
+                self.stats['delivered'] += 1
+            except queue.Full:
+                # A stalled client; it resyncs from Last-Event-ID on reconnect
+                self.stats['dropped'] += 1
+
+    def _poll_loop(self):
+        next_prune = time.monotonic()
+        while True:
+            try:
+                with self._lock:
+                    watched = bool(self._subscribers)
+                if watched:
+                    if self._last_id is None:
+                        self._last_id = self._latest() or 0
+                    self.stats['polls'] += 1
+                    self._poll()
+                else:
+                    # Nobody listening: skip the backlog when someone subscribes again
+                    self._last_id = None
+                    self._gaps.clear()
+                if self._prune and time.monotonic() >= next_prune:
+                    self._prune()
+                    next_prune = time.monotonic() + self.prune_interval
+            except Exception as e:
+                record_failure('event_poll', e)
+            time.sleep(self.poll_interval)
+
+    def _poll(self):
+        """Publish every event not seen yet, re-reading from the oldest open gap"""
+        now = time.monotonic()
+        for event_id in [event_id for event_id, skipped in self._gaps.items() if now - skipped > self.gap_seconds]:
+            del self._gaps[event_id]
+        after = min(self._gaps) - 1 if self._gaps else self._last_id
+        while True:
+            rows = self._fetch(after)
+            for event_id, user_id, payload in rows:
+                if event_id > self._last_id:
+                    # Lower ids may belong to transactions that have not committed yet
+                    for missing in range(max(self._last_id + 1, event_id - self.max_gaps), event_id):
+                        self._gaps[missing] = now
+                    self._last_id = event_id
+                elif self._gaps.pop(event_id, None) is not None:
+                    self.stats['late'] += 1
+                else:
+                    continue  # published by an earlier poll
+                self.publish(event_id, user_id, payload)
+            if len(rows) < self.fetch_limit:
+                break
+            after = rows[-1][0]
+        # Re-reading from the oldest gap must not grow without bound
+        while len(self._gaps) > self.max_gaps:
+            del self._gaps[min(self._gaps)]
@@ -0,0 +1,143 @@
+"""
+Streaming exports of story and viewer history
+Rows come from a server-side cursor and leave as CSV, NDJSON or Parquet
+chunks as soon as they are encoded, so memory stays flat however long an
+account's history is. Parquet needs the optional pyarrow package.
+"""
+
+import io
+import csv
+import json
+import zlib
+from datetime import date, datetime
+
+FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+CHUNK_ROWS = 1000  # rows per streamed CSV/NDJSON chunk and per database fetch
+PARQUET_ROW_GROUP = 50_000
+
+
+class ExportUnavailable(Exception):
+    """The requested format needs a package that is not installed"""
+
+
+def _text(value):
+    """A CSV cell"""
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def csv_chunks(names, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(names)
+    count = 0
+    for row in rows:
+        writer.writerow([_text(value) for value in row])
+        count += 1
+        if count % CHUNK_ROWS == 0:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode()
+
+
+def _json_default(value):
+    """Dates and timestamps as ISO strings; booleans and numbers stay native JSON"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def ndjson_chunks(names, rows):
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(names, row)), separators=(',', ':'), default=_json_default))
+        if len(lines) == CHUNK_ROWS:
+            yield ('\n'.join(lines) + '\n').encode()
+            lines = []
+    if lines:
+        yield ('\n'.join(lines) + '\n').encode()
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that hands written bytes back to the generator"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data, self.chunks = b''.join(self.chunks), []
+        return data
+
+
+def parquet_chunks(names, types, rows):
+    """Parquet written one row group at a time; ``types`` are 'int', 'str', 'bool', 'datetime' or 'date'"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ExportUnavailable('parquet export needs the pyarrow package')
+    arrow_types = {'int': pa.int64(), 'str': pa.string(), 'bool': pa.bool_(),
+                   'datetime': pa.timestamp('us'), 'date': pa.date32()}
+    schema = pa.schema([(name, arrow_types[kind]) for name, kind in zip(names, types)])
+    return _parquet_stream(pa, pq, schema, names, rows)
+
+
+def _parquet_stream(pa, pq, schema, names, rows):
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression='zstd')
+    columns = [[] for _ in names]
+
+    def flush():
+        writer.write_table(pa.Table.from_arrays(
+            [pa.array(values, type=field.type) for values, field in zip(columns, schema)], schema=schema))
+        for values in columns:
+            values.clear()
+
+    for row in rows:
+        for values, value in zip(columns, row):
+            values.append(value)
+        if len(columns[0]) == PARQUET_ROW_GROUP:
+            flush()
+            yield sink.drain()
+    if columns[0]:
+        flush()
+    writer.close()
+    yield sink.drain()
+
+
+def export_chunks(fmt, names, types, rows):
+    if fmt == 'csv':
+        return csv_chunks(names, rows)
+    if fmt == 'ndjson':
+        return ndjson_chunks(names, rows)
+    return parquet_chunks(names, types, rows)
+
+
+def gzip_chunks(chunks, level=6):
+    """gzip-compress a chunk stream on the fly"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
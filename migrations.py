@@ -0,0 +1,208 @@
+"""
+Versioned schema migrations for Instagram Story Monitor
+Run with: FLASK_APP=app.py flask db-upgrade
+
+Every step is idempotent (it inspects the live schema first), so it is also
+safe on databases that db.create_all() already built at the latest schema.
+Applied versions are recorded in the schema_version table.
+"""
+
+from datetime import datetime
+from sqlalchemy import inspect, text
+
+
+def upgrade(engine):
+    """Apply pending migrations; returns the user ids whose data was merged"""
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE IF NOT EXISTS schema_version "
+                          "(version INTEGER PRIMARY KEY, name VARCHAR(120), applied_at TIMESTAMP)"))
+        applied = {row[0] for row in conn.execute(text("SELECT version FROM schema_version"))}
+
+    touched_users = set()
+    for version, name, step in MIGRATIONS:
+        if version in applied:
+            continue
+        print(f"Applying migration {version}: {name}")
+        touched_users.update(step(engine) or ())
+        with engine.begin() as conn:
+            conn.execute(text("INSERT INTO schema_version (version, name, applied_at) VALUES (:v, :n, :t)"),
+                         {'v': version, 'n': name, 't': datetime.utcnow()})
+    return touched_users
+
+
+def current_version(engine):
+    if not inspect(engine).has_table('schema_version'):
+        return 0
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT MAX(version) FROM schema_version")).scalar() or 0
+
+
+# Migration steps
+
+def add_poll_bounds(engine):
+    """monitor_job.min_interval / max_interval (added with adaptive polling)"""
+    columns = {column['name'] for column in inspect(engine).get_columns('monitor_job')}
+    with engine.begin() as conn:
+        for column in ('min_interval', 'max_interval'):
+            if column not in columns:
+                conn.execute(text(f"ALTER TABLE monitor_job ADD COLUMN {column} INTEGER"))
+
+
+def merge_duplicates(engine):
+    """Merge duplicate Viewer(user_id, username) and Story(user_id, story_date) rows
+
+    Needed before the unique indexes can be built. Story-viewer links are
+    moved onto the surviving row (flags OR-ed when both rows had one) and the
+    affected counters are recomputed from the links.
+    """
+    touched = set()
+    with engine.begin() as conn:
+        groups = conn.execute(text(
+            "SELECT user_id, username, MIN(id) FROM viewer GROUP BY user_id, username HAVING COUNT(*) > 1"
+        )).all()
+        for user_id, username, keep_id in groups:
+            dup_ids = [row[0] for row in conn.execute(
+                text("SELECT id FROM viewer WHERE user_id = :u AND username = :n AND id <> :k"),
+                {'u': user_id, 'n': username, 'k': keep_id})]
+            for dup_id in dup_ids:
+                _move_links(conn, 'viewer_id', dup_id, keep_id, 'story_id')
+                conn.execute(text("UPDATE viewer SET first_seen = (SELECT MIN(first_seen) FROM viewer "
+                                  "WHERE id IN (:k, :d)), last_seen = (SELECT MAX(last_seen) FROM viewer "
+                                  "WHERE id IN (:k, :d)) WHERE id = :k"), {'k': keep_id, 'd': dup_id})
+                conn.execute(text("DELETE FROM viewer WHERE id = :d"), {'d': dup_id})
+            _recount_viewers(conn, [keep_id])
+            touched.add(user_id)
+
+        groups = conn.execute(text(
+            "SELECT user_id, story_date, MIN(id) FROM story GROUP BY user_id, story_date HAVING COUNT(*) > 1"
+        )).all()
+        for user_id, story_date, keep_id in groups:
+            dup_ids = [row[0] for row in conn.execute(
+                text("SELECT id FROM story WHERE user_id = :u AND story_date = :s AND id <> :k"),
+                {'u': user_id, 's': story_date, 'k': keep_id})]
+            for dup_id in dup_ids:
+                _move_links(conn, 'story_id', dup_id, keep_id, 'viewer_id')
+                conn.execute(text("DELETE FROM story WHERE id = :d"), {'d': dup_id})
+            conn.execute(text(
+                "UPDATE story SET "
+                "total_views = (SELECT COUNT(*) FROM story_viewer WHERE story_id = :k AND has_viewed = :t), "
+                "total_likes = (SELECT COUNT(*) FROM story_viewer WHERE story_id = :k AND has_liked = :t) "
+                "WHERE id = :k"), {'k': keep_id, 't': True})
+            viewer_ids = [row[0] for row in conn.execute(
+                text("SELECT viewer_id FROM story_viewer WHERE story_id = :k"), {'k': keep_id})]
+            _recount_viewers(conn, viewer_ids)
+            touched.add(user_id)
+    return touched
+
+
+def _move_links(conn, column, from_id, to_id, other_column):
+    """Repoint story_viewer rows from one viewer/story to another, merging clashes"""
+    links = conn.execute(text(
+        f"SELECT id, {other_column}, has_viewed, has_liked FROM story_viewer WHERE {column} = :f"
+    ), {'f': from_id}).all()
+    for link_id, other_id, viewed, liked in links:
+        existing = conn.execute(text(
+            f"SELECT id, has_viewed, has_liked FROM story_viewer WHERE {column} = :t AND {other_column} = :o"
+        ), {'t': to_id, 'o': other_id}).first()
+        if existing:
+            conn.execute(text("UPDATE story_viewer SET has_viewed = :v, has_liked = :l WHERE id = :i"),
+                         {'v': bool(existing[1] or viewed), 'l': bool(existing[2] or liked), 'i': existing[0]})
+            conn.execute(text("DELETE FROM story_viewer WHERE id = :i"), {'i': link_id})
+        else:
+            conn.execute(text(f"UPDATE story_viewer SET {column} = :t WHERE id = :i"), {'t': to_id, 'i': link_id})
+
+
+def _recount_viewers(conn, viewer_ids):
+    for viewer_id in set(viewer_ids):
+        conn.execute(text(
+            "UPDATE viewer SET "
+            "total_views = (SELECT COUNT(*) FROM story_viewer WHERE viewer_id = :v), "
+            "total_likes = (SELECT COUNT(*) FROM story_viewer WHERE viewer_id = :v AND has_liked = :t) "
+            "WHERE id = :v"), {'v': viewer_id, 't': True})
+
+
+def story_date_to_date(engine):
+    """story.story_date and daily_stats.story_date become DATE columns
+
+    SQLite stores DATE values as the same ISO 'YYYY-MM-DD' text already in
+    these columns, so only Postgres needs a type change. Both tables hold one
+    row per user per day, so the rewrite is short.
+    """
+    if engine.dialect.name != 'postgresql':
+        return
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in ('story', 'daily_stats'):
+            if not inspector.has_table(table):
+                continue
+            column = next(c for c in inspector.get_columns(table) if c['name'] == 'story_date')
+            if column['type'].__class__.__name__.upper() != 'DATE':
+                conn.execute(text(f"ALTER TABLE {table} ALTER COLUMN story_date TYPE DATE "
+                                  f"USING story_date::date"))
+
+
+def add_story_archive(engine):
+    """story.archive_id (added with story archival; db.create_all() builds story_archive)"""
+    columns = {column['name'] for column in inspect(engine).get_columns('story')}
+    if 'archive_id' not in columns:
+        with engine.begin() as conn:
+            conn.execute(text("ALTER TABLE story ADD COLUMN archive_id INTEGER REFERENCES story_archive (id)"))
+
+
+# name -> (table, columns, unique); kept in step with the models' __table_args__
+HOT_INDEXES = {
+    'ix_viewer_user_username': ('viewer', 'user_id, username', True),
+    'ix_viewer_user_views': ('viewer', 'user_id, total_views, id', False),
+    'ix_story_user_date': ('story', 'user_id, story_date', True),
+    'ix_story_viewer_flags': ('story_viewer', 'story_id, has_viewed, has_liked', False),
+}
+
+
+def create_hot_indexes(engine):
+    """Composite and covering indexes for the ingest and analytics lookups
+
+    On Postgres they are built CONCURRENTLY so writes keep flowing; an
+    invalid leftover from an interrupted build is dropped and rebuilt.
+    """
+    postgres = engine.dialect.name == 'postgresql'
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        for name, (table, columns, unique) in HOT_INDEXES.items():
+            if postgres:
+                valid = conn.execute(text(
+                    "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+                    "WHERE c.relname = :n"), {'n': name}).scalar()
+                if valid:
+                    continue
+                if valid is False:
+                    conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+            conn.execute(text(
+                f"CREATE {'UNIQUE ' if unique else ''}INDEX {'CONCURRENTLY ' if postgres else ''}"
+                f"IF NOT EXISTS {name} ON {table} ({columns})"
+            ))
+
+
+def explain(engine, statement):
+    """The query plan of a compiled statement as one lowercase string
+
+    Sequential scans are disabled on Postgres so small test tables still
+    show whether an index is usable.
+    """
+    with engine.connect() as conn:
+        if engine.dialect.name == 'postgresql':
+            conn.execute(text("SET enable_seqscan = off"))
+            rows = conn.execute(text(f"EXPLAIN {statement}")).all()
+            plan = "\n".join(row[0] for row in rows)
+        else:
+            rows = conn.execute(text(f"EXPLAIN QUERY PLAN {statement}")).all()
+            plan = "\n".join(str(row[-1]) for row in rows)
+        conn.rollback()
+    return plan.lower()
+
+
+MIGRATIONS = [
+    (1, 'monitor job polling bounds', add_poll_bounds),
+    (2, 'merge duplicate viewers and stories', merge_duplicates),
+    (3, 'typed story dates', story_date_to_date),
+    (4, 'hot lookup indexes', create_hot_indexes),
+    (5, 'story archive', add_story_archive),
+]
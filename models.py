@@ -0,0 +1,180 @@
+"""
+Database models for Instagram Story Monitor
+Shared by the web app (app.py) and the monitor runtime (monitor.py). The
+schema is created and upgraded by `flask db-upgrade` (see migrations.py),
+never as a side effect of importing a module.
+"""
+
+import os
+import json
+from datetime import datetime
+from types import SimpleNamespace
+
+from flask_login import UserMixin
+from flask_sqlalchemy import SQLAlchemy
+
+from db_pool import RoutingSession, engine_options
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+def init_app(app, role='web'):
+    """Configure a Flask app from the environment and bind ``db`` to it
+
+    ``role`` ('web' or 'worker') picks the connection pool settings (see db_pool.py).
+    """
+    url = os.environ.get('DATABASE_URL', 'sqlite:///instagram_monitor.db')
+    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'your-secret-key-here')
+    app.config['SQLALCHEMY_DATABASE_URI'] = url
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(role, url)
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    return app
+
+def create_tables(app):
+    """Create missing tables (new databases; existing ones use flask db-upgrade)"""
+    with app.app_context():
+        db.create_all()
+
+# Database Models
+class User(UserMixin, db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    username = db.Column(db.String(80), unique=True, nullable=False)
+    email = db.Column(db.String(120), unique=True, nullable=False)
+    password_hash = db.Column(db.String(120), nullable=False)
+    instagram_username = db.Column(db.String(80), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Relationships; story and viewer history is deleted in bulk by delete_user_data,
+    # never by loading it into the session (passive_deletes)
+    stories = db.relationship('Story', backref='user', lazy=True, passive_deletes='all')
+    viewers = db.relationship('Viewer', backref='user', lazy=True, passive_deletes='all')
+    monitor_job = db.relationship('MonitorJob', backref='user', uselist=False, cascade='all, delete-orphan')
+    stats = db.relationship('UserStats', uselist=False, cascade='all, delete-orphan')
+    daily_stats = db.relationship('DailyStats', lazy=True, cascade='all, delete-orphan')
+    ingest_events = db.relationship('IngestEvent', lazy=True, cascade='all, delete-orphan')
+    browser_session = db.relationship('BrowserSession', uselist=False, cascade='all, delete-orphan')
+
+class Story(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    story_date = db.Column(db.Date, nullable=False)
+    total_views = db.Column(db.Integer, default=0)
+    total_likes = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_checked = db.Column(db.DateTime, default=datetime.utcnow)
+    archive_id = db.Column(db.Integer, db.ForeignKey('story_archive.id'), nullable=True)  # set once its links are archived
+    
+    # Relationships
+    story_viewers = db.relationship('StoryViewer', backref='story', lazy=True, passive_deletes='all')
+    
+    # One story per user per day; also serves the per-day lookup on every ingest
+    __table_args__ = (db.Index('ix_story_user_date', 'user_id', 'story_date', unique=True),)
+
+class Viewer(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    username = db.Column(db.String(80), nullable=False)
+    total_views = db.Column(db.Integer, default=0)
+    total_likes = db.Column(db.Integer, default=0)
+    first_seen = db.Column(db.DateTime, default=datetime.utcnow)
+    last_seen = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Relationships
+    story_interactions = db.relationship('StoryViewer', backref='viewer', lazy=True, passive_deletes='all')
+    
+    __table_args__ = (
+        db.Index('ix_viewer_user_username', 'user_id', 'username', unique=True),  # ingest name lookups
+        db.Index('ix_viewer_user_views', 'user_id', 'total_views', 'id'),  # top viewers / API sort
+    )
+
+class StoryViewer(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    story_id = db.Column(db.Integer, db.ForeignKey('story.id'), nullable=False)
+    viewer_id = db.Column(db.Integer, db.ForeignKey('viewer.id'), nullable=False)
+    has_viewed = db.Column(db.Boolean, default=False)
+    has_liked = db.Column(db.Boolean, default=False)
+    first_detected = db.Column(db.DateTime, default=datetime.utcnow)
+    last_updated = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Unique constraint to prevent duplicates
+    __table_args__ = (
+        db.UniqueConstraint('story_id', 'viewer_id', name='unique_story_viewer'),
+        # Covers the per-story view/like counts without touching the table
+        db.Index('ix_story_viewer_flags', 'story_id', 'has_viewed', 'has_liked'),
+    )
+
+class StoryArchive(db.Model):
+    """Compressed StoryViewer rows of one user's old stories (see archive.py)"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    first_date = db.Column(db.Date, nullable=False)  # story days covered
+    last_date = db.Column(db.Date, nullable=False)
+    story_count = db.Column(db.Integer, default=0)
+    link_count = db.Column(db.Integer, default=0)
+    payload = db.Column(db.LargeBinary, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class UserStats(db.Model):
+    """Per-user analytics rollup, maintained by update_database"""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    total_stories = db.Column(db.Integer, default=0)
+    unique_viewers = db.Column(db.Integer, default=0)
+    total_views = db.Column(db.Integer, default=0)
+    total_likes = db.Column(db.Integer, default=0)
+    top_viewers = db.Column(db.Text, default='[]')  # JSON, see TOP_VIEWERS_LIMIT
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    @property
+    def like_rate(self):
+        return self.total_likes / self.total_views if self.total_views else 0
+    
+    def top_viewer_rows(self):
+        """Top viewers as objects shaped like Viewer for the templates"""
+        rows = []
+        for row in json.loads(self.top_viewers or '[]'):
+            row = dict(row, last_seen=datetime.fromisoformat(row['last_seen']) if row.get('last_seen') else None)
+            rows.append(SimpleNamespace(**row))
+        return rows
+
+class DailyStats(db.Model):
+    """Per-user, per-day analytics rollup (one row per story day)"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    story_date = db.Column(db.Date, nullable=False)
+    total_views = db.Column(db.Integer, default=0)
+    total_likes = db.Column(db.Integer, default=0)
+    new_viewers = db.Column(db.Integer, default=0)  # viewers seen for the first time that day
+    last_checked = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (db.UniqueConstraint('user_id', 'story_date', name='unique_daily_stats'),)
+    
+    @property
+    def like_rate(self):
+        return self.total_likes / self.total_views if self.total_views else 0
+
+class IngestEvent(db.Model):
+    """Delta published after each ingest commit, streamed to dashboards"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    payload = db.Column(db.Text, nullable=False)  # JSON
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+class MonitorJob(db.Model):
+    """Durable monitoring job, run by whichever worker holds its lease"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, unique=True)
+    instagram_username = db.Column(db.String(80), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='active')  # active / stopped
+    lease_owner = db.Column(db.String(120), nullable=True)  # worker id holding the job
+    lease_expires_at = db.Column(db.DateTime, nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+    min_interval = db.Column(db.Integer, nullable=True)  # polling bounds in seconds, None = defaults
+    max_interval = db.Column(db.Integer, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class BrowserSession(db.Model):
+    """Encrypted Instagram cookie jar of a monitored account (see sessions.py)"""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    cookies = db.Column(db.Text, nullable=False)  # Fernet token of the JSON cookie list
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
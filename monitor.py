@@ -0,0 +1,910 @@
+"""
+Monitor runtime for Instagram Story Monitor
+Selenium, the browser pool, the outbound budget and InstagramMonitor: what
+a monitor worker (worker.py) needs to scrape story viewers. The web app
+never imports this module, so web workers do not load Selenium or keep a
+browser pool. Scrapes are written through store.py.
+
+AsyncInstagramMonitor runs the same scrape as asyncio tasks that drive
+tabs over the DevTools protocol (cdp.py); SCRAPER_ENGINE picks the engine.
+"""
+
+import os
+import asyncio
+import hashlib
+import json
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import date, datetime
+from urllib.parse import urlparse
+
+from flask import Flask, has_app_context
+from selenium import webdriver
+from selenium.webdriver.common.by import By
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import TimeoutException, WebDriverException
+from sqlalchemy import select
+from sqlalchemy.exc import InterfaceError, OperationalError
+
+from browser_pool import BrowserPool
+from cdp import CDPBrowserPool, CDPError, launch_chrome
+from models import db, init_app, BrowserSession, Story, StoryViewer, Viewer
+from pipeline import ingest_pipeline_from_env, make_snapshot
+from rate_limit import Throttled, outbound_limiter_from_env
+from resource_blocking import resource_policy_from_env, summarize_events
+from scheduling import PollPolicy
+from sessions import session_store_from_env
+import store
+import telemetry
+from telemetry import log_event, record_failure
+
+# Database access for monitors and the ingest pipeline; no routes
+app = init_app(Flask(__name__), role='worker')
+
+# Story ring and "Seen by" lookups
+STORY_RING_SELECTORS = [
+    "canvas[height='77'][width='77']",
+    "canvas[height='56'][width='56']",
+    "div[role='button'] canvas"
+]
+SEEN_BY_SELECTORS = [
+    "//span[contains(text(), 'Seen by')]",
+    "//button[contains(text(), 'Seen by')]",
+    "//*[contains(text(), 'Seen by')]"
+]
+
+# Text of the page Instagram serves instead of a profile when it rate-limits us
+RATE_LIMIT_MARKERS = ["Please wait a few minutes before you try again", "Try Again Later"]
+
+# Viewer list extraction
+VIEWER_SELECTORS = [
+    "a[href*='/'][role='link']",
+    "a[href*='/']"
+]
+HEART_SELECTOR = "[data-testid='heart'], .heart, [aria-label*='like'], [aria-label*='Like']"
+
+# Collects {href, text, liked} for every visible viewer link in one round trip.
+# Mirrors the element-by-element path: selectors in order, visible links only,
+# and a heart lookup two levels up from the link. With scrolling enabled it
+# then scrolls the list one page and waits for the virtualized rows to render,
+# so the next call reads the next batch. Runs via execute_async_script.
+VIEWER_EXTRACTION_SCRIPT = """
+const selectors = arguments[0];
+const heartSelector = arguments[1];
+const scroll = arguments[2];
+const settleMs = arguments[3];
+const done = arguments[arguments.length - 1];
+const seen = new Set();
+const entries = [];
+let lastLink = null;
+for (const selector of selectors) {
+    for (const link of document.querySelectorAll(selector)) {
+        if (seen.has(link)) continue;
+        seen.add(link);
+        const style = window.getComputedStyle(link);
+        if (!link.getClientRects().length || style.visibility === 'hidden' || style.display === 'none') continue;
+        const container = link.parentElement && link.parentElement.parentElement;
+        entries.push({
+            href: link.href || '',
+            text: link.innerText || '',
+            liked: !!(container && container.querySelector(heartSelector))
+        });
+        lastLink = link;
+    }
+}
+if (!scroll || !lastLink) {
+    done({entries: entries, atEnd: true});
+    return;
+}
+let box = lastLink.parentElement;
+while (box && box !== document.body) {
+    const overflow = window.getComputedStyle(box).overflowY;
+    if (box.scrollHeight > box.clientHeight + 1 && (overflow === 'auto' || overflow === 'scroll')) break;
+    box = box.parentElement;
+}
+if (!box || box === document.body) {
+    done({entries: entries, atEnd: true});
+    return;
+}
+const before = box.scrollTop;
+box.scrollTop = before + box.clientHeight;
+if (box.scrollTop <= before) {
+    done({entries: entries, atEnd: true});
+    return;
+}
+let finished = false;
+const observer = new MutationObserver(() => setTimeout(finish, 50));
+function finish() {
+    if (finished) return;
+    finished = true;
+    observer.disconnect();
+    done({entries: entries, atEnd: false});
+}
+observer.observe(box, {childList: true, subtree: true});
+setTimeout(finish, settleMs);
+"""
+
+def snapshot_fingerprint(story_data):
+    """Stable digest of a scrape, scoped to today's story"""
+    digest = hashlib.sha1(datetime.now().date().isoformat().encode())
+    for key in ("viewers", "likes"):
+        digest.update(b"\0" + "\n".join(sorted(story_data[key])).encode())
+    return digest.hexdigest()
+
+# Readiness conditions for WebDriverWait
+def page_ready(driver):
+    """Document finished loading and the app shell rendered"""
+    return (driver.execute_script("return document.readyState") == "complete"
+            and bool(driver.find_elements(By.CSS_SELECTOR, "main, form, nav")))
+
+def find_story_ring(driver):
+    """Clickable parent of a visible story ring canvas, or False"""
+    for selector in STORY_RING_SELECTORS:
+        try:
+            for canvas in driver.find_elements(By.CSS_SELECTOR, selector):
+                if canvas.is_displayed():
+                    return canvas.find_element(By.XPATH, "..")
+        except WebDriverException:
+            continue
+    return False
+
+def find_seen_by(driver):
+    """Visible "Seen by N" element in an open story, or False"""
+    for selector in SEEN_BY_SELECTORS:
+        try:
+            for element in driver.find_elements(By.XPATH, selector):
+                if element.is_displayed():
+                    text = element.text.strip()
+                    if 'seen by' in text.lower() and any(char.isdigit() for char in text):
+                        return element
+        except WebDriverException:
+            continue
+    return False
+
+# The same lookups as in-page functions, for the DevTools engine (called with
+# CDPSession.call). The finders click what they find when asked to.
+PAGE_READY_JS = "() => document.readyState === 'complete' && !!document.querySelector('main, form, nav')"
+URL_CONTAINS_JS = "(part) => location.href.includes(part)"
+PROFILE_LOADED_JS = "() => !!document.querySelector('header') || location.href.includes('/accounts/login')"
+VIEWER_LIST_JS = "() => !!document.querySelector(\"div[role='dialog'] a[href*='/']\")"
+LOCATION_JS = "() => location.href"
+PAGE_SOURCE_JS = "() => document.documentElement.outerHTML"
+STORY_RING_JS = """(selectors, click) => {
+    for (const selector of selectors) {
+        for (const canvas of document.querySelectorAll(selector)) {
+            if (canvas.getClientRects().length && canvas.parentElement) {
+                if (click) canvas.parentElement.click();
+                return true;
+            }
+        }
+    }
+    return false;
+}"""
+SEEN_BY_JS = """(xpaths, click) => {
+    for (const xpath of xpaths) {
+        const found = document.evaluate(xpath, document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+        for (let i = 0; i < found.snapshotLength; i++) {
+            const element = found.snapshotItem(i);
+            const text = (element.innerText || '').trim();
+            if (element.getClientRects().length && text.toLowerCase().includes('seen by') && /[0-9]/.test(text)) {
+                if (click) element.click();
+                return true;
+            }
+        }
+    }
+    return false;
+}"""
+
+def viewer_extraction_expression(*args):
+    """VIEWER_EXTRACTION_SCRIPT as a Promise of its result, for Runtime.evaluate"""
+    return (f"new Promise(done => (function () {{{VIEWER_EXTRACTION_SCRIPT}}})"
+            f".apply(null, {json.dumps(list(args))}.concat([done])))")
+
+def setup_chrome():
+    """Create a headless Chrome with stability options"""
+    options = Options()
+    options.add_argument("--no-sandbox")
+    options.add_argument("--disable-dev-shm-usage")
+    options.add_argument("--disable-gpu")
+    options.add_argument("--log-level=3")
+    options.add_argument("--disable-logging")
+    options.add_experimental_option('excludeSwitches', ['enable-logging'])
+    options.add_experimental_option('useAutomationExtension', False)
+    options.add_argument("--disable-extensions")
+    options.add_argument("--headless")  # Run headless for server deployment
+    resource_policy.configure_options(options)
+    started = time.perf_counter()
+    driver = webdriver.Chrome(options=options)
+    resource_policy.install(driver)
+    telemetry.phase_seconds.observe(time.perf_counter() - started, phase='setup_chrome')
+    return driver
+
+async def setup_tab(session):
+    """DevTools engine counterpart of setup_chrome's resource options, for each new tab"""
+    await session.send('Page.enable')
+    if resource_policy.categories or resource_policy.measure:
+        await session.send('Network.enable')
+    if resource_policy.categories:
+        await session.send('Network.setBlockedURLs', urls=resource_policy.patterns())
+
+# Images, media, fonts and beacons the scraper never reads; see SCRAPER_BLOCK in env.example
+resource_policy = resource_policy_from_env()
+
+# Instagram sessions persisted across restarts and workers; see SESSION_STORE in env.example
+session_store = session_store_from_env(app, db, BrowserSession)
+
+# Browsers shared by every monitor in this process; size bounds scrape concurrency
+browser_pool = BrowserPool(
+    setup_chrome,
+    size=int(os.environ.get('BROWSER_POOL_SIZE', 2)),
+    max_uses=int(os.environ.get('BROWSER_MAX_USES', 50)),
+    max_rss_mb=int(os.environ.get('BROWSER_MAX_RSS_MB', 0)) or None,
+    session_store=session_store,
+)
+
+# Which engine runs scrapes: "selenium" (a thread and a pooled WebDriver per
+# scrape) or "cdp" (asyncio tasks driving tabs over DevTools); see SCRAPER_ENGINE in env.example
+SCRAPER_ENGINE = os.environ.get('SCRAPER_ENGINE', 'selenium')
+if SCRAPER_ENGINE not in ('selenium', 'cdp'):
+    raise ValueError(f"Unknown SCRAPER_ENGINE: {SCRAPER_ENGINE}")
+
+# Tabs in shared browsers for the DevTools engine; size * tabs bounds its scrape concurrency
+cdp_pool = CDPBrowserPool(
+    launch_chrome,
+    size=int(os.environ.get('BROWSER_POOL_SIZE', 2)),
+    tabs_per_browser=int(os.environ.get('CDP_TABS_PER_BROWSER', 16)),
+    max_uses=int(os.environ.get('CDP_MAX_USES', 500)),
+    setup=setup_tab,
+    session_store=session_store,
+)
+
+# Every navigation to Instagram from this host shares one budget; see OUTBOUND_BACKEND in env.example
+outbound = outbound_limiter_from_env()
+
+# Polling cadence bounds; per-account overrides live on MonitorJob
+poll_policy = PollPolicy(
+    min_interval=int(os.environ.get('POLL_MIN_INTERVAL', 60)),
+    max_interval=int(os.environ.get('POLL_MAX_INTERVAL', 1800)),
+)
+
+# Metrics (see telemetry.py); each process flushes its own for /metrics to merge
+engine_pool = cdp_pool if SCRAPER_ENGINE == 'cdp' else browser_pool
+telemetry.browsers_open.set_function(lambda: engine_pool.open_count)
+telemetry.browser_rss_mb.set_function(engine_pool.rss_mb)
+telemetry.browser_tabs_open.set_function(lambda: cdp_pool.tab_count)
+telemetry.registry.start()
+
+def write_snapshots(snapshots):
+    """store.write_snapshots, in the runtime's app context when called from a pipeline writer"""
+    if not has_app_context():
+        with app.app_context():
+            return store.write_snapshots(snapshots)
+    return store.write_snapshots(snapshots)
+
+# Scrape -> ingest queue run by monitor workers; see INGEST_MODE in env.example
+ingest_pipeline = ingest_pipeline_from_env(write_snapshots, transient=(OperationalError, InterfaceError))
+if ingest_pipeline is not None:
+    telemetry.ingest_queue_depth.set_function(lambda: ingest_pipeline.depth)
+    if ingest_pipeline.journal is not None:
+        telemetry.ingest_journal_pending.set_function(lambda: ingest_pipeline.journal.pending)
+
+class InstagramMonitor:
+    def __init__(self, user_id, instagram_username):
+        self.user_id = user_id
+        self.instagram_username = instagram_username
+        self.driver = None  # Borrowed from browser_pool for the duration of a scrape
+        self.is_running = False
+        self.session_id = str(uuid.uuid4())
+        self.extraction_mode = os.environ.get('VIEWER_EXTRACTION_MODE', 'script')
+        self.wait_timeout = float(os.environ.get('SCRAPE_WAIT_TIMEOUT', 10))
+        self.ring_grace = float(os.environ.get('STORY_RING_GRACE', 2))
+        self.base_url = os.environ.get('INSTAGRAM_BASE_URL', 'https://www.instagram.com').rstrip('/')
+        self.step_timings = {}  # step name -> seconds, for the latest scrape
+        self.story_date = None  # story day of the latest check, for the poll policy
+        
+        # Incremental harvesting: "incremental" stops at already-stored viewers,
+        # "full" scrolls the whole list, "visible" reads only rendered rows
+        self.harvest_mode = os.environ.get('VIEWER_HARVEST_MODE', 'incremental')
+        self.max_scroll_batches = int(os.environ.get('VIEWER_MAX_SCROLL_BATCHES', 200))
+        self._known_viewers = set()
+        self._known_viewers_date = None
+        self._last_fingerprint = None
+        
+    def wait_until(self, condition, timeout=None):
+        """Wait for a readiness condition; returns its value, or None on timeout"""
+        try:
+            return WebDriverWait(self.driver, timeout or self.wait_timeout, poll_frequency=0.1).until(condition)
+        except TimeoutException:
+            return None
+    
+    @contextmanager
+    def timed(self, step):
+        """Record how long a scrape step took"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.step_timings[step] = time.perf_counter() - started
+            telemetry.phase_seconds.observe(self.step_timings[step], phase=step)
+    
+    def log_fields(self):
+        """Context attached to every log line from this monitor"""
+        return {'session_id': self.session_id, 'user_id': self.user_id,
+                'instagram_username': self.instagram_username}
+    
+    def wait_for_login(self):
+        """Simulate login wait - in production, implement proper OAuth"""
+        try:
+            with self.timed('login'), outbound.request('login'):
+                self.driver.get(f"{self.base_url}/")
+                self.wait_until(page_ready)
+            
+            # For now, return True - in production, implement proper login flow
+            return True
+            
+        except Throttled:
+            raise
+        except Exception as e:
+            record_failure('login', e, **self.log_fields())
+            return False
+    
+    def session_rejected(self):
+        """Instagram redirected the browser to its login page"""
+        try:
+            return '/accounts/login' in urlparse(self.driver.current_url).path
+        except Exception:
+            return False
+    
+    def rate_limited(self):
+        """Instagram answered with its "please wait" page or a challenge"""
+        try:
+            if '/challenge/' in urlparse(self.driver.current_url).path:
+                return True
+            return any(marker in self.driver.page_source for marker in RATE_LIMIT_MARKERS)
+        except Exception:
+            return False
+    
+    def go_to_profile(self):
+        """Go to user's Instagram profile"""
+        try:
+            with self.timed('profile'):
+                with outbound.request('profile'):
+                    self.driver.get(f"{self.base_url}/{self.instagram_username}/")
+                    # An expired session lands on the login page, which has no header
+                    loaded = self.wait_until(EC.any_of(EC.presence_of_element_located((By.CSS_SELECTOR, "header")),
+                                                       EC.url_contains('/accounts/login')))
+                    if not loaded and self.rate_limited():
+                        # Every monitor on the host backs off, not just this one
+                        outbound.penalize('rate_limited')
+                        raise Throttled("Instagram rate limit page")
+                if self.session_rejected():
+                    return False
+                
+                # The story ring is drawn shortly after the header; accounts
+                # without a story only cost this short grace period
+                ring = self.wait_until(find_story_ring, timeout=self.ring_grace)
+            if not ring:
+                return False
+            
+            with self.timed('open_story'), outbound.request('story'):
+                self.driver.execute_script("arguments[0].click();", ring)
+                self.wait_until(EC.url_contains('/stories/'))
+            return True
+            
+        except Throttled:
+            raise
+        except Exception as e:
+            record_failure('profile', e, **self.log_fields())
+            return False
+    
+    def get_story_data(self):
+        """Get story viewers and likes"""
+        try:
+            # Find "Seen by X" element
+            with self.timed('seen_by'):
+                seen_by_element = self.wait_until(find_seen_by)
+            
+            if not seen_by_element:
+                return {"viewers": [], "likes": []}
+            
+            # Click to see viewers and wait for the list to render
+            with self.timed('viewer_list'), outbound.request('viewer_list'):
+                self.driver.execute_script("arguments[0].click();", seen_by_element)
+                self.wait_until(EC.presence_of_element_located(
+                    (By.CSS_SELECTOR, "div[role='dialog'] a[href*='/']")))
+            
+            # Extract viewers and likes
+            with self.timed('extract'):
+                viewers, likes = [], []
+                if self.extraction_mode == 'script':
+                    viewers, likes = self.extract_viewers_in_page()
+                if not viewers:
+                    viewers, likes = self.extract_viewers_by_element()
+            
+            return {"viewers": viewers, "likes": likes}
+            
+        except Throttled:
+            raise
+        except Exception as e:
+            record_failure('story_data', e, **self.log_fields())
+            return {"viewers": [], "likes": []}
+    
+    def extract_viewers_in_page(self):
+        """Harvest viewers and likes with one injected script per scroll batch
+        
+        Instagram lists the newest viewers first, so in incremental mode the
+        harvest stops at the first batch made up only of viewers already
+        stored for today's story.
+        """
+        scroll = self.harvest_mode != 'visible'
+        known = self.known_viewers() if self.harvest_mode == 'incremental' else set()
+        viewers = []
+        likes = []
+        empty_batches = 0
+        
+        for _ in range(self.max_scroll_batches if scroll else 1):
+            try:
+                page = self.driver.execute_async_script(
+                    VIEWER_EXTRACTION_SCRIPT, VIEWER_SELECTORS, HEART_SELECTOR, scroll, 500)
+            except WebDriverException as e:
+                record_failure('extract', e, **self.log_fields())
+                break
+            
+            batch = self._read_batch(page, viewers, likes)
+            empty_batches = 0 if batch else empty_batches + 1
+            if self._harvest_done(page, batch, known, empty_batches):
+                break
+        
+        return viewers, likes
+    
+    def _read_batch(self, page, viewers, likes):
+        """Add one extraction result's new viewers (and likes); returns them"""
+        batch = []
+        for entry in page.get('entries') or []:
+            username = self.parse_viewer_username(entry.get('href') or '', (entry.get('text') or '').strip())
+            if username and username != self.instagram_username and username not in viewers:
+                viewers.append(username)
+                batch.append(username)
+                if entry.get('liked'):
+                    likes.append(username)
+        return batch
+    
+    def _harvest_done(self, page, batch, known, empty_batches):
+        if page.get('atEnd'):
+            return True
+        if batch and all(username in known for username in batch):
+            return True
+        # Virtualized rows can lag behind the scroll; give up after a few empty batches
+        return empty_batches >= 3
+    
+    def known_viewers(self):
+        """Usernames already stored for today's story, loaded once per story"""
+        story_date = datetime.now().date()
+        if self._known_viewers_date != story_date:
+            self._known_viewers = set(db.session.execute(
+                select(Viewer.username)
+                .join(StoryViewer, StoryViewer.viewer_id == Viewer.id)
+                .join(Story, Story.id == StoryViewer.story_id)
+                .where(Story.user_id == self.user_id, Story.story_date == story_date)
+            ).scalars())
+            self._known_viewers_date = story_date
+        return self._known_viewers
+    
+    def extract_viewers_by_element(self):
+        """Extract viewers and likes element by element (fallback path)"""
+        viewers = []
+        likes = []
+        
+        # Look for viewer elements
+        for selector in VIEWER_SELECTORS:
+            try:
+                elements = self.driver.find_elements(By.CSS_SELECTOR, selector)
+                for element in elements:
+                    if element.is_displayed():
+                        href = element.get_attribute('href') or ''
+                        text = element.text.strip()
+                        username = self.parse_viewer_username(href, text)
+                        
+                        if username and username != self.instagram_username and username not in viewers:
+                            viewers.append(username)
+                            
+                            # Check if this viewer has liked the story
+                            try:
+                                # Look for heart icon near this viewer
+                                parent = element.find_element(By.XPATH, "../..")
+                                heart_elements = parent.find_elements(By.CSS_SELECTOR, HEART_SELECTOR)
+                                if heart_elements:
+                                    likes.append(username)
+                            except:
+                                pass
+            except:
+                continue
+        
+        return viewers, likes
+    
+    def parse_viewer_username(self, href, text):
+        """Extract a viewer username from a link href, falling back to its text"""
+        username = None
+        if href and '/p/' not in href and '/' in href:
+            parts = urlparse(href).path.split('/')
+            for part in parts:
+                if part and part not in ['www.instagram.com', 'instagram.com', 'stories', 'highlights']:
+                    username = part
+                    break
+        
+        if not username and text and self.is_valid_username(text):
+            username = text
+        return username
+    
+    def is_valid_username(self, text):
+        """Check if text looks like a valid Instagram username"""
+        if not text or len(text) < 1 or len(text) > 30:
+            return False
+        if not any(char.isalpha() for char in text):
+            return False
+        if text.isdigit() or ' ' in text:
+            return False
+        if text.startswith('http') or text in ['https:', 'www.', '.com']:
+            return False
+        return True
+    
+    def update_database(self, story_data):
+        """Store one scrape right away (inline ingest, see write_snapshots)"""
+        snapshot = make_snapshot(self.user_id, story_data, self.log_fields())
+        try:
+            write_snapshots([snapshot])
+        except Exception as e:
+            record_failure('ingest', e, **self.log_fields())
+            return False
+        self._remember_viewers(snapshot)
+        return True
+    
+    def ingest(self, story_data):
+        """Hand a scrape to the ingest pipeline, or store it inline when none is running"""
+        if ingest_pipeline is None or not ingest_pipeline.running:
+            return self.update_database(story_data)
+        snapshot = make_snapshot(self.user_id, story_data, self.log_fields())
+        ingest_pipeline.submit(snapshot)
+        # The journal guarantees the write, so later scrapes can rely on it already
+        self._remember_viewers(snapshot)
+        return True
+    
+    def _remember_viewers(self, snapshot):
+        if self._known_viewers_date == date.fromisoformat(snapshot.story_date):
+            self._known_viewers.update(snapshot.viewers)
+    
+    def monitor_loop(self):
+        """Main monitoring loop for a single account, polled adaptively"""
+        self.is_running = True
+        state = poll_policy.new_state()
+        
+        try:
+            # Monitors started together (e.g. by a deploy) spread out their first checks
+            for _ in range(int(outbound.start_delay())):
+                if not self.is_running:
+                    break
+                time.sleep(1)
+            
+            while self.is_running:
+                try:
+                    delay = poll_policy.next_interval(state, self.check(), story_date=self.story_date)
+                except Exception as e:
+                    record_failure('check', e, **self.log_fields())
+                    delay = poll_policy.error_delay(state)
+                
+                # Wait until the next check is due
+                for _ in range(int(delay)):
+                    if not self.is_running:
+                        break
+                    time.sleep(1)
+                    
+        except Exception as e:
+            record_failure('monitor', e, **self.log_fields())
+        finally:
+            self.cleanup()
+    
+    def check(self):
+        """Run one scrape and ingest; returns the viewer count, or None when no story is up"""
+        try:
+            story_data = self.scrape()
+        except Exception as e:
+            telemetry.scrapes_total.inc(result='error')
+            record_failure('scrape', e, **self.log_fields())
+            raise
+        return self.record_scrape(story_data)
+    
+    def record_scrape(self, story_data):
+        """Count a scrape and ingest it unless unchanged; returns the viewer count, or None"""
+        if story_data is None:
+            self.story_date = None
+            telemetry.scrapes_total.inc(result='no_story')
+            return None
+        self.story_date = datetime.now().date()
+        telemetry.scrapes_total.inc(result='story')
+        
+        # Skip ingest entirely when the snapshot is identical to the last one stored
+        fingerprint = snapshot_fingerprint(story_data)
+        if story_data["viewers"] and fingerprint != self._last_fingerprint:
+            if self.ingest(story_data):
+                self._last_fingerprint = fingerprint
+        elif story_data["viewers"]:
+            telemetry.ingests_skipped_total.inc()
+        return self.viewer_count(story_data)
+    
+    def viewer_count(self, story_data):
+        """Viewers of today's story so far, for the poll policy
+        
+        An incremental harvest stops at the first batch of stored viewers,
+        so its list alone would look like a decline after a full scrape.
+        """
+        if self.harvest_mode != 'incremental':
+            return len(story_data["viewers"])
+        return len(self.known_viewers() | set(story_data["viewers"]))
+    
+    def scrape(self):
+        """Borrow a pooled browser for one profile visit and viewer scrape"""
+        self.step_timings = {}
+        started = time.perf_counter()
+        with browser_pool.checkout(self.user_id) as browser:
+            self.driver = browser.driver
+            resource_policy.traffic(self.driver)  # drop what earlier checkouts loaded
+            traffic = None
+            try:
+                if browser.needs_login and not self.wait_for_login():
+                    raise RuntimeError("Instagram login failed")
+                if not self.go_to_profile():
+                    if not self.session_rejected():
+                        return None
+                    # A restored session Instagram no longer accepts: log in again once
+                    log_event('session_rejected', level='warning', **self.log_fields())
+                    browser_pool.invalidate(self.user_id)
+                    if not self.wait_for_login():
+                        raise RuntimeError("Instagram login failed")
+                    if not self.go_to_profile():
+                        return None
+                return self.get_story_data()
+            finally:
+                traffic = resource_policy.traffic(self.driver)
+                self.driver = None
+                telemetry.phase_seconds.observe(time.perf_counter() - started, phase='scrape')
+                telemetry.record_traffic(traffic)
+                log_event('scrape', seconds=round(time.perf_counter() - started, 3),
+                          steps={step: round(seconds, 3) for step, seconds in self.step_timings.items()},
+                          traffic=traffic, **self.log_fields())
+    
+    def stop(self):
+        """Stop monitoring"""
+        self.is_running = False
+    
+    def cleanup(self):
+        """Clean shutdown - drop this process's copy of the account's session
+
+        The stored session stays, so the worker that picks the job up next
+        starts logged in; cancel_monitoring deletes it.
+        """
+        browser_pool.forget(self.user_id)
+
+async def run_in_app(function, *args):
+    """Run blocking database work off the event loop, in the runtime's app context"""
+    def call():
+        with app.app_context():
+            return function(*args)
+    return await asyncio.to_thread(call)
+
+class AsyncInstagramMonitor(InstagramMonitor):
+    """InstagramMonitor on the DevTools engine: the same scrape, as coroutines
+    
+    Each scrape drives a tab borrowed from cdp_pool, so one event loop runs
+    every monitor in the process and waiting (page loads, readiness polls,
+    the outbound budget) holds no thread. Database work runs in threads.
+    """
+    
+    def __init__(self, user_id, instagram_username):
+        super().__init__(user_id, instagram_username)
+        self.tab = None  # Borrowed from cdp_pool for the duration of a scrape
+    
+    async def wait_until(self, function, *args, timeout=None):
+        """Poll an in-page function until it returns something truthy; returns it, or None on timeout"""
+        deadline = time.monotonic() + (timeout or self.wait_timeout)
+        while True:
+            try:
+                value = await self.tab.session.call(function, *args)
+                if value:
+                    return value
+            except CDPError:
+                # The page navigated away mid-call; only a lost browser is fatal
+                if self.tab.session.connection.closed:
+                    raise
+            if time.monotonic() >= deadline:
+                return None
+            await asyncio.sleep(0.1)
+    
+    async def wait_for_login(self):
+        """Simulate login wait - in production, implement proper OAuth"""
+        try:
+            with self.timed('login'):
+                async with outbound.async_request('login'):
+                    await self.tab.session.navigate(f"{self.base_url}/", self.wait_timeout)
+                    await self.wait_until(PAGE_READY_JS)
+            return True
+            
+        except Throttled:
+            raise
+        except Exception as e:
+            record_failure('login', e, **self.log_fields())
+            return False
+    
+    async def current_url(self):
+        try:
+            return await self.tab.session.call(LOCATION_JS) or ''
+        except CDPError:
+            return ''
+    
+    async def session_rejected(self):
+        """Instagram redirected the browser to its login page"""
+        return '/accounts/login' in urlparse(await self.current_url()).path
+    
+    async def rate_limited(self):
+        """Instagram answered with its "please wait" page or a challenge"""
+        try:
+            if '/challenge/' in urlparse(await self.current_url()).path:
+                return True
+            page_source = await self.tab.session.call(PAGE_SOURCE_JS) or ''
+            return any(marker in page_source for marker in RATE_LIMIT_MARKERS)
+        except Exception:
+            return False
+    
+    async def go_to_profile(self):
+        """Go to user's Instagram profile"""
+        try:
+            with self.timed('profile'):
+                async with outbound.async_request('profile'):
+                    await self.tab.session.navigate(f"{self.base_url}/{self.instagram_username}/", self.wait_timeout)
+                    loaded = await self.wait_until(PROFILE_LOADED_JS)
+                    if not loaded and await self.rate_limited():
+                        await outbound.async_penalize('rate_limited')
+                        raise Throttled("Instagram rate limit page")
+                if await self.session_rejected():
+                    return False
+                ring = await self.wait_until(STORY_RING_JS, STORY_RING_SELECTORS, False, timeout=self.ring_grace)
+            if not ring:
+                return False
+            
+            with self.timed('open_story'):
+                async with outbound.async_request('story'):
+                    await self.tab.session.call(STORY_RING_JS, STORY_RING_SELECTORS, True)
+                    await self.wait_until(URL_CONTAINS_JS, '/stories/')
+            return True
+            
+        except Throttled:
+            raise
+        except Exception as e:
+            record_failure('profile', e, **self.log_fields())
+            return False
+    
+    async def get_story_data(self):
+        """Get story viewers and likes"""
+        try:
+            with self.timed('seen_by'):
+                seen_by = await self.wait_until(SEEN_BY_JS, SEEN_BY_SELECTORS, False)
+            if not seen_by:
+                return {"viewers": [], "likes": []}
+            
+            with self.timed('viewer_list'):
+                async with outbound.async_request('viewer_list'):
+                    await self.tab.session.call(SEEN_BY_JS, SEEN_BY_SELECTORS, True)
+                    await self.wait_until(VIEWER_LIST_JS)
+            
+            with self.timed('extract'):
+                viewers, likes = await self.extract_viewers_in_page()
+            return {"viewers": viewers, "likes": likes}
+            
+        except Throttled:
+            raise
+        except Exception as e:
+            record_failure('story_data', e, **self.log_fields())
+            return {"viewers": [], "likes": []}
+    
+    async def extract_viewers_in_page(self):
+        """Harvest viewers and likes with one evaluated script per scroll batch (see InstagramMonitor)"""
+        scroll = self.harvest_mode != 'visible'
+        known = await run_in_app(self.known_viewers) if self.harvest_mode == 'incremental' else set()
+        expression = viewer_extraction_expression(VIEWER_SELECTORS, HEART_SELECTOR, scroll, 500)
+        viewers = []
+        likes = []
+        empty_batches = 0
+        
+        for _ in range(self.max_scroll_batches if scroll else 1):
+            try:
+                page = await self.tab.session.evaluate(expression, await_promise=True) or {}
+            except CDPError as e:
+                record_failure('extract', e, **self.log_fields())
+                break
+            
+            batch = self._read_batch(page, viewers, likes)
+            empty_batches = 0 if batch else empty_batches + 1
+            if self._harvest_done(page, batch, known, empty_batches):
+                break
+        
+        return viewers, likes
+    
+    async def monitor_loop(self):
+        """Main monitoring loop for a single account, polled adaptively"""
+        self.is_running = True
+        state = poll_policy.new_state()
+        
+        try:
+            for _ in range(int(outbound.start_delay())):
+                if not self.is_running:
+                    break
+                await asyncio.sleep(1)
+            
+            while self.is_running:
+                try:
+                    delay = poll_policy.next_interval(state, await self.check(), story_date=self.story_date)
+                except Exception as e:
+                    record_failure('check', e, **self.log_fields())
+                    delay = poll_policy.error_delay(state)
+                
+                for _ in range(int(delay)):
+                    if not self.is_running:
+                        break
+                    await asyncio.sleep(1)
+                    
+        except Exception as e:
+            record_failure('monitor', e, **self.log_fields())
+        finally:
+            self.cleanup()
+    
+    async def check(self):
+        """Run one scrape and ingest; returns the viewer count, or None when no story is up"""
+        try:
+            story_data = await self.scrape()
+        except Exception as e:
+            telemetry.scrapes_total.inc(result='error')
+            record_failure('scrape', e, **self.log_fields())
+            raise
+        return await run_in_app(self.record_scrape, story_data)
+    
+    async def scrape(self):
+        """Borrow a tab for one profile visit and viewer scrape"""
+        self.step_timings = {}
+        started = time.perf_counter()
+        async with cdp_pool.checkout(self.user_id) as tab:
+            self.tab = tab
+            tab.session.drain_network_events()  # drop what the tab's setup loaded
+            traffic = None
+            try:
+                if tab.needs_login and not await self.wait_for_login():
+                    raise RuntimeError("Instagram login failed")
+                if not await self.go_to_profile():
+                    if not await self.session_rejected():
+                        return None
+                    log_event('session_rejected', level='warning', **self.log_fields())
+                    await asyncio.to_thread(cdp_pool.invalidate, self.user_id)
+                    if not await self.wait_for_login():
+                        raise RuntimeError("Instagram login failed")
+                    if not await self.go_to_profile():
+                        return None
+                return await self.get_story_data()
+            finally:
+                events = tab.session.drain_network_events()
+                traffic = summarize_events(events, resource_policy) if resource_policy.measure else None
+                self.tab = None
+                telemetry.phase_seconds.observe(time.perf_counter() - started, phase='scrape')
+                telemetry.record_traffic(traffic)
+                log_event('scrape', seconds=round(time.perf_counter() - started, 3),
+                          steps={step: round(seconds, 3) for step, seconds in self.step_timings.items()},
+                          traffic=traffic, **self.log_fields())
+    
+    def cleanup(self):
+        """Drop this process's copy of the account's session (the stored one stays)"""
+        cdp_pool.forget(self.user_id)
+
+def new_monitor(user_id, instagram_username):
+    """A monitor for the configured SCRAPER_ENGINE"""
+    monitor_class = AsyncInstagramMonitor if SCRAPER_ENGINE == 'cdp' else InstagramMonitor
+    return monitor_class(user_id, instagram_username)
@@ -0,0 +1,425 @@
+"""
+Scrape -> ingest pipeline for monitor workers
+Scrapers hand immutable snapshots to a bounded queue and go back to their
+browser; a few writer threads merge and batch the snapshots into
+multi-account transactions. A full queue blocks the scrapers (backpressure)
+instead of piling snapshots up in memory.
+
+Every snapshot is appended to an on-disk journal before it is queued and
+acknowledged there once its transaction committed, so a crash between
+scrape and commit loses nothing: the next worker to start on the host
+replays the journal of the dead process. Delivery is at-least-once, which
+is safe because applying a snapshot is idempotent (links and counts only
+change for viewers and likes the database does not have yet).
+"""
+
+import os
+import json
+import time
+import fcntl
+import uuid
+import queue
+import tempfile
+import threading
+from collections import namedtuple
+from datetime import datetime, timezone
+
+import telemetry
+from telemetry import log_event
+
+# One scrape of one account; viewers and likes are tuples of usernames and
+# fields carries the monitor's log context
+Snapshot = namedtuple('Snapshot', 'id user_id story_date scraped_at viewers likes fields')
+
+
+def make_snapshot(user_id, story_data, fields=None, now=None):
+    """A snapshot of one scrape; ``now`` (local time, default the current time) dates both its story and the scrape"""
+    now = now or datetime.now()
+    return Snapshot(
+        id=uuid.uuid4().hex,
+        user_id=user_id,
+        story_date=now.date().isoformat(),
+        scraped_at=now.astimezone(timezone.utc).replace(tzinfo=None).isoformat(),  # UTC, like the other timestamps
+        viewers=tuple(dict.fromkeys(story_data['viewers'])),
+        likes=tuple(dict.fromkeys(story_data['likes'])),
+        fields=dict(fields or {}),
+    )
+
+
+def snapshot_from_dict(data):
+    return Snapshot(**dict(data, viewers=tuple(data['viewers']), likes=tuple(data['likes'])))
+
+
+def merge_snapshots(snapshots):
+    """Combine snapshots of the same account and story day
+
+    Returns ``[(merged, source_ids), ...]`` in first-seen order. Viewer
+    lists only grow, so the union of several scrapes is what the last
+    one would have stored on top of the earlier ones.
+    """
+    merged = {}
+    for snapshot in snapshots:
+        key = (snapshot.user_id, snapshot.story_date)
+        if key not in merged:
+            merged[key] = (snapshot, [snapshot.id])
+            continue
+        current, ids = merged[key]
+        merged[key] = (current._replace(
+            viewers=tuple(dict.fromkeys(current.viewers + snapshot.viewers)),
+            likes=tuple(dict.fromkeys(current.likes + snapshot.likes)),
+            scraped_at=max(current.scraped_at, snapshot.scraped_at),
+            fields=snapshot.fields,
+        ), ids + [snapshot.id])
+    return list(merged.values())
+
+
+class Journal:
+    """Append-only snapshot log in ``directory``, one set of segments per process
+
+    Segments are named ``<owner>-<seq>.log`` and hold ``{"put": snapshot}``
+    and ``{"ack": [ids]}`` lines. The owner token is the pid plus a random
+    part, so a restarted process that got the crashed one's pid back never
+    writes into its segments. The owner holds an flock on ``<owner>.lock``
+    for as long as it runs; segments whose lock is free (or gone) belong to
+    an exited process. A segment is deleted once it and every older
+    segment are fully acknowledged.
+    """
+
+    def __init__(self, directory, fsync=True, segment_bytes=4 * 1024 * 1024):
+        self.directory = directory
+        self.fsync = fsync
+        self.segment_bytes = segment_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._owner = None  # (token, locked lock file), claimed with the first segment
+        self._seq = 0
+        self._segments = []  # [path, set of unacknowledged ids], oldest first
+        self._where = {}  # snapshot id -> its segment entry
+        self._file = None
+
+    def recover(self):
+        """Adopt the segments of exited processes; returns their unacknowledged snapshots"""
+        adopted, puts, acked = [], {}, set()
+        with self._lock:
+            owners = {}
+            for name in os.listdir(self.directory):
+                owner = _segment_owner(name)
+                if owner is not None and (self._owner is None or owner != self._owner[0]):
+                    owners.setdefault(owner, []).append(name)
+            for owner, names in sorted(owners.items()):
+                lock_path = os.path.join(self.directory, f'{owner}.lock')
+                lock = _try_lock(lock_path)
+                if lock is False:
+                    continue  # its process is still running
+                try:
+                    for name in sorted((n for n in names if n.endswith('.log')), key=_segment_seq):
+                        path = self._next_path()
+                        try:
+                            os.rename(os.path.join(self.directory, name), path)
+                        except FileNotFoundError:
+                            continue  # another process adopted it first
+                        entry = [path, set()]
+                        adopted.append(entry)
+                        with open(path) as f:
+                            for line in f:
+                                try:
+                                    record = json.loads(line)
+                                except ValueError:
+                                    continue  # a line torn by the crash
+                                if 'put' in record:
+                                    snapshot = snapshot_from_dict(record['put'])
+                                    puts[snapshot.id] = snapshot
+                                    entry[1].add(snapshot.id)
+                                else:
+                                    acked.update(record.get('ack', ()))
+                finally:
+                    if lock is not None:
+                        _unlink(lock_path)  # only after its segments moved, so nobody adopts them twice
+                        lock.close()
+
+            pending = [snapshot for snapshot_id, snapshot in puts.items() if snapshot_id not in acked]
+            for entry in adopted:
+                entry[1] -= acked
+                self._segments.append(entry)
+                for snapshot_id in entry[1]:
+                    self._where[snapshot_id] = entry
+            self._prune()
+        return pending
+
+    def append(self, snapshot):
+        with self._lock:
+            entry = self._writable()
+            self._write({'put': snapshot._asdict()}, sync=self.fsync)
+            entry[1].add(snapshot.id)
+            self._where[snapshot.id] = entry
+
+    def ack(self, snapshot_ids):
+        """Mark snapshots committed; losing an ack only means an idempotent replay"""
+        with self._lock:
+            self._writable()
+            self._write({'ack': list(snapshot_ids)}, sync=False)
+            for snapshot_id in snapshot_ids:
+                entry = self._where.pop(snapshot_id, None)
+                if entry is not None:
+                    entry[1].discard(snapshot_id)
+            self._prune()
+
+    def dead_letter(self, snapshot, error):
+        """Set aside a snapshot that cannot be applied (acknowledge it separately)"""
+        with self._lock:
+            with open(os.path.join(self.directory, 'dead-letters.jsonl'), 'a') as f:
+                f.write(json.dumps({'snapshot': snapshot._asdict(), 'error': error,
+                                    'at': datetime.utcnow().isoformat()}) + '\n')
+
+    @property
+    def pending(self):
+        with self._lock:
+            return len(self._where)
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+            self._prune()
+            if self._owner is not None and not self._segments:
+                token, lock = self._owner
+                _unlink(os.path.join(self.directory, f'{token}.lock'))
+                lock.close()
+                self._owner = None
+
+    def _next_path(self):
+        if self._owner is None:
+            token = f'{os.getpid()}-{uuid.uuid4().hex}'
+            lock = open(os.path.join(self.directory, f'{token}.lock'), 'w')
+            fcntl.flock(lock, fcntl.LOCK_EX)  # held until the process exits
+            self._owner = (token, lock)
+        self._seq += 1
+        return os.path.join(self.directory, f'{self._owner[0]}-{self._seq:06d}.log')
+
+    def _writable(self):
+        """The current segment entry, rotating to a new segment when it is full"""
+        if self._file is not None and self._file.tell() < self.segment_bytes:
+            return self._segments[-1]
+        if self._file is not None:
+            self._file.close()
+        path = self._next_path()
+        self._file = open(path, 'a')
+        entry = [path, set()]
+        self._segments.append(entry)
+        return entry
+
+    def _write(self, record, sync):
+        self._file.write(json.dumps(record, separators=(',', ':')) + '\n')
+        self._file.flush()
+        if sync:
+            os.fsync(self._file.fileno())
+
+    def _prune(self):
+        current = self._segments[-1] if self._file is not None else None
+        while self._segments and not self._segments[0][1] and self._segments[0] is not current:
+            path, _ = self._segments.pop(0)
+            _unlink(path)
+
+
+def _segment_owner(name):
+    """The owner token of a segment or lock file name (``<pid>-<hex>``; older segments carry only the pid)"""
+    if name.endswith('.lock'):
+        return name[:-len('.lock')]
+    if name.endswith('.log') and '-' in name:
+        return name[:-len('.log')].rsplit('-', 1)[0]
+    return None
+
+
+def _segment_seq(name):
+    try:
+        return int(name[:-len('.log')].rsplit('-', 1)[1])
+    except ValueError:
+        return 0
+
+
+def _try_lock(path):
+    """The owner's lock file, locked, if its process is gone; False while it runs, None if there is none"""
+    try:
+        lock = open(path)
+    except FileNotFoundError:
+        return None
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock.close()
+        return False
+    return lock
+
+
+def _unlink(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+class IngestPipeline:
+    """Bounded snapshot queue drained by batching writer threads
+
+    ``write(snapshots)`` applies merged snapshots in one transaction and
+    raises on failure. Errors of a ``transient`` type (the database is
+    unreachable) are retried until they clear, which fills the queue and
+    so slows the scrapers down; a snapshot failing for any other reason
+    is retried ``max_attempts`` times and then dead-lettered.
+    """
+
+    def __init__(self, write, queue_size=100, batch_size=20, batch_wait=0.5, writers=1,
+                 journal=None, max_attempts=5, retry_delay=1.0, max_retry_delay=60, transient=()):
+        self._write = write
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.writers = writers
+        self.journal = journal
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.transient = tuple(transient)
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._threads = []
+        self._stopping = threading.Event()
+        self.stats = {'submitted': 0, 'replayed': 0, 'batches': 0, 'written': 0,
+                      'retries': 0, 'dead_letters': 0, 'blocked_seconds': 0.0}
+
+    @property
+    def running(self):
+        return bool(self._threads) and not self._stopping.is_set()
+
+    @property
+    def depth(self):
+        return self._queue.qsize()
+
+    def start(self):
+        """Replay snapshots a crashed process left in the journal, then start the writers"""
+        if self._threads:
+            return
+        recovered = self.journal.recover() if self.journal else []
+        if recovered:
+            log_event('ingest_replay', snapshots=len(recovered))
+        for i in range(self.writers):
+            thread = threading.Thread(target=self._writer_loop, name=f'ingest-writer-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        for snapshot in recovered:
+            self._put(snapshot)
+            self.stats['replayed'] += 1
+
+    def submit(self, snapshot):
+        """Journal a snapshot and queue it, blocking while the writers are behind"""
+        if self.journal:
+            self.journal.append(snapshot)
+        self._put(snapshot)
+        self.stats['submitted'] += 1
+
+    def stop(self, timeout=30):
+        """Write everything queued, then stop the writers; leftovers stay in the journal"""
+        self._stopping.set()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0, deadline - time.monotonic()))
+        self._threads = []
+        if self.journal:
+            self.journal.close()
+
+    def _put(self, snapshot):
+        try:
+            self._queue.put_nowait(snapshot)
+            return
+        except queue.Full:
+            pass
+        started = time.perf_counter()
+        self._queue.put(snapshot)
+        waited = time.perf_counter() - started
+        self.stats['blocked_seconds'] += waited
+        telemetry.ingest_backpressure_seconds_total.inc(waited)
+
+    def _writer_loop(self):
+        while True:
+            try:
+                first = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                if self._stopping.is_set():
+                    return
+                continue
+            batch = [first]
+            deadline = time.monotonic() + self.batch_wait
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            try:
+                self._write_batch(batch)
+            except Exception as e:
+                # Never lose the writer thread; the journal still holds the batch
+                telemetry.record_failure('ingest_batch', e, snapshots=len(batch))
+
+    def _write_batch(self, batch):
+        telemetry.ingest_batch_snapshots.observe(len(batch))
+        self.stats['batches'] += 1
+        self._write_merged(merge_snapshots(batch))
+
+    def _write_merged(self, items):
+        """Write ``[(snapshot, source_ids), ...]`` in one transaction, retrying with backoff
+
+        A batch that fails for a non-transient reason is split up so one bad
+        snapshot cannot hold the others back.
+        """
+        attempt = 0
+        while True:
+            try:
+                self._write([snapshot for snapshot, _ in items])
+            except Exception as e:
+                error = e
+            else:
+                self._acknowledge([snapshot_id for _, ids in items for snapshot_id in ids])
+                return
+            attempt += 1
+            if not isinstance(error, self.transient):
+                if len(items) > 1:
+                    log_event('ingest_batch_failed', level='warning', error=str(error), snapshots=len(items))
+                    for item in items:
+                        self._write_merged([item])
+                    return
+                if attempt >= self.max_attempts:
+                    self._dead_letter(*items[0], error=error, attempts=attempt)
+                    return
+            self.stats['retries'] += 1
+            time.sleep(min(self.retry_delay * 2 ** (attempt - 1), self.max_retry_delay))
+
+    def _dead_letter(self, snapshot, ids, error, attempts):
+        self.stats['dead_letters'] += 1
+        telemetry.ingest_dead_letters_total.inc()
+        telemetry.record_failure('ingest', error, snapshot_id=snapshot.id, attempts=attempts, **snapshot.fields)
+        if self.journal:
+            self.journal.dead_letter(snapshot, str(error))
+            self.journal.ack(ids)
+
+    def _acknowledge(self, ids):
+        self.stats['written'] += len(ids)
+        if self.journal:
+            self.journal.ack(ids)
+
+
+def ingest_pipeline_from_env(write, transient=()):
+    """INGEST_MODE=pipeline (default) or inline; the journal lives in INGEST_JOURNAL_DIR"""
+    if os.environ.get('INGEST_MODE', 'pipeline') == 'inline':
+        return None
+    directory = os.environ.get('INGEST_JOURNAL_DIR') or os.path.join(tempfile.gettempdir(), 'instagram_monitor_journal')
+    journal = None if directory == 'off' else Journal(
+        directory, fsync=os.environ.get('INGEST_JOURNAL_FSYNC', '1') != '0')
+    return IngestPipeline(
+        write,
+        queue_size=int(os.environ.get('INGEST_QUEUE_SIZE', 100)),
+        batch_size=int(os.environ.get('INGEST_BATCH_SIZE', 20)),
+        batch_wait=float(os.environ.get('INGEST_BATCH_WAIT', 0.5)),
+        writers=int(os.environ.get('INGEST_WRITERS', 1)),
+        journal=journal,
+        transient=transient,
+    )
@@ -0,0 +1,325 @@
+"""
+Outbound request budget shared by every monitor
+Each navigation to Instagram (login page, profile, story, viewer list)
+first takes a slot from a concurrency semaphore and a token from a token
+bucket, so a host never loads more pages at once, or per second, than
+configured however many monitors it runs. Rate-limit pages and navigation
+errors put the whole budget in a cooldown that doubles while the signals
+keep coming. The state lives in this process or, for the worker processes
+on one host, in a SQLite file standing in for a shared store.
+"""
+
+import asyncio
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager, contextmanager
+
+import telemetry
+from telemetry import log_event
+
+# Base cooldown per backoff signal, in seconds; doubles per consecutive signal
+BACKOFF_SECONDS = {'rate_limited': 30, 'error': 2}
+
+
+class Throttled(Exception):
+    """The outbound budget stayed closed for longer than a caller may wait"""
+
+
+def _refill(tokens, updated_at, now, rate, burst):
+    return min(burst, tokens + max(now - updated_at, 0) * rate)
+
+
+def _cooldown(strikes, reason, max_backoff):
+    # Somewhere between half and all of the delay, so monitors do not all come back together
+    delay = min(BACKOFF_SECONDS[reason] * 2 ** (strikes - 1), max_backoff)
+    return delay * random.uniform(0.5, 1.0)
+
+
+class MemoryBackend:
+    """Budget for the monitors of this process only"""
+
+    blocking = False
+
+    def __init__(self, burst):
+        self._lock = threading.Lock()
+        self._tokens = burst
+        self._updated_at = time.time()
+        self._cooldown_until = 0
+        self._strikes = 0
+        self._slots = {}  # slot id -> lease expiry
+
+    def take(self, rate, burst):
+        """Take one token; returns 0, or the seconds until one may be available"""
+        now = time.time()
+        with self._lock:
+            self._tokens = _refill(self._tokens, self._updated_at, now, rate, burst)
+            self._updated_at = now
+            if now < self._cooldown_until:
+                return self._cooldown_until - now
+            if self._tokens < 1:
+                return (1 - self._tokens) / rate
+            self._tokens -= 1
+            return 0
+
+    def acquire_slot(self, limit, lease):
+        now = time.time()
+        with self._lock:
+            self._slots = {slot: expires for slot, expires in self._slots.items() if expires > now}
+            if len(self._slots) >= limit:
+                return None
+            slot = uuid.uuid4().hex
+            self._slots[slot] = now + lease
+            return slot
+
+    def release_slot(self, slot):
+        with self._lock:
+            self._slots.pop(slot, None)
+
+    def penalize(self, reason, max_backoff):
+        now = time.time()
+        with self._lock:
+            self._strikes += 1
+            delay = _cooldown(self._strikes, reason, max_backoff)
+            self._cooldown_until = max(self._cooldown_until, now + delay)
+            return delay
+
+    def succeed(self):
+        with self._lock:
+            self._strikes = 0
+
+
+class LocalBackend:
+    """Stand-in for a shared budget: a SQLite file shared by the processes on one host"""
+
+    blocking = True  # waits up to 10 s for the file's write lock
+
+    def __init__(self, path, burst):
+        self.path = path
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute("CREATE TABLE IF NOT EXISTS bucket (id INTEGER PRIMARY KEY CHECK (id = 0), tokens REAL, "
+                     "updated_at REAL, cooldown_until REAL, strikes INTEGER)")
+        conn.execute("CREATE TABLE IF NOT EXISTS slot (id TEXT PRIMARY KEY, expires_at REAL)")
+        conn.execute("INSERT OR IGNORE INTO bucket VALUES (0, ?, ?, 0, 0)", (burst, time.time()))
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")  # one writer at a time across processes
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def take(self, rate, burst):
+        now = time.time()
+        with self._transaction() as conn:
+            tokens, updated_at, cooldown_until = conn.execute(
+                "SELECT tokens, updated_at, cooldown_until FROM bucket WHERE id = 0").fetchone()
+            tokens = _refill(tokens, updated_at, now, rate, burst)
+            wait = 0
+            if now < cooldown_until:
+                wait = cooldown_until - now
+            elif tokens < 1:
+                wait = (1 - tokens) / rate
+            else:
+                tokens -= 1
+            conn.execute("UPDATE bucket SET tokens = ?, updated_at = ? WHERE id = 0", (tokens, now))
+            return wait
+
+    def acquire_slot(self, limit, lease):
+        now = time.time()
+        with self._transaction() as conn:
+            # Slots of a process that died without releasing them run out with their lease
+            conn.execute("DELETE FROM slot WHERE expires_at <= ?", (now,))
+            if conn.execute("SELECT COUNT(*) FROM slot").fetchone()[0] >= limit:
+                return None
+            slot = uuid.uuid4().hex
+            conn.execute("INSERT INTO slot VALUES (?, ?)", (slot, now + lease))
+            return slot
+
+    def release_slot(self, slot):
+        self._connect().execute("DELETE FROM slot WHERE id = ?", (slot,))
+
+    def penalize(self, reason, max_backoff):
+        now = time.time()
+        with self._transaction() as conn:
+            strikes, cooldown_until = conn.execute(
+                "SELECT strikes, cooldown_until FROM bucket WHERE id = 0").fetchone()
+            delay = _cooldown(strikes + 1, reason, max_backoff)
+            conn.execute("UPDATE bucket SET strikes = ?, cooldown_until = ? WHERE id = 0",
+                         (strikes + 1, max(cooldown_until, now + delay)))
+            return delay
+
+    def succeed(self):
+        # Most navigations succeed with no strikes to clear; skip the write lock then
+        self._connect().execute("UPDATE bucket SET strikes = 0 WHERE id = 0 AND strikes > 0")
+
+
+class OutboundLimiter:
+    """Token bucket plus concurrency semaphore in front of every navigation
+
+    ``rate`` tokens per second refill a bucket of ``burst``; at most
+    ``concurrency`` navigations hold a slot at once. A caller waits at most
+    ``max_wait`` seconds for both before Throttled is raised, so a long
+    cooldown fails the check (and the scheduler retries it later) instead
+    of pinning a pooled browser. ``start_jitter`` spreads the first checks
+    of monitors started together.
+    """
+
+    def __init__(self, backend=None, rate=0.5, burst=5, concurrency=2, max_wait=120, lease=180,
+                 max_backoff=900, start_jitter=60, enabled=True):
+        self.backend = backend or MemoryBackend(burst)
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency
+        self.max_wait = max_wait
+        self.lease = lease
+        self.max_backoff = max_backoff
+        self.start_jitter = start_jitter
+        self.enabled = enabled
+
+    def start_delay(self):
+        """Random delay before a monitor's first check"""
+        return random.uniform(0, self.start_jitter) if self.enabled else 0
+
+    @contextmanager
+    def request(self, kind):
+        """Hold one navigation slot and token while the block runs
+
+        An exception from the block counts as an error signal; a clean
+        exit clears the backoff.
+        """
+        if not self.enabled:
+            yield
+            return
+        started = time.monotonic()
+        deadline = started + self.max_wait
+        slot = self._wait(kind, deadline, lambda: (self.backend.acquire_slot(self.concurrency, self.lease), None))
+        try:
+            self._wait(kind, deadline, self._take)
+            telemetry.outbound_wait_seconds.observe(time.monotonic() - started, kind=kind)
+            telemetry.outbound_requests_total.inc(kind=kind)
+            try:
+                yield
+            except Throttled:
+                raise
+            except Exception:
+                self.penalize('error')
+                raise
+            self.backend.succeed()
+        finally:
+            self.backend.release_slot(slot)
+
+    @asynccontextmanager
+    async def async_request(self, kind):
+        """request() for coroutines: waits for the budget without blocking the event loop
+
+        A blocking backend (LocalBackend's SQLite lock) is called in a
+        thread, so lock contention stalls only this request, not the loop.
+        """
+        if not self.enabled:
+            yield
+            return
+        started = time.monotonic()
+        deadline = started + self.max_wait
+        slot = await self._wait_async(kind, deadline,
+                                      lambda: (self.backend.acquire_slot(self.concurrency, self.lease), None))
+        try:
+            await self._wait_async(kind, deadline, self._take)
+            telemetry.outbound_wait_seconds.observe(time.monotonic() - started, kind=kind)
+            telemetry.outbound_requests_total.inc(kind=kind)
+            try:
+                yield
+            except Throttled:
+                raise
+            except Exception:
+                await self._call_backend(self.penalize, 'error')
+                raise
+            await self._call_backend(self.backend.succeed)
+        finally:
+            await self._call_backend(self.backend.release_slot, slot)
+
+    async def _call_backend(self, function, *args):
+        if self.backend.blocking:
+            return await asyncio.to_thread(function, *args)
+        return function(*args)
+
+    async def async_penalize(self, reason):
+        """penalize() for coroutines"""
+        await self._call_backend(self.penalize, reason)
+
+    def _take(self):
+        wait = self.backend.take(self.rate, self.burst)
+        return (True, None) if wait == 0 else (None, wait)
+
+    def _wait(self, kind, deadline, attempt):
+        """Retry ``attempt`` until it returns a result, sleeping as long as it hints (with jitter)"""
+        backoff = 0.05
+        while True:
+            result, hint = attempt()
+            if result is not None:
+                return result
+            time.sleep(self._retry_delay(kind, deadline, hint, backoff))
+            backoff = min(backoff * 2, 1.0)
+
+    async def _wait_async(self, kind, deadline, attempt):
+        backoff = 0.05
+        while True:
+            result, hint = await self._call_backend(attempt)
+            if result is not None:
+                return result
+            await asyncio.sleep(self._retry_delay(kind, deadline, hint, backoff))
+            backoff = min(backoff * 2, 1.0)
+
+    def _retry_delay(self, kind, deadline, hint, backoff):
+        """How long to sleep before the next attempt; raises Throttled past the deadline"""
+        now = time.monotonic()
+        delay = hint * random.uniform(1.0, 1.25) if hint else backoff * random.uniform(0.5, 1.5)
+        if now + (hint or 0) > deadline or now >= deadline:
+            telemetry.outbound_throttled_total.inc(kind=kind)
+            raise Throttled(f"outbound budget closed for more than {self.max_wait:g}s ({kind})")
+        return min(delay, deadline - now)
+
+    def penalize(self, reason):
+        """Back off every monitor after a rate-limit page or a failed navigation"""
+        if not self.enabled:
+            return
+        delay = self.backend.penalize(reason, self.max_backoff)
+        telemetry.outbound_backoffs_total.inc(reason=reason)
+        log_event('outbound_backoff', level='warning', reason=reason, seconds=round(delay, 1))
+
+
+def outbound_limiter_from_env():
+    """Build the limiter from OUTBOUND_BACKEND (local, memory or off) and its OUTBOUND_* settings"""
+    backend = os.environ.get('OUTBOUND_BACKEND', 'local')
+    burst = float(os.environ.get('OUTBOUND_BURST', 5))
+    settings = {
+        'rate': float(os.environ.get('OUTBOUND_RATE', 0.5)),
+        'burst': burst,
+        'concurrency': int(os.environ.get('OUTBOUND_CONCURRENCY', 2)),
+        'max_wait': float(os.environ.get('OUTBOUND_MAX_WAIT', 120)),
+        'max_backoff': float(os.environ.get('OUTBOUND_MAX_BACKOFF', 900)),
+        'start_jitter': float(os.environ.get('OUTBOUND_START_JITTER', 60)),
+    }
+    if backend == 'off':
+        return OutboundLimiter(enabled=False, **settings)
+    if backend == 'local':
+        path = os.environ.get('OUTBOUND_PATH') or os.path.join(tempfile.gettempdir(), 'instagram_monitor_outbound.db')
+        return OutboundLimiter(LocalBackend(path, burst), **settings)
+    return OutboundLimiter(MemoryBackend(burst), **settings)
@@ -0,0 +1,122 @@
+"""
+Network-level resource blocking for the headless scraper
+Profiles and stories pull full-size images, story video, web fonts and
+analytics beacons that the scraper never reads. Chrome is told to refuse
+them through the DevTools Network.setBlockedURLs command. Chrome's
+performance log (or, for the DevTools engine, the tab's Network events) is
+then read after every scrape to count what was loaded and what was refused.
+"""
+
+import os
+import json
+from fnmatch import fnmatchcase
+
+# URL patterns per category, in the Network.setBlockedURLs wildcard syntax
+BLOCK_PATTERNS = {
+    'image': ('*.jpg*', '*.jpeg*', '*.png*', '*.webp*', '*.gif*', '*.heic*'),
+    'media': ('*.mp4*', '*.m4a*', '*.m4v*', '*.webm*', '*.m3u8*', '*.mpd*'),
+    'font': ('*.woff2*', '*.woff*', '*.ttf*', '*.otf*'),
+    'beacon': ('*/logging_client_events*', '*/ajax/bz*', '*/ajax/logging/*', '*graph.instagram.com/logging*',
+               '*connect.facebook.net/*', '*facebook.com/tr*', '*google-analytics.com/*', '*doubleclick.net/*'),
+}
+
+# Typical transfer size of one request per category, for the bytes-saved
+# estimate (a refused request never reports its size)
+ESTIMATED_BYTES = {'image': 45_000, 'media': 1_200_000, 'font': 60_000, 'beacon': 800}
+
+
+class ResourcePolicy:
+    """Which resource categories to block, minus the allowlisted URLs
+
+    ``allow`` holds wildcard patterns of URLs the scraper must load (for
+    example an image the story ring or viewer dialog ends up depending
+    on). CDP URL blocking has no exceptions, so a block pattern that an
+    allowlisted URL matches is left out; the category is otherwise still
+    blocked. ``measure`` reads the traffic without necessarily blocking
+    anything (it defaults to on whenever something is blocked).
+    """
+
+    def __init__(self, categories=tuple(BLOCK_PATTERNS), allow=(), measure=None):
+        unknown = set(categories) - set(BLOCK_PATTERNS)
+        if unknown:
+            raise ValueError(f"Unknown resource categories: {', '.join(sorted(unknown))}")
+        self.categories = tuple(categories)
+        self.allow = tuple(allow)
+        self.measure = bool(self.categories) if measure is None else measure
+
+    def patterns(self):
+        """The block patterns to install, allowlisted URLs excluded"""
+        return [pattern for category in self.categories for pattern in BLOCK_PATTERNS[category]
+                if not any(fnmatchcase(allowed, pattern) for allowed in self.allow)]
+
+    def category(self, url):
+        """Category of a URL under this policy's patterns, or None"""
+        for category in self.categories:
+            if any(fnmatchcase(url, pattern) for pattern in BLOCK_PATTERNS[category]):
+                return category
+        return None
+
+    def configure_options(self, options):
+        """Chrome options: performance logging of network events for the accounting"""
+        if not self.measure:
+            return
+        options.set_capability('goog:loggingPrefs', {'performance': 'ALL'})
+        options.add_experimental_option('perfLoggingPrefs', {'enableNetwork': True, 'enablePage': False})
+
+    def install(self, driver):
+        """Start blocking in a new browser; the setting lasts for the browser's lifetime"""
+        if not self.categories:
+            return
+        driver.execute_cdp_cmd('Network.enable', {})
+        driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': self.patterns()})
+
+    def traffic(self, driver):
+        """Requests loaded and refused since the last call, or None when not measuring
+
+        Reading the performance log drains it, so calling this before and
+        after a scrape yields that scrape's traffic.
+        """
+        if not self.measure:
+            return None
+        try:
+            entries = driver.get_log('performance')
+        except Exception:
+            return None
+        return summarize_traffic(entries, self)
+
+
+def summarize_traffic(entries, policy):
+    """Tally Network.* events from Chrome performance log entries"""
+    events = []
+    for entry in entries:
+        try:
+            message = json.loads(entry['message'])['message']
+        except (KeyError, TypeError, ValueError):
+            continue
+        events.append((message.get('method'), message.get('params', {})))
+    return summarize_events(events, policy)
+
+
+def summarize_events(events, policy):
+    """Tally (method, params) Network.* events, as read from a DevTools session"""
+    urls = {}
+    summary = {'requests': 0, 'bytes': 0, 'blocked': {}, 'bytes_saved': 0}
+    for method, params in events:
+        if method == 'Network.requestWillBeSent':
+            urls[params.get('requestId')] = params.get('request', {}).get('url', '')
+        elif method == 'Network.loadingFinished':
+            summary['requests'] += 1
+            summary['bytes'] += int(params.get('encodedDataLength') or 0)
+        elif method == 'Network.loadingFailed' and params.get('blockedReason') == 'inspector':
+            category = policy.category(urls.get(params.get('requestId'), '')) or 'other'
+            summary['blocked'][category] = summary['blocked'].get(category, 0) + 1
+            summary['bytes_saved'] += ESTIMATED_BYTES.get(category, 0)
+    return summary
+
+
+def resource_policy_from_env():
+    """SCRAPER_BLOCK=image,media,font,beacon (default) or off; SCRAPER_ALLOW=pattern,..."""
+    setting = os.environ.get('SCRAPER_BLOCK', ','.join(BLOCK_PATTERNS))
+    categories = () if setting.strip() == 'off' else [c.strip() for c in setting.split(',') if c.strip()]
+    allow = [p.strip() for p in os.environ.get('SCRAPER_ALLOW', '').split(',') if p.strip()]
+    return ResourcePolicy(categories, allow)
@@ -54,10 +54,12 @@ def main():
     
     # Import and run the app
     try:
-        from app import app, create_tables
+        from app import create_app
+        from models import create_tables
         
+        app = create_app()
         print("\n📊 Creating database tables...")
-        create_tables()
+        create_tables(app)
         
         print("\n🌐 Starting Flask development server...")
         print("🔗 Open your browser to: http://localhost:5000")
@@ -0,0 +1,201 @@
+"""
+Adaptive polling for Instagram monitors
+Checks accounts more often while viewers are still arriving and backs off
+when there is no story or nothing has changed
+"""
+
+import heapq
+import threading
+import time
+
+STORY_WINDOW_SECONDS = 24 * 60 * 60
+BASELINE_INTERVAL = 300  # the old fixed cadence, used to report scrapes saved
+
+
+class PollPolicy:
+    """Decides how long to wait before the next check of an account"""
+
+    def __init__(self, min_interval=60, max_interval=1800, initial_interval=BASELINE_INTERVAL,
+                 error_interval=60, story_window=STORY_WINDOW_SECONDS):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.initial_interval = initial_interval
+        self.error_interval = error_interval
+        self.story_window = story_window
+
+    def new_state(self, min_interval=None, max_interval=None):
+        low = min_interval or self.min_interval
+        high = max(max_interval or self.max_interval, low)
+        return PollState(min(max(self.initial_interval, low), high), low, high)
+
+    def next_interval(self, state, viewer_count, now=None, story_date=None):
+        """Update ``state`` with a check result and return the next delay
+
+        ``viewer_count`` is None when the account has no story up.
+        ``story_date`` is the story day the count belongs to; an account
+        that posts again before its ring expires never shows "no story",
+        so a new day is what starts fast sampling again.
+        """
+        now = time.time() if now is None else now
+        state.errors = 0
+
+        if viewer_count is None:
+            # No story ring: back off until one appears
+            state.story_started_at = None
+            state.story_date = None
+            state.last_viewer_count = None
+            state.interval = min(state.interval * 2, state.max_interval)
+        elif state.story_started_at is None or (story_date is not None and story_date != state.story_date):
+            # A story just showed up, or a new story day began: start sampling it quickly
+            state.story_started_at = now
+            state.story_date = story_date
+            state.last_viewer_count = viewer_count
+            state.interval = state.min_interval
+        elif now - state.story_started_at >= self.story_window:
+            # Past the 24-hour window the counts are final
+            state.last_viewer_count = viewer_count
+            state.interval = state.max_interval
+        elif viewer_count > (state.last_viewer_count or 0):
+            # Viewers still pouring in: sample more often
+            state.last_viewer_count = viewer_count
+            state.interval = max(state.interval // 2, state.min_interval)
+        else:
+            state.interval = min(state.interval * 2, state.max_interval)
+
+        return state.interval
+
+    def error_delay(self, state):
+        """Retry delay after a failed check, doubling on repeated failures"""
+        state.errors += 1
+        return min(self.error_interval * 2 ** (state.errors - 1), state.max_interval)
+
+
+class PollState:
+    def __init__(self, interval, min_interval, max_interval):
+        self.interval = interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.story_started_at = None
+        self.story_date = None
+        self.last_viewer_count = None
+        self.errors = 0
+        self.scrapes = 0
+        self.covered_seconds = 0
+
+
+class PollScheduler:
+    """Priority queue of accounts keyed on their next due time
+
+    Thread-safe: ticks complete on executor threads while the worker loop
+    pops due accounts. ``wait()`` returns early whenever a check is
+    (re)scheduled, so the loop never sleeps past a due time that moved up.
+    """
+
+    def __init__(self, policy=None, clock=time.monotonic):
+        self.policy = policy or PollPolicy()
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._heap = []
+        self._due = {}
+        self._states = {}
+        self._seq = 0
+        self._retired_scrapes = 0  # totals from accounts that were removed
+        self._retired_seconds = 0
+        self._changed = threading.Event()
+
+    def add(self, key, delay=0, min_interval=None, max_interval=None):
+        with self._lock:
+            self._states[key] = self.policy.new_state(min_interval, max_interval)
+            self._push(key, self.clock() + delay)
+
+    def remove(self, key):
+        with self._lock:
+            state = self._states.pop(key, None)
+            self._due.pop(key, None)
+            if state is not None:
+                self._retired_scrapes += state.scrapes
+                self._retired_seconds += state.covered_seconds
+
+    def __contains__(self, key):
+        return key in self._states
+
+    def next_due(self):
+        """Monotonic time of the earliest scheduled check (None when empty)"""
+        with self._lock:
+            self._drop_stale()
+            return self._heap[0][0] if self._heap else None
+
+    def wait(self, timeout):
+        """Sleep up to ``timeout`` seconds, or until an account is scheduled or ``wake()`` is called"""
+        self._changed.wait(timeout)
+        self._changed.clear()
+
+    def wake(self):
+        self._changed.set()
+
+    def pop_due(self, now=None):
+        """Take every account whose check is due; they stay out of the queue until completed"""
+        now = self.clock() if now is None else now
+        due = []
+        with self._lock:
+            while self._heap:
+                self._drop_stale()
+                if not self._heap or self._heap[0][0] > now:
+                    break
+                _, _, key = heapq.heappop(self._heap)
+                del self._due[key]
+                due.append(key)
+        return due
+
+    def complete(self, key, viewer_count, story_date=None):
+        """Record a finished check and schedule the next one"""
+        with self._lock:
+            state = self._states.get(key)
+            if state is None:
+                return None
+            delay = self.policy.next_interval(state, viewer_count, story_date=story_date)
+            state.scrapes += 1
+            state.covered_seconds += delay
+            self._push(key, self.clock() + delay)
+            return delay
+
+    def fail(self, key):
+        """Record a failed check and schedule a retry"""
+        with self._lock:
+            state = self._states.get(key)
+            if state is None:
+                return None
+            delay = self.policy.error_delay(state)
+            state.scrapes += 1
+            state.covered_seconds += delay
+            self._push(key, self.clock() + delay)
+            return delay
+
+    def metrics(self):
+        """Scrape counts plus how many the old fixed 300-second loop would have run"""
+        with self._lock:
+            states = list(self._states.values())
+            scrapes = self._retired_scrapes + sum(state.scrapes for state in states)
+            covered = self._retired_seconds + sum(state.covered_seconds for state in states)
+        fixed = covered / BASELINE_INTERVAL
+        return {
+            'accounts': len(states),
+            'hot_accounts': sum(1 for state in states if state.interval <= state.min_interval),
+            'scrapes': scrapes,
+            'fixed_interval_scrapes': round(fixed),
+            'scrapes_saved': round(fixed - scrapes),
+        }
+
+    def _push(self, key, due):
+        self._seq += 1
+        self._due[key] = due
+        heapq.heappush(self._heap, (due, self._seq, key))
+        self._changed.set()
+
+    def _drop_stale(self):
+        # Entries for removed or rescheduled accounts are skipped lazily
+        while self._heap:
+            due, _, key = self._heap[0]
+            if self._due.get(key) == due and key in self._states:
+                return
+            heapq.heappop(self._heap)
@@ -0,0 +1,95 @@
+"""
+Persistent Instagram sessions for pooled browsers
+Cookie jars are encrypted (Fernet) and kept in the database, so a restarted
+or redeployed worker - or another worker taking over a job - restores the
+account's session instead of logging in again.
+"""
+
+import os
+import json
+import base64
+import hashlib
+import time
+from datetime import datetime
+
+from telemetry import log_event
+
+LOGIN_COOKIE = 'sessionid'
+
+
+def session_cookies_valid(cookies, login_cookie=LOGIN_COOKIE, now=None):
+    """Cheap offline check: the jar holds an unexpired login cookie"""
+    now = time.time() if now is None else now
+    for cookie in cookies or ():
+        if cookie.get('name') == login_cookie and cookie.get('value'):
+            expires = cookie.get('expires')
+            return expires is None or expires <= 0 or expires > now
+    return False
+
+
+def cookie_digest(cookies):
+    """Digest of the parts of a jar that matter, ignoring expiry refreshes"""
+    identity = sorted((c.get('name'), c.get('value'), c.get('domain'), c.get('path')) for c in cookies or ())
+    return hashlib.sha1(json.dumps(identity).encode()).hexdigest()
+
+
+class SessionCipher:
+    """Fernet encryption with a key derived from any secret string"""
+
+    def __init__(self, secret):
+        from cryptography.fernet import Fernet
+        self._fernet = Fernet(base64.urlsafe_b64encode(hashlib.sha256(secret.encode()).digest()))
+
+    def encrypt(self, cookies):
+        return self._fernet.encrypt(json.dumps(cookies).encode()).decode()
+
+    def decrypt(self, token):
+        from cryptography.fernet import InvalidToken
+        try:
+            return json.loads(self._fernet.decrypt(token.encode()))
+        except (InvalidToken, ValueError):
+            return None  # written with another key, or corrupted
+
+
+class DatabaseSessionStore:
+    """Encrypted cookie jars in the ``model`` table, one row per account"""
+
+    def __init__(self, app, db, model, cipher):
+        self.app = app
+        self.db = db
+        self.model = model
+        self.cipher = cipher
+
+    def load(self, account):
+        with self.app.app_context():
+            row = self.db.session.get(self.model, account)
+            return self.cipher.decrypt(row.cookies) if row else None
+
+    def save(self, account, cookies):
+        with self.app.app_context():
+            row = self.db.session.get(self.model, account)
+            if row is None:
+                row = self.model(user_id=account)
+                self.db.session.add(row)
+            row.cookies = self.cipher.encrypt(cookies)
+            row.updated_at = datetime.utcnow()
+            self.db.session.commit()
+
+    def delete(self, account):
+        with self.app.app_context():
+            self.model.query.filter_by(user_id=account).delete()
+            self.db.session.commit()
+
+
+def session_store_from_env(app, db, model):
+    """SESSION_STORE=db (default) or off; the key is SESSION_ENCRYPTION_KEY, else SECRET_KEY"""
+    if os.environ.get('SESSION_STORE', 'db') == 'off':
+        return None
+    secret = os.environ.get('SESSION_ENCRYPTION_KEY') or app.config['SECRET_KEY']
+    try:
+        cipher = SessionCipher(secret)
+    except ImportError:
+        log_event('session_store_disabled', level='warning',
+                  reason='the cryptography package is not installed; sessions are kept in memory only')
+        return None
+    return DatabaseSessionStore(app, db, model, cipher)
@@ -0,0 +1,527 @@
+"""
+Story history store for Instagram Story Monitor
+Everything that writes or reads the story history outside of a single web
+request: snapshot ingest, the analytics rollups, the story archive and
+bulk deletes. Used by the web app (app.py) and the monitor runtime
+(monitor.py) alike, so it imports neither Flask routes nor Selenium;
+callers provide the app context.
+"""
+
+import os
+import json
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import case, delete, event, func, insert, or_, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Engine
+
+from cache import view_cache_from_env
+from models import (db, BrowserSession, DailyStats, IngestEvent, MonitorJob, Story, StoryArchive, StoryViewer,
+                    User, UserStats, Viewer)
+import telemetry
+from telemetry import log_event
+
+def rollup_version(user_id):
+    """When a user's rollups last changed; every ingest moves it, whichever process or host ran it"""
+    updated_at = db.session.execute(select(UserStats.updated_at).where(UserStats.user_id == user_id)).scalar()
+    return updated_at.isoformat() if updated_at else None
+
+# Per-user view cache; see cache.py and CACHE_BACKEND in env.example
+view_cache = view_cache_from_env(data_version=rollup_version)
+
+# Statements issued by the current thread, counted while an ingest runs
+_statement_count = threading.local()
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    if getattr(_statement_count, 'value', None) is not None:
+        _statement_count.value += 1
+
+def chunked(items, size=500):
+    """Split a list into IN-clause sized chunks (SQLite caps bound parameters)"""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def _upsert_story_viewers(story_id, viewer_ids, now):
+    """Insert-or-update story-viewer links in one statement per chunk"""
+    dialect = db.session.get_bind().dialect.name
+    rows = [{'story_id': story_id, 'viewer_id': viewer_id, 'has_viewed': True,
+             'has_liked': False, 'first_detected': now, 'last_updated': now}
+            for viewer_id in viewer_ids]
+    
+    if dialect in ('postgresql', 'sqlite'):
+        dialect_insert = pg_insert if dialect == 'postgresql' else sqlite_insert
+        for chunk in chunked(rows):
+            stmt = dialect_insert(StoryViewer).values(chunk)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['story_id', 'viewer_id'],
+                set_={'has_viewed': True, 'last_updated': now}
+            )
+            db.session.execute(stmt)
+        return
+    
+    # Generic fallback: update existing links, insert the rest
+    existing = set()
+    for chunk in chunked(viewer_ids):
+        existing.update(db.session.execute(
+            select(StoryViewer.viewer_id)
+            .where(StoryViewer.story_id == story_id, StoryViewer.viewer_id.in_(chunk))
+        ).scalars())
+        db.session.execute(
+            update(StoryViewer)
+            .where(StoryViewer.story_id == story_id, StoryViewer.viewer_id.in_(chunk))
+            .values(has_viewed=True, last_updated=now)
+        )
+    new_rows = [row for row in rows if row['viewer_id'] not in existing]
+    if new_rows:
+        db.session.execute(insert(StoryViewer), new_rows)
+
+# Ingest: scrapes become immutable snapshots (pipeline.py) written by these
+def _viewer_ids(user_id, usernames):
+    """Map usernames to viewer ids for a user with batched IN queries"""
+    ids = {}
+    for chunk in chunked(list(usernames)):
+        rows = db.session.execute(
+            select(Viewer.id, Viewer.username)
+            .where(Viewer.user_id == user_id, Viewer.username.in_(chunk))
+        )
+        ids.update((row.username, row.id) for row in rows)
+    return ids
+
+def apply_snapshot(snapshot):
+    """Add one scrape to the current transaction - no duplicate counting
+    
+    Viewers and story-viewer links are resolved with a handful of
+    set-based statements instead of one query per username, so the
+    number of round trips stays flat as the viewer list grows. Counts only
+    move for links and likes the database does not hold yet, so applying
+    the same snapshot twice (a journal replay) changes nothing.
+    """
+    user_id = snapshot.user_id
+    story_date = date.fromisoformat(snapshot.story_date)
+    now = datetime.fromisoformat(snapshot.scraped_at)
+    
+    # Get or create story record
+    story = Story.query.filter_by(user_id=user_id, story_date=story_date).first()
+    new_story = story is None
+    if new_story:
+        story = Story(user_id=user_id, story_date=story_date)
+        db.session.add(story)
+        db.session.flush()
+    elif story.archive_id is not None:
+        # A late snapshot of an archived day: bring its links back so the counts below stay exact
+        restore_archive(story.archive_id)
+    
+    # Update story last checked time (a replayed older snapshot never moves it back)
+    if story.last_checked is None or story.last_checked < now:
+        story.last_checked = now
+    
+    viewer_names = list(dict.fromkeys(snapshot.viewers))
+    liker_names = list(dict.fromkeys(snapshot.likes))
+    
+    # Resolve viewer ids, creating any viewers we have not seen before
+    viewer_ids = _viewer_ids(user_id, set(viewer_names) | set(liker_names))
+    missing = [name for name in viewer_names if name not in viewer_ids]
+    if missing:
+        db.session.execute(insert(Viewer), [
+            {'user_id': user_id, 'username': name, 'total_views': 0,
+             'total_likes': 0, 'first_seen': now, 'last_seen': now}
+            for name in missing
+        ])
+        viewer_ids.update(_viewer_ids(user_id, missing))
+    
+    seen_ids = [viewer_ids[name] for name in viewer_names]
+    liked_ids = [viewer_ids[name] for name in liker_names if name in viewer_ids]
+    
+    # Existing story-viewer relationships (prevents duplicates)
+    existing_links = {}
+    for chunk in chunked(list(set(seen_ids) | set(liked_ids))):
+        rows = db.session.execute(
+            select(StoryViewer.viewer_id, StoryViewer.has_liked)
+            .where(StoryViewer.story_id == story.id, StoryViewer.viewer_id.in_(chunk))
+        )
+        existing_links.update((row.viewer_id, bool(row.has_liked)) for row in rows)
+    new_ids = [viewer_id for viewer_id in seen_ids if viewer_id not in existing_links]
+    
+    if seen_ids:
+        _upsert_story_viewers(story.id, seen_ids, now)
+        for chunk in chunked(seen_ids):
+            db.session.execute(
+                update(Viewer)
+                .where(Viewer.id.in_(chunk), or_(Viewer.last_seen.is_(None), Viewer.last_seen < now))
+                .values(last_seen=now)
+            )
+    
+    # Only increment counts for NEW viewers (no duplicates)
+    for chunk in chunked(new_ids):
+        db.session.execute(
+            update(Viewer).where(Viewer.id.in_(chunk))
+            .values(total_views=Viewer.total_views + 1)
+        )
+    
+    # Process likes - only increment like count if not already liked
+    linked = set(existing_links) | set(new_ids)
+    new_like_ids = [viewer_id for viewer_id in liked_ids
+                    if viewer_id in linked and not existing_links.get(viewer_id)]
+    for chunk in chunked(new_like_ids):
+        db.session.execute(
+            update(StoryViewer)
+            .where(StoryViewer.story_id == story.id, StoryViewer.viewer_id.in_(chunk))
+            .values(has_liked=True, last_updated=now)
+        )
+        db.session.execute(
+            update(Viewer).where(Viewer.id.in_(chunk))
+            .values(total_likes=Viewer.total_likes + 1)
+        )
+    
+    # Update story totals
+    totals = db.session.execute(
+        select(func.count(case((StoryViewer.has_viewed.is_(True), 1))),
+               func.count(case((StoryViewer.has_liked.is_(True), 1))))
+        .where(StoryViewer.story_id == story.id)
+    ).one()
+    story.total_views, story.total_likes = totals
+    
+    # Keep the analytics rollups in step, in the same transaction
+    update_rollups(user_id, story, now,
+                   new_story=new_story,
+                   new_viewers=len(missing),
+                   new_views=len(new_ids),
+                   new_likes=len(new_like_ids),
+                   changed_viewer_ids=set(new_ids) | set(new_like_ids))
+    
+    # Publish the delta for live dashboards (committed with the ingest)
+    if new_ids or new_like_ids:
+        names = {viewer_id: name for name, viewer_id in viewer_ids.items()}
+        db.session.add(IngestEvent(user_id=user_id, payload=json.dumps(
+            ingest_delta(user_id, story, [names[i] for i in new_ids],
+                         [names[i] for i in new_like_ids]),
+            separators=(',', ':'))))
+    
+    return {'viewers': len(viewer_names), 'new_views': len(new_ids), 'new_likes': len(new_like_ids)}
+
+def write_snapshots(snapshots):
+    """Apply snapshots in one transaction, then invalidate caches and record metrics"""
+    started = time.perf_counter()
+    results = []
+    try:
+        for snapshot in snapshots:
+            _statement_count.value = 0
+            result = apply_snapshot(snapshot)
+            result['statements'] = _statement_count.value
+            results.append(result)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        _statement_count.value = None
+    
+    seconds = round(time.perf_counter() - started, 3)
+    telemetry.phase_seconds.observe(seconds, phase='ingest')
+    for snapshot, result in zip(snapshots, results):
+        view_cache.bump(snapshot.user_id)
+        telemetry.ingest_statements.observe(result['statements'])
+        telemetry.viewers_ingested_total.inc(result['new_views'])
+        telemetry.likes_ingested_total.inc(result['new_likes'])
+        log_event('ingest', snapshot_id=snapshot.id, batch=len(snapshots), seconds=seconds,
+                  **result, **snapshot.fields)
+    return results
+
+# Live update deltas, published with each ingest
+STREAM_DELTA_NAMES = 100  # usernames listed per delta; counts are always exact
+
+def ingest_delta(user_id, story, new_viewers, new_likes):
+    """Compact description of what one ingest changed"""
+    # Read the row itself: the rollups moved with SQL-side increments
+    totals = db.session.execute(
+        select(UserStats.total_stories, UserStats.unique_viewers, UserStats.total_views, UserStats.total_likes)
+        .where(UserStats.user_id == user_id)
+    ).one()
+    return {
+        'date': story.story_date.isoformat(),
+        'story': [story.total_views, story.total_likes],
+        'totals': list(totals),
+        'new_viewers': [len(new_viewers), new_viewers[:STREAM_DELTA_NAMES]],
+        'new_likes': [len(new_likes), new_likes[:STREAM_DELTA_NAMES]],
+    }
+
+# Analytics rollups
+TOP_VIEWERS_LIMIT = 15
+
+def _top_viewers(candidates, limit=TOP_VIEWERS_LIMIT):
+    """Rank viewer rows by views, oldest viewer first on ties"""
+    ranked = sorted(candidates, key=lambda row: (-row['total_views'], row['id']))
+    return ranked[:limit]
+
+def _viewer_rows(viewer_ids):
+    rows = []
+    for chunk in chunked(list(viewer_ids)):
+        for row in db.session.execute(
+            select(Viewer.id, Viewer.username, Viewer.total_views, Viewer.total_likes, Viewer.last_seen)
+            .where(Viewer.id.in_(chunk))
+        ):
+            rows.append({'id': row.id, 'username': row.username, 'total_views': row.total_views,
+                         'total_likes': row.total_likes,
+                         'last_seen': row.last_seen.isoformat() if row.last_seen else None})
+    return rows
+
+def update_rollups(user_id, story, now, new_story, new_viewers, new_views, new_likes, changed_viewer_ids):
+    """Apply one ingest's deltas to the user and daily rollups
+
+    Counters move with SQL-side increments like the viewer counts, so
+    concurrent writers (several INGEST_WRITERS, a journal replay next to
+    live ingest) cannot lose each other's updates. Viewer counts only ever
+    grow, so the top-N list stays exact by re-ranking the current top
+    viewers together with the viewers this ingest touched.
+    """
+    counters = db.session.execute(
+        update(UserStats).where(UserStats.user_id == user_id)
+        .values(total_stories=UserStats.total_stories + (1 if new_story else 0),
+                unique_viewers=UserStats.unique_viewers + new_viewers,
+                total_views=UserStats.total_views + new_views,
+                total_likes=UserStats.total_likes + new_likes,
+                updated_at=datetime.utcnow())  # the cache's data version; a replayed snapshot moves it too
+        .execution_options(synchronize_session=False)
+    )
+    if counters.rowcount == 0:
+        # A new user, or history from before the rollups existed: build them from the tables,
+        # which already hold this ingest
+        _rebuild_rollups(user_id)
+        return
+    
+    # The increment holds the row lock, so this reads the top list the last writer left
+    top_viewers = db.session.execute(select(UserStats.top_viewers).where(UserStats.user_id == user_id)).scalar()
+    current_ids = [row['id'] for row in json.loads(top_viewers or '[]')]
+    db.session.execute(
+        update(UserStats).where(UserStats.user_id == user_id)
+        .values(top_viewers=json.dumps(_top_viewers(_viewer_rows(set(current_ids) | set(changed_viewer_ids)))))
+        .execution_options(synchronize_session=False)
+    )
+    
+    daily = db.session.execute(
+        update(DailyStats).where(DailyStats.user_id == user_id, DailyStats.story_date == story.story_date)
+        .values(total_views=story.total_views, total_likes=story.total_likes,
+                new_viewers=DailyStats.new_viewers + new_viewers, last_checked=now)
+        .execution_options(synchronize_session=False)
+    )
+    if daily.rowcount == 0:
+        db.session.add(DailyStats(user_id=user_id, story_date=story.story_date, total_views=story.total_views,
+                                  total_likes=story.total_likes, new_viewers=new_viewers, last_checked=now))
+
+def rebuild_rollups(user_id):
+    """Recompute a user's rollups from the Story/Viewer/StoryViewer tables"""
+    _rebuild_rollups(user_id)
+    db.session.commit()
+    view_cache.bump(user_id)
+
+def _rebuild_rollups(user_id):
+    """rebuild_rollups in the current transaction; the caller commits"""
+    UserStats.query.filter_by(user_id=user_id).delete()
+    DailyStats.query.filter_by(user_id=user_id).delete()
+    
+    # A viewer is new on the first story day it appears in, archived days included
+    first_dates = dict(db.session.execute(
+        select(StoryViewer.viewer_id, func.min(Story.story_date))
+        .join(Story, Story.id == StoryViewer.story_id)
+        .where(Story.user_id == user_id)
+        .group_by(StoryViewer.viewer_id)
+    ).all())
+    for links, story_dates in user_segments(user_id):
+        for story_id, viewer_id in zip(links['story_id'].tolist(), links['viewer_id'].tolist()):
+            story_date = story_dates[story_id]
+            if viewer_id not in first_dates or story_date < first_dates[viewer_id]:
+                first_dates[viewer_id] = story_date
+    new_per_day = {}
+    for first_date in first_dates.values():
+        new_per_day[first_date] = new_per_day.get(first_date, 0) + 1
+    
+    stories = Story.query.filter_by(user_id=user_id).all()
+    for story in stories:
+        db.session.add(DailyStats(user_id=user_id, story_date=story.story_date,
+                                  total_views=story.total_views or 0, total_likes=story.total_likes or 0,
+                                  new_viewers=new_per_day.get(story.story_date, 0),
+                                  last_checked=story.last_checked))
+    
+    unique_viewers, total_views, total_likes = db.session.execute(
+        select(func.count(Viewer.id), func.coalesce(func.sum(Viewer.total_views), 0),
+               func.coalesce(func.sum(Viewer.total_likes), 0))
+        .where(Viewer.user_id == user_id)
+    ).one()
+    top_ids = db.session.execute(
+        select(Viewer.id).where(Viewer.user_id == user_id)
+        .order_by(Viewer.total_views.desc(), Viewer.id).limit(TOP_VIEWERS_LIMIT)
+    ).scalars().all()
+    db.session.add(UserStats(user_id=user_id, total_stories=len(stories), unique_viewers=unique_viewers,
+                             total_views=total_views, total_likes=total_likes,
+                             top_viewers=json.dumps(_top_viewers(_viewer_rows(top_ids))),
+                             updated_at=datetime.utcnow()))
+
+def user_rollups(user_id):
+    """A user's rollup row, or an empty one before the first ingest"""
+    return db.session.get(UserStats, user_id) or UserStats(
+        user_id=user_id, total_stories=0, unique_viewers=0, total_views=0, total_likes=0, top_viewers='[]')
+
+# Story archive: links of old stories move into compressed per-user segments (see archive.py).
+# archive.py and numpy are imported where they are used: web workers import this module
+# on boot and most of them never read an archived story.
+def archive_after_from_env():
+    """Age after which stories are archived (ARCHIVE_AFTER_DAYS), or None when set to "off" """
+    days = os.environ.get('ARCHIVE_AFTER_DAYS', '180')
+    if days == 'off':
+        return None
+    return timedelta(days=int(days))
+
+ARCHIVE_AFTER = archive_after_from_env()
+
+# In LINK_DTYPE order
+LINK_COLUMNS = [StoryViewer.id, StoryViewer.story_id, StoryViewer.viewer_id, StoryViewer.has_viewed,
+                StoryViewer.has_liked, StoryViewer.first_detected, StoryViewer.last_updated]
+
+def _hot_links(story_ids):
+    """LINK_DTYPE array of the StoryViewer rows of these stories"""
+    import numpy as np
+    from archive import LINK_DTYPE
+    links = [np.fromiter((tuple(row) for row in db.session.connection().execute(
+                 select(*LINK_COLUMNS).where(StoryViewer.story_id.in_(chunk))
+             )), dtype=LINK_DTYPE)
+             for chunk in chunked(story_ids)]
+    return np.concatenate(links) if links else np.zeros(0, dtype=LINK_DTYPE)
+
+def archived_links(story_ids):
+    """LINK_DTYPE array of the archived links of these stories (hot stories have none)"""
+    import numpy as np
+    from archive import LINK_DTYPE, decode_segment
+    segments = {}
+    for chunk in chunked(list(story_ids)):
+        for story_id, archive_id in db.session.execute(
+            select(Story.id, Story.archive_id).where(Story.id.in_(chunk), Story.archive_id.is_not(None))
+        ):
+            segments.setdefault(archive_id, []).append(story_id)
+    links = []
+    for archive_id, ids in segments.items():
+        segment = decode_segment(db.session.execute(
+            select(StoryArchive.payload).where(StoryArchive.id == archive_id)).scalar_one())
+        links.append(segment[np.isin(segment['story_id'], ids)])
+    return np.concatenate(links) if links else np.zeros(0, dtype=LINK_DTYPE)
+
+def user_segments(user_id, since=None, until=None):
+    """(links, {story id: story date}) per archive segment of a user, oldest first"""
+    from archive import decode_segment
+    stmt = select(StoryArchive.id).where(StoryArchive.user_id == user_id)
+    if since:
+        stmt = stmt.where(StoryArchive.last_date >= since)
+    if until:
+        stmt = stmt.where(StoryArchive.first_date <= until)
+    # Payloads are read one at a time, so only one segment is decoded at once
+    for archive_id in db.session.execute(stmt.order_by(StoryArchive.first_date, StoryArchive.id)).scalars().all():
+        payload = db.session.execute(
+            select(StoryArchive.payload).where(StoryArchive.id == archive_id)).scalar_one()
+        dates = dict(db.session.execute(
+            select(Story.id, Story.story_date).where(Story.archive_id == archive_id)).all())
+        yield decode_segment(payload), dates
+
+def viewer_names(viewer_ids):
+    names = {}
+    for chunk in chunked(list(set(viewer_ids))):
+        names.update(db.session.execute(select(Viewer.id, Viewer.username).where(Viewer.id.in_(chunk))).all())
+    return names
+
+def archived_values(link, story_dates, usernames):
+    """An archived link under the field names of the API and exports"""
+    return {'id': link['id'], 'story_id': link['story_id'], 'date': story_dates.get(link['story_id']),
+            'username': usernames.get(link['viewer_id']), 'viewed': link['has_viewed'],
+            'liked': link['has_liked'], 'first_detected': link['first_detected'],
+            'last_updated': link['last_updated']}
+
+def archive_stories(user_id, before):
+    """Move the links of a user's stories dated before ``before`` into monthly segments
+
+    One transaction per segment. The stories are claimed with a
+    compare-and-set on archive_id, so two processes archiving the same user
+    cannot both write a segment for a story. Returns (segments, links).
+    """
+    from archive import encode_segment, segment_key
+    stories = db.session.execute(
+        select(Story.id, Story.story_date)
+        .where(Story.user_id == user_id, Story.story_date < before, Story.archive_id.is_(None))
+        .order_by(Story.story_date)
+    ).all()
+    months = {}
+    for story_id, story_date in stories:
+        months.setdefault(segment_key(story_date), []).append((story_id, story_date))
+    
+    segments = moved = 0
+    for members in months.values():
+        story_ids = [story_id for story_id, _ in members]
+        links = _hot_links(story_ids)
+        links.sort(order=['story_id', 'id'])
+        payload = encode_segment(links)
+        segment = StoryArchive(user_id=user_id, first_date=members[0][1], last_date=members[-1][1],
+                               story_count=len(members), link_count=len(links), payload=payload)
+        db.session.add(segment)
+        db.session.flush()
+        claimed = sum(db.session.execute(
+            update(Story).where(Story.id.in_(chunk), Story.archive_id.is_(None)).values(archive_id=segment.id)
+        ).rowcount for chunk in chunked(story_ids))
+        if claimed != len(story_ids):
+            db.session.rollback()  # another process archived some of them first
+            continue
+        for chunk in chunked(story_ids):
+            db.session.execute(delete(StoryViewer).where(StoryViewer.story_id.in_(chunk))
+                               .execution_options(synchronize_session=False))
+        db.session.commit()
+        segments += 1
+        moved += len(links)
+        telemetry.archive_segments_total.inc()
+        telemetry.archive_links_total.inc(len(links))
+        telemetry.archive_bytes_total.inc(len(payload))
+        log_event('stories_archived', user_id=user_id, first_date=members[0][1].isoformat(),
+                  last_date=members[-1][1].isoformat(), stories=len(members), links=len(links),
+                  bytes=len(payload))
+    return segments, moved
+
+def archive_due(after=ARCHIVE_AFTER, user_id=None):
+    """Archive stories older than ``after`` (every user's by default); returns (segments, links)"""
+    if after is None:
+        return 0, 0
+    before = datetime.utcnow().date() - after
+    user_ids = [user_id] if user_id else db.session.execute(
+        select(Story.user_id).where(Story.story_date < before, Story.archive_id.is_(None)).distinct()
+    ).scalars().all()
+    segments = moved = 0
+    for user_id in user_ids:
+        written, links = archive_stories(user_id, before)
+        segments += written
+        moved += links
+    return segments, moved
+
+def restore_archive(archive_id):
+    """Move a segment's links back into StoryViewer; the caller commits"""
+    from archive import decode_segment, link_rows
+    payload = db.session.execute(select(StoryArchive.payload).where(StoryArchive.id == archive_id)).scalar_one()
+    for chunk in chunked(link_rows(decode_segment(payload))):
+        db.session.execute(insert(StoryViewer), chunk)
+    db.session.execute(update(Story).where(Story.archive_id == archive_id).values(archive_id=None))
+    db.session.execute(delete(StoryArchive).where(StoryArchive.id == archive_id))
+
+def delete_user_data(user_id):
+    """Delete a user and all of their history with bulk statements
+
+    Deleting through the ORM relationships would first load every story,
+    viewer and story-viewer link of the account into the session.
+    """
+    story_ids = select(Story.id).where(Story.user_id == user_id)
+    statements = [delete(StoryViewer).where(StoryViewer.story_id.in_(story_ids)),
+                  delete(Story).where(Story.user_id == user_id)]
+    statements += [delete(model).where(model.user_id == user_id)
+                   for model in (StoryArchive, Viewer, DailyStats, UserStats, IngestEvent,
+                                 MonitorJob, BrowserSession)]
+    statements.append(delete(User).where(User.id == user_id))
+    for stmt in statements:
+        db.session.execute(stmt.execution_options(synchronize_session=False))
+    db.session.commit()
+    view_cache.bump(user_id)
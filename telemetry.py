@@ -0,0 +1,371 @@
+"""
+Metrics and structured logs for Instagram monitors
+Counters, gauges and histograms in the Prometheus text format. Every process
+(gunicorn workers and monitor workers on the same host) snapshots its
+metrics to a file in METRICS_DIR, and /metrics merges the files, so one
+scrape reports the whole host no matter which worker answers it.
+"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import tempfile
+import threading
+from datetime import datetime
+
+PHASE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+STATEMENT_BUCKETS = (5, 10, 20, 50, 100, 200, 500, 1000)
+BYTE_BUCKETS = (1e4, 5e4, 1e5, 2.5e5, 5e5, 1e6, 2.5e6, 5e6, 1e7)
+BATCH_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+POOL_WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1, 5, 30)
+
+
+def log_event(event, level='info', **fields):
+    """Print one JSON log line; monitors pass their session_id along"""
+    record = {'ts': datetime.utcnow().isoformat(timespec='milliseconds') + 'Z', 'level': level, 'event': event}
+    record.update(fields)
+    print(json.dumps(record, default=str), file=sys.stderr if level == 'error' else sys.stdout, flush=True)
+
+
+class Metric:
+    def __init__(self, registry, kind, name, help, buckets=None):
+        self.registry = registry
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self._values = {}  # sorted label items -> value
+        self._function = None
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self.registry.lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, value, **labels):
+        with self.registry.lock:
+            self._values[_label_key(labels)] = value
+
+    def set_function(self, function):
+        """Gauge read at snapshot time; ``function`` returns a number or None"""
+        self._function = function
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self.registry.lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = {'buckets': [0] * len(self.buckets), 'sum': 0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry['buckets'][i] += 1
+            entry['sum'] += value
+            entry['count'] += 1
+
+    def snapshot(self):
+        if self._function is not None:
+            try:
+                value = self._function()
+            except Exception:
+                value = None
+            if value is not None:
+                self.set(value)
+        with self.registry.lock:
+            samples = [[dict(key), json.loads(json.dumps(value))] for key, value in self._values.items()]
+        return {'kind': self.kind, 'help': self.help, 'buckets': self.buckets, 'samples': samples}
+
+
+class Registry:
+    """Process-local metrics, shared with sibling processes through METRICS_DIR"""
+
+    def __init__(self, directory=None, flush_interval=5, retention=86400):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.retention = retention  # how long files of exited processes keep counting
+        self.lock = threading.Lock()
+        self._metrics = {}
+        self._flusher = None
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            atexit.register(self.flush)
+
+    def counter(self, name, help):
+        return self._register('counter', name, help)
+
+    def gauge(self, name, help):
+        return self._register('gauge', name, help)
+
+    def histogram(self, name, help, buckets=PHASE_BUCKETS):
+        return self._register('histogram', name, help, buckets)
+
+    def _register(self, kind, name, help, buckets=None):
+        if name not in self._metrics:
+            self._metrics[name] = Metric(self, kind, name, help, buckets)
+        return self._metrics[name]
+
+    def snapshot(self):
+        return {name: metric.snapshot() for name, metric in self._metrics.items()}
+
+    def start(self):
+        """Flush this process's metrics every ``flush_interval`` seconds"""
+        if not self.directory or self._flusher is not None:
+            return
+        self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                log_event('metrics_flush_failed', level='error', error=str(e))
+
+    def flush(self):
+        if not self.directory:
+            return
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        data = json.dumps({'pid': os.getpid(), 'metrics': self.snapshot()})
+        with tempfile.NamedTemporaryFile('w', dir=self.directory, delete=False, suffix='.tmp') as f:
+            f.write(data)
+        os.replace(f.name, path)
+
+    def collect(self):
+        """Merged snapshot of every process on this host
+
+        Counters and histograms of exited processes keep counting (until
+        ``retention``) so totals never go backwards; their gauges are dropped.
+        """
+        if not self.directory:
+            return [(True, self.snapshot())]
+        self.flush()
+        snapshots = []
+        for entry in os.listdir(self.directory):
+            if not entry.endswith('.json'):
+                continue
+            path = os.path.join(self.directory, entry)
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            alive = pid_alive(data['pid'])
+            if not alive and time.time() - os.path.getmtime(path) > self.retention:
+                os.unlink(path)
+                continue
+            snapshots.append((alive, data['metrics']))
+        return snapshots
+
+    def render(self):
+        """The merged metrics in the Prometheus text exposition format"""
+        merged = {}
+        for alive, metrics in self.collect():
+            for name, metric in metrics.items():
+                if metric['kind'] == 'gauge' and not alive:
+                    continue
+                target = merged.setdefault(name, {'kind': metric['kind'], 'help': metric['help'],
+                                                  'buckets': metric['buckets'], 'samples': {}})
+                for labels, value in metric['samples']:
+                    key = _label_key(labels)
+                    if metric['kind'] == 'histogram':
+                        entry = target['samples'].setdefault(
+                            key, {'buckets': [0] * len(value['buckets']), 'sum': 0, 'count': 0})
+                        entry['buckets'] = [a + b for a, b in zip(entry['buckets'], value['buckets'])]
+                        entry['sum'] += value['sum']
+                        entry['count'] += value['count']
+                    else:
+                        target['samples'][key] = target['samples'].get(key, 0) + value
+
+        lines = []
+        for name in sorted(merged):
+            metric = merged[name]
+            lines.append(f"# HELP {name} {metric['help']}")
+            lines.append(f"# TYPE {name} {metric['kind']}")
+            for key, value in sorted(metric['samples'].items()):
+                labels = dict(key)
+                if metric['kind'] != 'histogram':
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+                    continue
+                for bound, count in zip(metric['buckets'], value['buckets']):
+                    lines.append(f"{name}_bucket{_format_labels(dict(labels, le=_format_value(bound)))} {count}")
+                lines.append(f"{name}_bucket{_format_labels(dict(labels, le='+Inf'))} {value['count']}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(value['sum'])}")
+                lines.append(f"{name}_count{_format_labels(labels)} {value['count']}")
+        return "\n".join(lines) + "\n"
+
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in sorted(labels.items())) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def serve(port, registry=None):
+    """Serve /metrics from a background thread (for processes without the web app)"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    source = registry or globals()['registry']
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = source.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('0.0.0.0', port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def registry_from_env():
+    """METRICS_DIR is shared by the processes on a host; "off" keeps metrics per process"""
+    directory = os.environ.get('METRICS_DIR') or os.path.join(tempfile.gettempdir(), 'instagram_monitor_metrics')
+    return Registry(None if directory == 'off' else directory,
+                    flush_interval=float(os.environ.get('METRICS_FLUSH_SECONDS', 5)))
+
+
+registry = registry_from_env()
+
+# Monitor metrics
+phase_seconds = registry.histogram(
+    'instagram_monitor_phase_seconds', 'Time spent in each scrape and ingest phase')
+scrapes_total = registry.counter(
+    'instagram_monitor_scrapes_total', 'Completed scrapes by result (story, no_story, error)')
+failures_total = registry.counter(
+    'instagram_monitor_failures_total', 'Monitor failures by phase and exception type')
+viewers_ingested_total = registry.counter(
+    'instagram_monitor_viewers_ingested_total', 'Story-viewer links added by ingests')
+likes_ingested_total = registry.counter(
+    'instagram_monitor_likes_ingested_total', 'Likes added by ingests')
+ingests_skipped_total = registry.counter(
+    'instagram_monitor_ingests_skipped_total', 'Ingests skipped because the snapshot was unchanged')
+ingest_statements = registry.histogram(
+    'instagram_monitor_ingest_statements', 'Database statements per ingest', buckets=STATEMENT_BUCKETS)
+active_monitors = registry.gauge(
+    'instagram_monitor_active_monitors', 'Monitors running in worker processes')
+browser_rss_mb = registry.gauge(
+    'instagram_monitor_browser_rss_mb', 'Resident memory of pooled browsers (MB)')
+browsers_open = registry.gauge(
+    'instagram_monitor_browsers_open', 'Browsers currently open in the pool')
+browser_tabs_open = registry.gauge(
+    'instagram_monitor_browser_tabs_open', "Tabs open in the DevTools engine's browsers")
+
+session_restores_total = registry.counter(
+    'instagram_monitor_session_restores_total',
+    'Browser checkouts by where the account session came from (memory, store, store_expired, none)')
+scrape_bytes = registry.histogram(
+    'instagram_monitor_scrape_bytes', 'Bytes downloaded by the browser per scrape', buckets=BYTE_BUCKETS)
+requests_blocked_total = registry.counter(
+    'instagram_monitor_requests_blocked_total', 'Browser requests refused by resource blocking, by category')
+bytes_saved_total = registry.counter(
+    'instagram_monitor_bytes_saved_total', 'Estimated bytes not downloaded thanks to resource blocking')
+
+ingest_queue_depth = registry.gauge(
+    'instagram_monitor_ingest_queue_depth', 'Snapshots waiting for an ingest writer')
+ingest_journal_pending = registry.gauge(
+    'instagram_monitor_ingest_journal_pending', 'Journaled snapshots not yet committed')
+ingest_batch_snapshots = registry.histogram(
+    'instagram_monitor_ingest_batch_snapshots', 'Snapshots per ingest transaction', buckets=BATCH_BUCKETS)
+ingest_backpressure_seconds_total = registry.counter(
+    'instagram_monitor_ingest_backpressure_seconds_total', 'Time scrapers spent blocked on a full ingest queue')
+ingest_dead_letters_total = registry.counter(
+    'instagram_monitor_ingest_dead_letters_total', 'Snapshots set aside after repeated ingest failures')
+
+outbound_wait_seconds = registry.histogram(
+    'instagram_monitor_outbound_wait_seconds', 'Time navigations queued for the outbound budget, by kind')
+outbound_requests_total = registry.counter(
+    'instagram_monitor_outbound_requests_total', 'Navigations admitted by the outbound budget, by kind')
+outbound_throttled_total = registry.counter(
+    'instagram_monitor_outbound_throttled_total', 'Navigations given up after waiting too long for the budget')
+outbound_backoffs_total = registry.counter(
+    'instagram_monitor_outbound_backoffs_total', 'Cooldowns applied to the outbound budget, by reason')
+
+audience_sync_seconds = registry.histogram(
+    'instagram_monitor_audience_sync_seconds', 'Time to build (build) or refresh (sync) an audience matrix')
+audience_stories_loaded_total = registry.counter(
+    'instagram_monitor_audience_stories_loaded_total', 'Story rows read into audience matrices')
+
+archive_segments_total = registry.counter(
+    'instagram_monitor_archive_segments_total', 'Archive segments written by story archival')
+archive_links_total = registry.counter(
+    'instagram_monitor_archive_links_total', 'Story-viewer rows moved from the hot table into archive segments')
+archive_bytes_total = registry.counter(
+    'instagram_monitor_archive_bytes_total', 'Compressed bytes of the archive segments written')
+
+# Database connection pools (db_pool.py), by process role and pool (primary, replica)
+db_pool_checkout_seconds = registry.histogram(
+    'instagram_monitor_db_pool_checkout_seconds', 'Time to get a pooled connection, queueing or connecting',
+    buckets=POOL_WAIT_BUCKETS)
+db_pool_checked_out = registry.gauge(
+    'instagram_monitor_db_pool_checked_out', 'Connections checked out of a pool')
+db_pool_overflow = registry.gauge(
+    'instagram_monitor_db_pool_overflow', 'Connections open beyond pool_size')
+db_pool_timeouts_total = registry.counter(
+    'instagram_monitor_db_pool_timeouts_total', 'Checkouts that gave up after pool_timeout')
+db_routed_views_total = registry.counter(
+    'instagram_monitor_db_routed_views_total', 'Read-only views served by the replica, or the primary after a write')
+db_replica_fallbacks_total = registry.counter(
+    'instagram_monitor_db_replica_fallbacks_total', 'Read-only views run on the primary instead, by reason')
+
+
+# Per-user view cache (cache.py)
+view_cache_requests_total = registry.counter(
+    'instagram_monitor_view_cache_requests_total', 'Cached view lookups by result (hit, shared_hit, miss)')
+view_cache_bumps_total = registry.counter(
+    'instagram_monitor_view_cache_bumps_total', 'Per-user cache invalidations after committed writes')
+
+
+# Live update streams (events.py, /api/v1/stream)
+live_streams_open = registry.gauge(
+    'instagram_monitor_live_streams_open', 'Server-Sent Events streams this process is serving')
+live_streams_rejected_total = registry.counter(
+    'instagram_monitor_live_streams_rejected_total', 'Streams refused at STREAM_MAX_CONNECTIONS')
+
+
+def record_traffic(traffic):
+    """Count one scrape's network traffic (see resource_blocking.py)"""
+    if not traffic:
+        return
+    scrape_bytes.observe(traffic['bytes'])
+    for category, count in traffic['blocked'].items():
+        requests_blocked_total.inc(count, category=category)
+    bytes_saved_total.inc(traffic['bytes_saved'])
+
+
+def record_failure(phase, error, **fields):
+    """Count a failure and log it with the monitor's context"""
+    failures_total.inc(phase=phase, type=type(error).__name__)
+    log_event(f'{phase}_failed', level='error', error=str(error), error_type=type(error).__name__, **fields)
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Monitor Worker for Instagram Story Monitor
+Claims monitoring jobs from the database and runs them in this process
+
+Run one or more of these next to the web app (on one node or many):
+    python worker.py
+
+Each worker holds a lease on the jobs it runs and renews it on every
+heartbeat. Jobs from a worker that dies are picked up by the others once
+their lease expires. Claimed accounts are checked on an adaptive schedule
+(see scheduling.py) by a thread pool as large as the browser pool, or with
+SCRAPER_ENGINE=cdp as asyncio tasks on one event loop driving browser tabs
+over DevTools (cdp.py), their page loads share the host's outbound budget (rate_limit.py), and their
+scrapes are written by the batching ingest pipeline (pipeline.py). Every
+WORKER_ARCHIVE_SECONDS a worker also moves old story history into the
+archive (archive.py).
+
+The scraper itself lives in monitor.py; the web app (app.py) never imports it.
+"""
+
+import os
+import random
+import signal
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+from sqlalchemy import or_, select, update
+
+from models import db, MonitorJob
+from cdp import LoopThread
+from monitor import (SCRAPER_ENGINE, app, browser_pool, cdp_pool, ingest_pipeline, new_monitor, outbound,
+                     poll_policy)
+from store import archive_due
+from scheduling import PollScheduler
+import telemetry
+from telemetry import log_event
+
+
+class MonitorWorker:
+    def __init__(self, worker_id, concurrency, lease_seconds, heartbeat_seconds, metrics_seconds=300,
+                 archive_seconds=3600):
+        self.worker_id = worker_id
+        self.concurrency = concurrency
+        self.lease_seconds = lease_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.metrics_seconds = metrics_seconds
+        self.archive_seconds = archive_seconds
+        self.monitors = {}  # job id -> InstagramMonitor (AsyncInstagramMonitor on the cdp engine)
+        self.scheduler = PollScheduler(poll_policy)
+        if SCRAPER_ENGINE == 'cdp':
+            # Checks are tasks on one loop; cdp_pool's tabs bound how many scrape at once
+            self.engine = LoopThread()
+            self.executor = None
+            self.running = set()  # futures of checks submitted to the loop
+        else:
+            self.engine = None
+            self.executor = ThreadPoolExecutor(max_workers=browser_pool.size)
+        self.stopping = threading.Event()
+
+    def run(self):
+        """Heartbeat, claim and dispatch due checks until asked to stop"""
+        log_event('worker_started', worker_id=self.worker_id, concurrency=self.concurrency)
+        if ingest_pipeline is not None:
+            ingest_pipeline.start()
+        next_heartbeat = next_metrics = time.monotonic()
+        # Workers started together should not all archive at once
+        next_archive = next_heartbeat + random.uniform(0, self.archive_seconds)
+        with app.app_context():
+            while not self.stopping.is_set():
+                now = time.monotonic()
+                if now >= next_heartbeat:
+                    try:
+                        self.heartbeat()
+                        self.claim()
+                    except Exception as e:
+                        telemetry.record_failure('worker_loop', e, worker_id=self.worker_id)
+                        db.session.rollback()
+                    next_heartbeat = now + self.heartbeat_seconds
+                if now >= next_metrics:
+                    log_event('worker_scheduler', worker_id=self.worker_id, **self.scheduler.metrics())
+                    if ingest_pipeline is not None:
+                        log_event('worker_ingest', worker_id=self.worker_id, depth=ingest_pipeline.depth,
+                                  **ingest_pipeline.stats)
+                    next_metrics = now + self.metrics_seconds
+                if self.archive_seconds and now >= next_archive:
+                    self.archive()
+                    next_archive = now + self.archive_seconds
+                self.dispatch()
+
+                # Checks finishing on the pool reschedule their account and wake the loop
+                wake = min(next_heartbeat, self.scheduler.next_due() or next_heartbeat)
+                self.scheduler.wait(max(0, wake - time.monotonic()))
+            self.shutdown()
+
+    def archive(self):
+        """Move stories older than ARCHIVE_AFTER_DAYS into archive segments"""
+        try:
+            segments, links = archive_due()
+        except Exception as e:
+            telemetry.record_failure('archive', e, worker_id=self.worker_id)
+            db.session.rollback()
+            return
+        if segments:
+            log_event('worker_archive', worker_id=self.worker_id, segments=segments, links=links)
+
+    def heartbeat(self):
+        """Renew leases on running jobs and stop any we no longer own"""
+        if not self.monitors:
+            return
+        now = datetime.utcnow()
+        job_ids = list(self.monitors)
+        db.session.execute(
+            update(MonitorJob)
+            .where(MonitorJob.id.in_(job_ids),
+                   MonitorJob.lease_owner == self.worker_id,
+                   MonitorJob.status == 'active')
+            .values(lease_expires_at=now + timedelta(seconds=self.lease_seconds), heartbeat_at=now)
+        )
+        db.session.commit()
+
+        owned = set(db.session.execute(
+            select(MonitorJob.id)
+            .where(MonitorJob.id.in_(job_ids),
+                   MonitorJob.lease_owner == self.worker_id,
+                   MonitorJob.status == 'active')
+        ).scalars())
+        for job_id in job_ids:
+            if job_id not in owned:
+                # Stopped by the user, or the lease was lost to another worker
+                self.stop(job_id)
+
+    def dispatch(self):
+        """Hand every due account to the scrape pool"""
+        for job_id in self.scheduler.pop_due():
+            monitor = self.monitors.get(job_id)
+            if not monitor:
+                continue
+            if self.engine is not None:
+                future = self.engine.submit(self._tick_async(job_id, monitor))
+                self.running.add(future)
+                future.add_done_callback(self.running.discard)
+            else:
+                self.executor.submit(self._tick, job_id, monitor)
+
+    def _tick(self, job_id, monitor):
+        with app.app_context():
+            try:
+                viewer_count = monitor.check()
+            except Exception as e:
+                self._retry(job_id, monitor, e)
+            else:
+                self.scheduler.complete(job_id, viewer_count, monitor.story_date)
+
+    async def _tick_async(self, job_id, monitor):
+        try:
+            viewer_count = await monitor.check()
+        except Exception as e:
+            self._retry(job_id, monitor, e)
+        else:
+            self.scheduler.complete(job_id, viewer_count, monitor.story_date)
+
+    def _retry(self, job_id, monitor, error):
+        # check() already counted and logged the failure
+        delay = self.scheduler.fail(job_id)
+        log_event('check_retry', level='warning', job_id=job_id, retry_in=delay,
+                  session_id=monitor.session_id, error_type=type(error).__name__)
+
+    def claim(self):
+        """Claim unowned or expired jobs up to the concurrency limit"""
+        free = self.concurrency - len(self.monitors)
+        if free <= 0:
+            return
+        now = datetime.utcnow()
+        claimable = (MonitorJob.status == 'active',
+                     or_(MonitorJob.lease_owner.is_(None), MonitorJob.lease_expires_at < now))
+        candidates = db.session.execute(
+            select(MonitorJob.id, MonitorJob.user_id, MonitorJob.instagram_username,
+                   MonitorJob.min_interval, MonitorJob.max_interval)
+            .where(*claimable, MonitorJob.id.notin_(list(self.monitors)))
+            .order_by(MonitorJob.id)
+            .limit(free)
+        ).all()
+
+        for job in candidates:
+            # Compare-and-set: only one worker can move the lease
+            result = db.session.execute(
+                update(MonitorJob)
+                .where(MonitorJob.id == job.id, *claimable)
+                .values(lease_owner=self.worker_id,
+                        lease_expires_at=now + timedelta(seconds=self.lease_seconds),
+                        heartbeat_at=now)
+            )
+            db.session.commit()
+            if result.rowcount == 1:
+                self.start(job)
+
+    def start(self, job):
+        monitor = new_monitor(job.user_id, job.instagram_username)
+        self.monitors[job.id] = monitor
+        # Jobs claimed together (a deploy, a worker taking over) spread out their first checks
+        self.scheduler.add(job.id, delay=outbound.start_delay(),
+                           min_interval=job.min_interval, max_interval=job.max_interval)
+        telemetry.active_monitors.set(len(self.monitors))
+        log_event('job_claimed', worker_id=self.worker_id, job_id=job.id, **monitor.log_fields())
+
+    def stop(self, job_id):
+        """Drop a job from this worker; a check already running finishes but is not rescheduled"""
+        self.scheduler.remove(job_id)
+        monitor = self.monitors.pop(job_id, None)
+        telemetry.active_monitors.set(len(self.monitors))
+        if monitor:
+            monitor.cleanup()
+            log_event('job_stopped', worker_id=self.worker_id, job_id=job_id, **monitor.log_fields())
+        self.release(job_id)
+
+    def release(self, job_id):
+        db.session.execute(
+            update(MonitorJob)
+            .where(MonitorJob.id == job_id, MonitorJob.lease_owner == self.worker_id)
+            .values(lease_owner=None, lease_expires_at=None)
+        )
+        db.session.commit()
+
+    def shutdown(self):
+        """Finish running checks and hand every job back for another worker"""
+        for job_id in list(self.monitors):
+            self.scheduler.remove(job_id)
+        if self.engine is not None:
+            wait(list(self.running))
+        else:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+        if ingest_pipeline is not None:
+            ingest_pipeline.stop()
+        for job_id in list(self.monitors):
+            try:
+                self.stop(job_id)
+            except Exception as e:
+                telemetry.record_failure('release', e, worker_id=self.worker_id, job_id=job_id)
+                db.session.rollback()
+        if self.engine is not None:
+            self.engine.submit(cdp_pool.close()).result()
+            self.engine.stop()
+        else:
+            browser_pool.close()
+        log_event('worker_stopped', worker_id=self.worker_id, **self.scheduler.metrics())
+
+
+def main():
+    worker = MonitorWorker(
+        worker_id=os.environ.get('WORKER_ID') or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}",
+        concurrency=int(os.environ.get('WORKER_CONCURRENCY', 4)),
+        lease_seconds=int(os.environ.get('WORKER_LEASE_SECONDS', 90)),
+        heartbeat_seconds=int(os.environ.get('WORKER_HEARTBEAT_SECONDS', 20)),
+        metrics_seconds=int(os.environ.get('WORKER_METRICS_SECONDS', 300)),
+        archive_seconds=int(os.environ.get('WORKER_ARCHIVE_SECONDS', 3600)),
+    )
+
+    def request_stop(signum, frame):
+        worker.stopping.set()
+        worker.scheduler.wake()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+    metrics_port = int(os.environ.get('WORKER_METRICS_PORT', 0))
+    if metrics_port:
+        # For workers on hosts without a web process to serve /metrics
+        telemetry.serve(metrics_port)
+    worker.run()
+
+
+if __name__ == '__main__':
+    main()